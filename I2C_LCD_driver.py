@@ -1,9 +1,13 @@
 # I2C_LCD_driver.py
 # 適用 20x4 I2C LCD（PCF8574 背包），位址 0x27
 
-import smbus
 import time
 
+try:
+    import smbus
+except ImportError:
+    smbus = None   # 沒裝 smbus 時仍可傳入其他 bus（例如 hal.py 的模擬器）
+
 # I2C 位址
 LCD_ADDR = 0x27
 
@@ -24,11 +28,27 @@ ENABLE = 0b00000100
 E_PULSE = 0.0005
 E_DELAY = 0.0005
 
+# 批次傳輸（fast path）
+# 100kHz I2C 每個 byte 約 90us，已大於 HD44780 的 E 脈衝寬度（>=450ns）與一般指令執行時間（37us），
+# 所以整串 byte 連續送出即可；只有 clear/home（1.52ms）需要額外等。
+I2C_BLOCK_MAX = 32          # SMBus block write 上限（不含 cmd byte）
+ITEM_BYTES = 6              # 每個 byte（高/低 nibble 各 3 個 byte）
+# 每次 block write 送幾個完整的字（30 byte = cmd byte + 29 資料）：切在字的邊界，
+# 中途失敗時 HD44780 不會停在只收到高 nibble 的狀態，之後的逐 byte 重送也能對齊
+ITEMS_PER_BLOCK = (I2C_BLOCK_MAX + 1) // ITEM_BYTES
+HD44780_CLEAR_DELAY = 0.002
+
 
 class lcd:
-    def __init__(self, addr=LCD_ADDR):
+    def __init__(self, addr=LCD_ADDR, bus=None):
+        """bus：smbus.SMBus 相容物件；省略時開 /dev/i2c-1"""
         self.addr = addr
-        self.bus = smbus.SMBus(1)
+        if bus is None:
+            if smbus is None:
+                raise RuntimeError("smbus not installed")
+            bus = smbus.SMBus(1)
+        self.bus = bus
+        self.block_ok = True    # write_i2c_block_data 失敗後改走逐 byte 路徑
         self.lcd_init()
 
     def lcd_init(self):
@@ -59,20 +79,60 @@ class lcd:
         self.bus.write_byte(self.addr, bits & ~ENABLE)
         time.sleep(E_DELAY)
 
+    def _nibble_bytes(self, bits, mode):
+        """一個 byte 拆成高/低 nibble，各自 [資料, 資料|E, 資料&~E]"""
+        out = []
+        for nib in (bits & 0xF0, (bits << 4) & 0xF0):
+            b = mode | nib | LCD_BACKLIGHT
+            out += (b, b | ENABLE, b & ~ENABLE)
+        return out
+
+    def lcd_write_seq(self, items):
+        """
+        fast path：把 [(bits, mode), ...] 組成完整的 nibble/enable byte 串，
+        用 write_i2c_block_data 批次送出（每次 ITEMS_PER_BLOCK 個字）；
+        不支援或失敗時，還沒送出的字改走逐 byte 的 lcd_write()。
+        """
+        items = list(items)
+        sent = 0
+        if self.block_ok:
+            try:
+                for sent in range(0, len(items), ITEMS_PER_BLOCK):
+                    data = []
+                    for bits, mode in items[sent:sent + ITEMS_PER_BLOCK]:
+                        data += self._nibble_bytes(bits, mode)
+                    self.bus.write_i2c_block_data(self.addr, data[0], data[1:])
+                return
+            except Exception as e:
+                print("⚠️ LCD block write failed, fallback to per-byte:", e)
+                self.block_ok = False
+
+        for bits, mode in items[sent:]:
+            self.lcd_write(bits, mode)
+
     def lcd_clear(self):
-        self.lcd_write(0x01, LCD_CMD)
-        time.sleep(E_DELAY)
+        self.lcd_write_seq([(0x01, LCD_CMD)])
+        time.sleep(HD44780_CLEAR_DELAY)
 
     def lcd_display_string(self, string, line):
         """line = 1~4"""
         if line == 1:
-            self.lcd_write(LCD_LINE_1, LCD_CMD)
+            items = [(LCD_LINE_1, LCD_CMD)]
         elif line == 2:
-            self.lcd_write(LCD_LINE_2, LCD_CMD)
+            items = [(LCD_LINE_2, LCD_CMD)]
         elif line == 3:
-            self.lcd_write(LCD_LINE_3, LCD_CMD)
+            items = [(LCD_LINE_3, LCD_CMD)]
         elif line == 4:
-            self.lcd_write(LCD_LINE_4, LCD_CMD)
-
-        for ch in string.ljust(LCD_WIDTH, " "):
-            self.lcd_write(ord(ch), LCD_CHR)
+            items = [(LCD_LINE_4, LCD_CMD)]
+        else:
+            items = []
+
+        items += [(ord(ch), LCD_CHR) for ch in string.ljust(LCD_WIDTH, " ")]
+        self.lcd_write_seq(items)
+
+    def lcd_display_string_pos(self, string, line, pos):
+        """line = 1~4, pos = 0~19；只從 pos 開始寫 string 的字元（不補空白）"""
+        base = (LCD_LINE_1, LCD_LINE_2, LCD_LINE_3, LCD_LINE_4)[line - 1]
+        items = [(base + pos, LCD_CMD)]
+        items += [(ord(ch), LCD_CHR) for ch in string[:LCD_WIDTH - pos]]
+        self.lcd_write_seq(items)
@@ -0,0 +1,569 @@
+# aggregator.py
+# -*- coding: utf-8 -*-
+"""
+場館排行榜彙整服務：多台機台把每個 Round 上傳到這裡，即時維護全場排行榜（不用再掃各台的歷史檔）。
+
+- 全域唯一 ID：gid = "<cabinet>-<seq>"。seq 是機台歷史紀錄的單調序號（寫在每筆紀錄裡，重開機接著編）；
+  round_id 每次行程重啟都從 1 開始，只用來顯示
+- 批次匯入：POST /ingest {"cabinet": "A1", "epoch": "...", "rounds": [...]}；每台只收 seq > 已收最大值的紀錄，
+  重送 / 斷線補傳造成的重複自動丟掉。epoch 是機台歷史紀錄的代號：換了（歷史被清掉、seq 從 1 重編）就把已收最大值歸零
+- 排行榜增量更新：每個榜是大小 K 的 min-heap（根 = 目前最後一名），每筆 O(log K)
+  榜：all（總榜）、mode:<g1>-<g2>（模式組合）、day:<YYYY-MM-DD>（每日，保留最近 AGG_DAYS_KEEP 天）、cabinet:<id>
+- 持久化：收到的紀錄 append 到 journal（JSONL，一批一次 fsync）；每 AGG_SNAPSHOT_S 秒把各榜 + 各機台進度
+  寫成 snapshot（含 journal 位移），重啟時載入 snapshot 再重播之後的 journal
+- 即時：GET /leaderboard?board=all&wait=<version> 會等到排行榜有變動（或逾時）才回（long-poll）
+
+機台端是本檔的 RoundUploader（game_config.json 設 aggregator_url 就會啟用）：
+Round 結束後背景上傳，連不上就累積、退避重試，恢復後從歷史紀錄補傳。
+
+用法：
+  python3 aggregator.py --port 5100 --data-dir ./aggregator_data --k 20
+  curl 'http://<host>:5100/leaderboard?board=mode:3-3&k=10'
+"""
+
+import argparse
+import heapq
+import json
+import os
+import signal
+import sys
+import threading
+import urllib.request
+from collections import deque
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+AGG_TOP_K = 20
+AGG_DAYS_KEEP = 7              # 每日榜保留幾天（snapshot 時清掉更舊的）
+AGG_FUTURE_DAYS = 1            # start_time 最多比伺服器日期晚幾天（機台時鐘差 / 時區），再晚就拒收
+AGG_SNAPSHOT_S = 30.0
+AGG_MAX_BODY = 1 << 20         # /ingest 單次 body 上限
+AGG_MAX_BATCH = 500
+AGG_WAIT_MAX_S = 25.0          # long-poll 最久等這麼久
+AGG_CABINET_MAX_LEN = 64
+
+# 排行榜保留的欄位（其餘丟掉，snapshot 才不會越長越大）
+ROUND_FIELDS = ("round_id", "session", "start_time", "game1_mode", "game2_mode",
+                "game1_score", "game2_score", "round_total_score")
+
+UPLOAD_BATCH_MAX = 100
+UPLOAD_QUEUE_MAX = 1000        # 記憶體裡最多排這麼多筆，超過就等恢復連線後從歷史紀錄補傳
+UPLOAD_TIMEOUT_S = 5.0
+UPLOAD_BACKOFF_S = (1.0, 60.0)
+
+
+def _write_json_atomic(path: str, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _day_window():
+    """每日榜接受的日期範圍 (最舊, 最新)，ISO 字串（可直接比大小）。"""
+    today = datetime.now().date()
+    return ((today - timedelta(days=AGG_DAYS_KEEP - 1)).isoformat(),
+            (today + timedelta(days=AGG_FUTURE_DAYS)).isoformat())
+
+
+def _record_day(r: dict):
+    """紀錄 start_time 的日期（YYYY-MM-DD）；沒有或格式不對回 None。"""
+    try:
+        return date.fromisoformat(str(r.get("start_time", ""))[:10]).isoformat()
+    except ValueError:
+        return None
+
+
+# =========================
+# 排行榜
+# =========================
+class TopK:
+    """大小 K 的排行榜：min-heap 以 (分數, -匯入順序) 排序，分數相同先匯入的排前面。"""
+
+    def __init__(self, k: int):
+        self.k = int(k)
+        self._heap = []            # (score, -order, rec)；(score, -order) 唯一，不會比到 rec
+
+    def offer(self, score: int, order: int, rec: dict) -> bool:
+        """可能進榜就放進去；回傳排行榜是否有變。"""
+        item = (int(score), -int(order), rec)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, item)
+            return True
+        if item[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, item)
+            return True
+        return False
+
+    def items(self, n: int = None):
+        out = [rec for _, _, rec in sorted(self._heap, key=lambda x: x[:2], reverse=True)]
+        return out[:n] if n is not None else out
+
+    def dump(self):
+        return [[s, -o, rec] for s, o, rec in self._heap]
+
+    @classmethod
+    def load(cls, k: int, items):
+        t = cls(k)
+        for score, order, rec in items:
+            t.offer(score, order, rec)
+        return t
+
+
+class Aggregator:
+    """各機台進度 + 各排行榜；所有狀態由 self._cond 保護。"""
+
+    def __init__(self, data_dir: str, k: int = AGG_TOP_K):
+        self.data_dir = data_dir
+        self.k = int(k)
+        self.journal_path = os.path.join(data_dir, "rounds.jsonl")
+        self.snapshot_path = os.path.join(data_dir, "snapshot.json")
+
+        self._cond = threading.Condition()
+        self.version = 0           # 任何排行榜變動就 +1（long-poll 用）
+        self._order = 0            # 匯入順序（同分排名用）
+        self.cabinets = {}         # id → {"high_seq", "epoch", "rounds", "best", "last_seen"}
+        self.boards = {}           # 名稱 → TopK
+        self.ingested = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self._journal = None
+        self._dirty = False
+        # snapshot 寫檔（同一個 .tmp）+ 換名整段序列化：_snapshot_loop 與 close() 可能同時寫
+        self._snap_lock = threading.Lock()
+
+    # ---------- 載入 / 持久化 ----------
+    def load(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        offset = 0
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                    snap = json.load(f)
+                offset = int(snap.get("journal_offset", 0))
+                self._order = int(snap.get("order", 0))
+                self.ingested = int(snap.get("ingested", 0))
+                self.cabinets = dict(snap.get("cabinets", {}))
+                self.boards = {name: TopK.load(self.k, items) for name, items in snap.get("boards", {}).items()}
+            except Exception as e:
+                print("⚠️ snapshot load error, rebuilding from journal:", e)
+                offset = 0
+                self._order, self.ingested, self.cabinets, self.boards = 0, 0, {}, {}
+
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue   # 斷電造成的半行
+                    self._apply(rec)
+                    replayed += 1
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        print(f"[AGG] loaded {len(self.cabinets)} cabinets, {self.ingested} rounds "
+              f"(replayed {replayed} from journal)")
+
+    def snapshot(self, force: bool = False):
+        """把目前狀態寫成 snapshot（沒變動就跳過）。"""
+        with self._snap_lock:
+            with self._cond:
+                if not (self._dirty or force) or self._journal is None:
+                    return False
+                self._prune_days()
+                self._journal.flush()
+                snap = {
+                    "journal_offset": self._journal.tell(),
+                    "order": self._order,
+                    "ingested": self.ingested,
+                    "cabinets": {c: dict(v) for c, v in self.cabinets.items()},
+                    "boards": {name: b.dump() for name, b in self.boards.items()},
+                    "saved_at": datetime.now().isoformat(timespec="seconds"),
+                }
+                self._dirty = False
+            _write_json_atomic(self.snapshot_path, snap)
+            return True
+
+    def close(self):
+        self.snapshot(force=True)
+        with self._cond:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def _prune_days(self):
+        oldest, newest = _day_window()
+        for name in [n for n in self.boards if n.startswith("day:") and not oldest <= n[4:] <= newest]:
+            del self.boards[name]
+
+    # ---------- 匯入 ----------
+    @staticmethod
+    def _normalize(cabinet: str, r: dict, epoch: str = ""):
+        """檢查並只留排行榜需要的欄位；不合法回 None。"""
+        try:
+            seq = int(r["seq"])
+            score = int(r["round_total_score"])
+        except (KeyError, TypeError, ValueError, OverflowError):
+            return None
+        if seq <= 0:
+            return None
+        day = _record_day(r)
+        if day is not None and day > _day_window()[1]:
+            return None   # 未來的日期：不讓任何人開出永遠清不掉的 day: 榜
+        rec = {k: r[k] for k in ROUND_FIELDS if k in r}
+        rec["round_total_score"] = score
+        rec["cabinet"] = cabinet
+        rec["seq"] = seq
+        rec["gid"] = f"{cabinet}-{seq}"
+        if epoch:
+            rec["epoch"] = epoch   # 寫進 journal，重播時才知道哪裡換過 epoch
+        return rec
+
+    @staticmethod
+    def _high_seq(cab: dict, epoch: str) -> int:
+        """這台在 epoch 下已收的最大 seq；epoch 換了（之前沒記 epoch 的舊機台不算）就從 0 算。"""
+        if epoch and cab.get("epoch") and cab["epoch"] != epoch:
+            return 0
+        return cab.get("high_seq", 0)
+
+    def _boards_for(self, rec: dict):
+        names = ["all", f"cabinet:{rec['cabinet']}"]
+        if "game1_mode" in rec and "game2_mode" in rec:
+            names.append(f"mode:{rec['game1_mode']}-{rec['game2_mode']}")
+        # 每日榜只收保留期間內的日期；更舊的（例如斷線很久才補傳）照樣進總榜 / 模式榜 / 機台榜
+        day = _record_day(rec)
+        if day is not None:
+            oldest, newest = _day_window()
+            if oldest <= day <= newest:
+                names.append(f"day:{day}")
+        return names
+
+    def _apply(self, rec: dict) -> bool:
+        # 呼叫端需持有 self._cond（load() 除外：那時還沒有別的 thread）
+        cab = self.cabinets.setdefault(rec["cabinet"], {"high_seq": 0, "rounds": 0, "best": 0, "last_seen": ""})
+        epoch = rec.get("epoch", "")
+        cab["high_seq"] = max(self._high_seq(cab, epoch), rec["seq"])
+        if epoch:
+            cab["epoch"] = epoch
+        cab["rounds"] += 1
+        cab["best"] = max(cab["best"], rec["round_total_score"])
+        self._order += 1
+        self.ingested += 1
+        changed = False
+        for name in self._boards_for(rec):
+            board = self.boards.get(name)
+            if board is None:
+                board = self.boards[name] = TopK(self.k)
+            changed |= board.offer(rec["round_total_score"], self._order, rec)
+        return changed
+
+    def ingest(self, cabinet: str, rounds, epoch: str = None):
+        """一批紀錄：去重 → 寫 journal（一次 fsync）→ 更新排行榜。回傳統計與這台目前已收到的最大 seq。"""
+        cabinet = str(cabinet or "").strip()
+        if not cabinet or len(cabinet) > AGG_CABINET_MAX_LEN:
+            raise ValueError("bad cabinet id")
+        epoch = str(epoch or "").strip()
+        if len(epoch) > AGG_CABINET_MAX_LEN:
+            raise ValueError("bad epoch")
+        if not isinstance(rounds, list) or len(rounds) > AGG_MAX_BATCH:
+            raise ValueError(f"rounds must be a list of at most {AGG_MAX_BATCH}")
+
+        recs, rejected = [], 0
+        for r in rounds:
+            rec = self._normalize(cabinet, r, epoch) if isinstance(r, dict) else None
+            if rec is None:
+                rejected += 1
+            else:
+                recs.append(rec)
+        recs.sort(key=lambda x: x["seq"])
+
+        with self._cond:
+            cab = self.cabinets.get(cabinet, {})
+            high = self._high_seq(cab, epoch)
+            if high < cab.get("high_seq", 0):
+                print(f"[AGG] cabinet {cabinet}: history epoch changed, seq restarts")
+            fresh = []
+            for rec in recs:
+                if rec["seq"] > high:
+                    fresh.append(rec)
+                    high = rec["seq"]
+            dup = len(recs) - len(fresh)
+            if fresh:
+                self._journal.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in fresh))
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+            changed = False
+            for rec in fresh:
+                changed |= self._apply(rec)
+            if fresh:
+                self.cabinets[cabinet]["last_seen"] = datetime.now().isoformat(timespec="seconds")
+                self._dirty = True
+            if changed:
+                self.version += 1
+                self._cond.notify_all()
+            self.duplicates += dup
+            self.rejected += rejected
+            return {"accepted": len(fresh), "duplicates": dup, "rejected": rejected, "high_seq": high}
+
+    # ---------- 查詢 ----------
+    def wait_change(self, version: int, timeout: float) -> int:
+        with self._cond:
+            if self.version == version:
+                self._cond.wait(timeout)
+            return self.version
+
+    def leaderboard(self, board: str = "all", k: int = None):
+        with self._cond:
+            b = self.boards.get(board)
+            return self.version, (b.items(k) if b is not None else [])
+
+    def board_names(self):
+        with self._cond:
+            return sorted(self.boards)
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                "version": self.version,
+                "ingested": self.ingested,
+                "duplicates": self.duplicates,
+                "rejected": self.rejected,
+                "cabinets": {c: dict(v) for c, v in self.cabinets.items()},
+            }
+
+
+# =========================
+# HTTP
+# =========================
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive（機台上傳、顯示看板輪詢都是長連線）
+    server_version = "basketball-aggregator"
+    agg = None                     # make_server() 設定
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, code: int, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if urlsplit(self.path).path != "/ingest":
+            return self._send(404, {"msg": "not found"})
+        n = int(self.headers.get("Content-Length") or 0)
+        if n <= 0 or n > AGG_MAX_BODY:
+            return self._send(413 if n > 0 else 400, {"msg": "bad body size"})
+        try:
+            req = json.loads(self.rfile.read(n))
+            res = self.agg.ingest(req.get("cabinet"), req.get("rounds"), req.get("epoch"))
+        except (ValueError, AttributeError) as e:
+            return self._send(400, {"msg": str(e)})
+        self._send(200, res)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        q = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        if parts.path == "/leaderboard":
+            board = q.get("board", "all")
+            if board == "today":
+                board = "day:" + datetime.now().date().isoformat()
+            try:
+                k = max(1, min(self.agg.k, int(q.get("k", self.agg.k))))
+                wait = int(q["wait"]) if "wait" in q else None
+            except ValueError:
+                return self._send(400, {"msg": "bad k / wait"})
+            if wait is not None:
+                self.agg.wait_change(wait, AGG_WAIT_MAX_S)
+            ver, items = self.agg.leaderboard(board, k)
+            return self._send(200, {"board": board, "version": ver, "items": items})
+        if parts.path == "/boards":
+            return self._send(200, {"items": self.agg.board_names()})
+        if parts.path == "/cabinets":
+            return self._send(200, self.agg.get_stats())
+        self._send(404, {"msg": "not found"})
+
+
+def make_server(agg: Aggregator, host: str, port: int):
+    handler = type("Handler", (_Handler,), {"agg": agg})
+    srv = ThreadingHTTPServer((host, port), handler)
+    srv.daemon_threads = True
+    return srv
+
+
+def _snapshot_loop(agg: Aggregator, stop: threading.Event, interval_s: float):
+    while not stop.wait(interval_s):
+        try:
+            agg.snapshot()
+        except Exception as e:
+            print("⚠️ snapshot failed:", e)
+
+
+# =========================
+# 機台端上傳
+# =========================
+class RoundUploader(threading.Thread):
+    """
+    機台端：Round 紀錄排進記憶體佇列，背景 thread 批次 POST 到 aggregator 的 /ingest。
+    - 已確認的 seq 存在 state_path，重開機後用 backlog(after_seq, limit) 從歷史紀錄補傳
+    - 失敗就保留、指數退避重試；佇列超過 UPLOAD_QUEUE_MAX 就不再排，恢復後一樣從歷史紀錄補
+    - epoch：歷史紀錄的代號，每批一起送；跟 state_path 記的不同（歷史被清掉重來）就從 seq 0 重傳
+    - 確認點只看自己送出、伺服器有回應的那批 seq，不拿伺服器的 high_seq 往前跳
+    """
+
+    def __init__(self, url: str, cabinet: str, state_path: str, backlog=None,
+                 batch_max: int = UPLOAD_BATCH_MAX, epoch: str = ""):
+        super().__init__(daemon=True)
+        self.url = url.rstrip("/") + "/ingest"
+        self.cabinet = str(cabinet)
+        self.state_path = state_path
+        self.backlog = backlog
+        self.batch_max = int(batch_max)
+        self.epoch = str(epoch or "")
+
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._rescan = True        # 啟動時先從歷史紀錄補傳
+        self._stopping = False
+
+        self.acked_seq = 0
+        self.sent = 0
+        self.errors = 0
+        self.last_error = ""
+        self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                st = json.load(f)
+            # 沒記 epoch 的舊狀態檔當作同一份歷史
+            if (st.get("url") == self.url and st.get("cabinet") == self.cabinet
+                    and st.get("epoch") in (None, self.epoch)):
+                self.acked_seq = int(st.get("acked_seq", 0))
+        except (OSError, ValueError):
+            pass
+
+    def _save_state(self):
+        try:
+            _write_json_atomic(self.state_path, {"url": self.url, "cabinet": self.cabinet, "epoch": self.epoch,
+                                                 "acked_seq": int(self.acked_seq)})
+        except OSError as e:
+            print("⚠️ upload state save error:", e)
+
+    def submit(self, entry: dict):
+        """Round 結束時呼叫（不阻塞）；entry 需已有 seq。"""
+        with self._cond:
+            if len(self._pending) < UPLOAD_QUEUE_MAX:
+                self._pending.append(entry)
+            else:
+                self._rescan = True
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                "acked_seq": int(self.acked_seq),
+                "pending": len(self._pending),
+                "sent": int(self.sent),
+                "errors": int(self.errors),
+                "last_error": str(self.last_error),
+            }
+
+    def _next_batch(self):
+        if self._rescan:
+            batch = self.backlog(self.acked_seq, self.batch_max) if self.backlog else []
+            if len(batch) < self.batch_max:
+                self._rescan = False
+            if batch:
+                return batch
+        with self._cond:
+            while self._pending and int(self._pending[0].get("seq", 0)) <= self.acked_seq:
+                self._pending.popleft()
+            return [e for _, e in zip(range(self.batch_max), self._pending)]
+
+    def _post(self, rounds):
+        body = json.dumps({"cabinet": self.cabinet, "epoch": self.epoch, "rounds": rounds},
+                          ensure_ascii=False).encode("utf-8")
+        req = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=UPLOAD_TIMEOUT_S) as resp:
+            return json.loads(resp.read())
+
+    def run(self):
+        backoff = 0.0
+        while True:
+            with self._cond:
+                if backoff > 0:
+                    self._cond.wait(backoff)
+                while not self._pending and not self._rescan and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    break
+            try:
+                batch = self._next_batch()
+                if not batch:
+                    continue
+                res = self._post(batch)
+            except Exception as e:
+                with self._cond:
+                    self.errors += 1
+                    self.last_error = str(e)
+                    self._rescan = self._rescan or len(self._pending) >= UPLOAD_QUEUE_MAX
+                backoff = min(UPLOAD_BACKOFF_S[1], max(UPLOAD_BACKOFF_S[0], backoff * 2))
+                continue
+            backoff = 0.0
+            with self._cond:
+                # 這批伺服器都處理過了（收下 / 重複 / 格式不合永久拒收），確認點往前推，不會卡在同一批一直重送
+                top = max(int(e.get("seq", 0)) for e in batch)
+                self.acked_seq = max(self.acked_seq, top)
+                self.sent += int(res.get("accepted", 0))
+                self.last_error = ""
+            self._save_state()
+
+
+# =========================
+# CLI
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description="場館排行榜彙整服務")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=5100)
+    ap.add_argument("--data-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "aggregator_data"))
+    ap.add_argument("--k", type=int, default=AGG_TOP_K, help="每個排行榜保留的名次數")
+    ap.add_argument("--snapshot-s", type=float, default=AGG_SNAPSHOT_S)
+    args = ap.parse_args()
+
+    agg = Aggregator(args.data_dir, args.k)
+    agg.load()
+    stop = threading.Event()
+    threading.Thread(target=_snapshot_loop, args=(agg, stop, args.snapshot_s), daemon=True).start()
+    srv = make_server(agg, args.host, args.port)
+    # systemd stop（SIGTERM）與 Ctrl-C 一樣：停止收連線、寫最後一份 snapshot
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=srv.shutdown, daemon=True).start())
+    print(f"[AGG] listening on {args.host}:{args.port} (top-{args.k}, data {args.data_dir})")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        srv.server_close()
+        agg.close()
+        print("[AGG] stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
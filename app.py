@@ -4,77 +4,299 @@ print("=== Flask app 啟動於此路徑 ===")
 import os
 print(os.path.abspath(__file__))
 
-from flask import Flask, render_template, jsonify, request
+import json
+import time
+import atexit
+import threading
+from datetime import date
+
+from flask import Flask, Response, render_template, jsonify, request, g
 from game_logic import (
+    init,
+    shutdown,
     start_game,
     stop_game,
     get_status,
+    get_status_body,
+    get_status_since,
+    get_status_debug,
+    get_metrics_text,
+    wait_state_change,
     set_sound_mode,
     set_mute,
     set_game_time,
     set_game_modes,
+    get_history_page,
+    get_history_top,
+    get_history_daily,
+    get_goal_traces,
+    get_waveform,
+    start_trace_recording,
+    stop_trace_recording,
+    set_auto_calibrate,
+    get_session,
+    list_sessions,
+    UnknownSessionError,
 )
+import metrics
+
+# SSE：沒有狀態變更時最多等這麼久就送一次（順便刷新 sensor debug 欄位 / 保持連線）
+SSE_REFRESH_S = 1.0
+# 每條 SSE 連線會一直佔住一個 worker thread；超過上限回 503，前端自動退回輪詢
+SSE_MAX_STREAMS = int(os.environ.get("BASKETBALL_SSE_MAX", "8"))
+_sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+# 硬體 / 背景 thread 在伺服器啟動前才初始化（__main__ / serve.py / gunicorn.conf.py），
+# import app 本身不碰硬體；init() 重複呼叫無作用，另一個行程已擁有硬體時會丟 RuntimeError
+atexit.register(shutdown)
 
 app = Flask(__name__)
 app.config["TEMPLATES_AUTO_RELOAD"] = True
 
+# handler 耗時與回應數（依 endpoint / 狀態碼；SSE 只算到開始串流為止）。多個 worker thread 會寫同一格，所以要 lock
+HTTP_BUCKETS = (1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 50e-3, 100e-3, 250e-3, 500e-3, 1.0, 2.5, 5.0)
+_http_hist = metrics.histogram("basketball_http_request_seconds", "HTTP handler time per endpoint",
+                               HTTP_BUCKETS, labelnames=("endpoint",), lock=True)
+_http_responses = metrics.counter("basketball_http_responses_total", "HTTP responses per endpoint and status code",
+                                  labelnames=("endpoint", "code"), lock=True)
+
+@app.before_request
+def start_request_timer():
+    g.t0 = time.perf_counter()
+
+@app.after_request
+def observe_request_time(resp):
+    t0 = g.get("t0")
+    if t0 is not None:
+        # endpoint 是 view 函式名稱（數量固定）；對不到路由的一律算 "unmatched"，避免 label 爆量
+        _http_hist.labels(request.endpoint or "unmatched").observe(time.perf_counter() - t0)
+    _http_responses.labels(request.endpoint or "unmatched", resp.status_code).inc()
+    return resp
+
 @app.after_request
 def add_no_cache_headers(resp):
     # 避免瀏覽器快取導致 UI/設定看起來「跳回預設值」
-    resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
+    # 帶 ETag 的回應（/status）允許存但每次都要重新驗證，才能用 If-None-Match 拿 304
+    if resp.headers.get("ETag"):
+        resp.headers["Cache-Control"] = "no-cache, must-revalidate, max-age=0"
+    else:
+        resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     resp.headers["Pragma"] = "no-cache"
     resp.headers["Expires"] = "0"
     return resp
 
+# 多機台：/s/<sid>/... 是指定 session 的同一組 API；不帶前綴的舊路徑作用在預設（第一個）session
+@app.errorhandler(UnknownSessionError)
+def unknown_session(e):
+    return jsonify({"msg": f"no session {e.args[0]}"}), 404
+
 @app.route("/")
-def index():
-    return render_template("index.html")
+@app.route("/s/<sid>/")
+def index(sid=None):
+    api_base = "" if sid is None else f"/s/{get_session(sid).id}"
+    return render_template("index.html", api_base=api_base)
+
+@app.route("/sessions")
+def sessions():
+    return jsonify({"items": list_sessions()})
 
 @app.route("/start")
-def start():
-    start_game()
+@app.route("/s/<sid>/start")
+def start(sid=None):
+    start_game(sid)
     return jsonify({"msg": "round started"})
 
 @app.route("/stop")
-def stop():
-    stop_game()
+@app.route("/s/<sid>/stop")
+def stop(sid=None):
+    stop_game(sid)
     return jsonify({"msg": "round stopped"})
 
 @app.route("/status")
-def status():
-    return jsonify(get_status())
+@app.route("/s/<sid>/status")
+def status(sid=None):
+    """
+    版本化狀態：
+    - ETag = 狀態版本；If-None-Match 相同 → 304（不重送 body）
+    - ?since=<version> → 只回之後變動的欄位 {"version", "full", "changed"}
+    """
+    since = request.args.get("since", type=int)
+    if since is not None:
+        ver, changed, full = get_status_since(since, sid)
+        return jsonify({"version": ver, "full": full, "changed": changed})
+
+    ver, body = get_status_body(sid)
+    if request.if_none_match.contains(str(ver)):
+        resp = Response(status=304)
+    else:
+        resp = Response(body, mimetype="application/json")
+    resp.set_etag(str(ver))
+    return resp
+
+@app.route("/status/debug")
+@app.route("/s/<sid>/status/debug")
+def status_debug(sid=None):
+    """量測值（電壓、取樣率、舵機 / LCD 計數…）：每次都會變，不放進 /status 的版本與 ETag。"""
+    return jsonify(get_status_debug(sid))
+
+@app.route("/events")
+@app.route("/s/<sid>/events")
+def events(sid=None):
+    """
+    Server-Sent Events：第一包 event:status 為完整狀態，
+    之後有變更（進球 / 倒數 / Round 開始結束 / 設定）才送出有變的欄位。
+    """
+    get_session(sid)   # session 不存在就在拿名額前回 404
+    if not _sse_slots.acquire(blocking=False):
+        return Response("too many event streams", status=503, headers={"Retry-After": "10"})
+
+    def stream():
+        seq = -1
+        last = None
+        while True:
+            seq = wait_state_change(seq, SSE_REFRESH_S)
+            st = get_status(sid)
+            st.pop("timestamp", None)
+            if last is None:
+                yield "event: status\ndata: " + json.dumps(st, ensure_ascii=False) + "\n\n"
+            else:
+                delta = {k: v for k, v in st.items() if last.get(k) != v}
+                if delta:
+                    yield "data: " + json.dumps(delta, ensure_ascii=False) + "\n\n"
+                else:
+                    yield ": keepalive\n\n"
+            last = st
+
+    try:
+        resp = Response(
+            stream(),
+            mimetype="text/event-stream",
+            headers={"X-Accel-Buffering": "no"},
+        )
+    except Exception:
+        _sse_slots.release()
+        raise
+    # 名額在 WSGI 伺服器 close() 回應時歸還：用戶端斷線、HEAD、第一包之前就斷線都會走到
+    # （generator 從沒開始跑的話 close() 不會執行它的 finally，所以不能放在 stream() 裡）
+    resp.call_on_close(_sse_slots.release)
+    return resp
+
+@app.route("/metrics")
+def metrics_text():
+    """Prometheus text format：取樣迴圈 / 進球延遲 / 舵機 / LCD / 蜂鳴器 / 鎖等待 / HTTP 耗時 + 既有統計。"""
+    return Response(get_metrics_text(), content_type=metrics.CONTENT_TYPE)
+
+@app.route("/history")
+def history():
+    limit = request.args.get("limit", default=20, type=int)
+    before = request.args.get("before", type=int)
+    items = get_history_page(limit, before)
+    next_before = items[-1]["id"] if items else None
+    return jsonify({"items": items, "next_before": next_before})
+
+def _day_arg():
+    """day=YYYY-MM-DD / today；格式不對丟 ValueError（呼叫端回 400）。"""
+    day = request.args.get("day")
+    if day == "today":
+        return date.today().isoformat()
+    return date.fromisoformat(day).isoformat() if day else None
+
+@app.route("/history/top")
+def history_top():
+    k = request.args.get("k", default=10, type=int)
+    g1 = request.args.get("game1", type=int)
+    g2 = request.args.get("game2", type=int)
+    try:
+        day = _day_arg()
+    except ValueError:
+        return jsonify({"msg": "invalid day (YYYY-MM-DD or today)"}), 400
+    return jsonify({"items": get_history_top(k, g1, g2, day)})
+
+@app.route("/history/daily")
+def history_daily():
+    days = request.args.get("days", default=7, type=int)
+    g1 = request.args.get("game1", type=int)
+    g2 = request.args.get("game2", type=int)
+    return jsonify({"items": get_history_daily(days, g1, g2)})
+
+@app.route("/goal_traces")
+def goal_traces():
+    n = request.args.get("n", default=5, type=int)
+    pre_ms = request.args.get("pre_ms", default=100.0, type=float)
+    post_ms = request.args.get("post_ms", default=100.0, type=float)
+    ch = request.args.get("ch", type=int)
+    try:
+        return jsonify({"events": get_goal_traces(n, pre_ms, post_ms, ch)})
+    except KeyError:
+        return jsonify({"msg": f"no hoop on channel {ch}"}), 400
+
+@app.route("/waveform")
+def waveform():
+    ms = request.args.get("ms", default=500.0, type=float)
+    ch = request.args.get("ch", type=int)
+    try:
+        return jsonify({"samples": get_waveform(ms, ch)})
+    except KeyError:
+        return jsonify({"msg": f"no hoop on channel {ch}"}), 400
+
+@app.route("/calib/on")
+def calib_on():
+    set_auto_calibrate(True)
+    return jsonify({"msg": "auto calibration on (applies before next game)"})
+
+@app.route("/calib/off")
+def calib_off():
+    set_auto_calibrate(False)
+    return jsonify({"msg": "auto calibration off"})
+
+@app.route("/trace/start")
+def trace_start():
+    start_trace_recording()
+    return jsonify({"msg": "trace recording started"})
+
+@app.route("/trace/stop")
+def trace_stop():
+    stop_trace_recording()
+    return jsonify({"msg": "trace recording stopped"})
 
 @app.route("/sound/<mode>")
-def sound(mode):
-    set_sound_mode(mode)
+@app.route("/s/<sid>/sound/<mode>")
+def sound(mode, sid=None):
+    set_sound_mode(mode, sid)
     return jsonify({"msg": f"sound mode set to {mode}"})
 
 @app.route("/mute")
-def mute():
-    set_mute(True)
+@app.route("/s/<sid>/mute")
+def mute(sid=None):
+    set_mute(True, sid)
     return jsonify({"msg": "muted"})
 
 @app.route("/unmute")
-def unmute():
-    set_mute(False)
+@app.route("/s/<sid>/unmute")
+def unmute(sid=None):
+    set_mute(False, sid)
     return jsonify({"msg": "unmuted"})
 
 @app.route("/set_time", methods=["GET"])
-def set_time():
+@app.route("/s/<sid>/set_time", methods=["GET"])
+def set_time(sid=None):
     seconds = request.args.get("seconds", type=int)
     if seconds is None:
         return jsonify({"msg": "invalid seconds"}), 400
-    set_game_time(seconds)
+    set_game_time(seconds, sid)
     return jsonify({"msg": f"game time set to {seconds} seconds"})
 
 @app.route("/set_modes", methods=["GET"])
-def set_modes():
+@app.route("/s/<sid>/set_modes", methods=["GET"])
+def set_modes(sid=None):
     g1 = request.args.get("game1", type=int)
     g2 = request.args.get("game2", type=int)
     if g1 is None or g2 is None:
         return jsonify({"msg": "missing game1/game2"}), 400
-    set_game_modes(g1, g2)
+    set_game_modes(g1, g2, sid)
     return jsonify({"msg": f"next round modes set: game1={g1}, game2={g2}"})
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    # 開發用；機台上請用 serve.py（waitress，固定大小的 thread pool）
+    init()
+    app.run(host="0.0.0.0", port=5000, threaded=True)  # SSE 連線各佔一個 thread
@@ -0,0 +1,430 @@
+# bench.py
+# -*- coding: utf-8 -*-
+"""
+game_logic 熱路徑基準測試：在一般 Linux 上用 hal 模擬器（BASKETBALL_HW=sim）跑，不需要樹莓派。
+所有檔案（歷史紀錄、設定、鎖）都寫在暫存目錄，不會動到機台上的資料。
+
+量測項目（--only 可挑）：
+  sampler ：HoopDetector.feed() 每秒能處理幾個樣本（純判定邏輯），GoalDetector 全速空轉時的掃描率（含模擬 SPI）
+  lcd     ：各種畫面變化的 I2C 交易數 / byte 數 / 寫入時間（block write 與逐 byte 兩種路徑）
+  status  ：get_status() 與快取 JSON body 的延遲 vs 歷史筆數
+  history ：save_round_history_entry() 呼叫端延遲、實際寫檔（含 fsync）每筆成本、啟動載入時間 vs 歷史筆數
+  game    ：play_single_game() 迴圈 thread 的 CPU 時間、迴圈次數，以及整個行程的 CPU
+
+用法：
+  python3 bench.py                                   # 全部，印摘要
+  python3 bench.py --json > bench_$(git rev-parse --short HEAD).json
+  python3 bench.py --only sampler,lcd --history-sizes 0,1000,10000
+  python3 bench.py --history-backend sqlite
+  python3 bench.py --json --baseline bench_old.json  # 與舊結果比較，退步超過 --tolerance 就 exit 1
+
+sampler / lcd 在 init() 前跑（沒有背景 thread 干擾）；status / history / game 在 init() 後跑，
+取樣 / 舵機 / LCD thread 都在背景運作，跟機台上的情況一樣。數字依機器而異，只跟同一台機器的舊結果比。
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SECTIONS = ("sampler", "lcd", "status", "history", "game")
+DEFAULT_HISTORY_SIZES = (0, 1000, 10000, 40000)
+
+FEED_SAMPLES = 200_000
+FEED_RATE_HZ = 2000.0
+SCAN_SECONDS = 2.0
+STATUS_REPS = 300
+HISTORY_APPENDS = 50
+LCD_REPS = 5
+GAME_SECONDS = 5
+GAME_PASS_RATE_HZ = 2.0
+
+
+def _percentile(sorted_vals, q):
+    if not sorted_vals:
+        return 0.0
+    i = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[i]
+
+
+def _latency_us(samples):
+    lat = sorted(samples)
+    return {
+        "p50_us": round(_percentile(lat, 0.50) * 1e6, 1),
+        "p99_us": round(_percentile(lat, 0.99) * 1e6, 1),
+        "max_us": round((lat[-1] if lat else 0.0) * 1e6, 1),
+    }
+
+
+def _git_rev():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() if out.returncode == 0 else ""
+    except Exception:
+        return ""
+
+
+# =========================
+# 環境：暫存目錄 + 模擬器
+# =========================
+def _prepare(tmp: str, history_backend: str):
+    """在 import game_logic 前設好模擬器，並把所有檔案路徑改到暫存目錄。"""
+    os.environ["BASKETBALL_HW"] = "sim"
+    os.environ.setdefault("BASKETBALL_SIM_PASS_RATE", str(GAME_PASS_RATE_HZ))
+    os.environ.setdefault("BASKETBALL_SIM_SEED", "1")
+    import game_logic as g
+    g.CONFIG_FILE = os.path.join(tmp, "game_config.json")
+    g.TRACE_DIR = os.path.join(tmp, "traces")
+    g.UPLOAD_STATE_FILE = os.path.join(tmp, "upload.json")
+    g.INSTANCE_LOCK_FILE = os.path.join(tmp, "bench.lock")
+    g.HISTORY_BACKEND = history_backend
+    _use_history_dir(g, os.path.join(tmp, "history-init"))
+    return g
+
+
+def _use_history_dir(g, d: str):
+    os.makedirs(d, exist_ok=True)
+    g.HISTORY_FILE = os.path.join(d, "score_history.json")
+    g.HISTORY_JSONL_FILE = os.path.join(d, "score_history.jsonl")
+    g.HISTORY_META_FILE = os.path.join(d, "score_history.meta.json")
+    g.HISTORY_DB_FILE = os.path.join(d, "score_history.db")
+
+
+def _fake_rounds(n: int, rng: random.Random):
+    t0 = datetime(2025, 1, 1, 10, 0, 0)
+    for i in range(n):
+        g1, g2 = rng.randint(0, 40), rng.randint(0, 40)
+        yield {
+            "round_id": i + 1,
+            "start_time": (t0 + timedelta(minutes=3 * i)).isoformat(timespec="seconds"),
+            "game1_mode": rng.randint(1, 3),
+            "game2_mode": rng.randint(1, 3),
+            "game1_score": g1,
+            "game2_score": g2,
+            "round_total_score": g1 + g2,
+            "session": "main",
+            "seq": i + 1,
+        }
+
+
+# =========================
+# sampler
+# =========================
+def bench_sampler(g):
+    import hal
+
+    # 1) 純判定：預先用模擬感測器產生波形，只計 HoopDetector.feed() 的時間
+    rng = random.Random(1)
+    sensor = hal.SimSensor(rng, pass_rate_hz=4.0, miss_ratio=0.2)
+    dt = 1.0 / FEED_RATE_HZ
+    ts = [i * dt for i in range(FEED_SAMPLES)]
+    vs = [sensor.voltage(t) for t in ts]
+    hoop = g.HoopDetector(0, g.GOAL_ENTRY_V, g.GOAL_RELEASE_V, g.GOAL_HOLDOFF_MS, g.GOAL_MIN_WIDTH_MS)
+    hoop.set_enabled(True)
+    feed = hoop.feed
+    t0 = time.perf_counter()
+    for t, v in zip(ts, vs):
+        feed(t, v)
+    elapsed = time.perf_counter() - t0
+
+    # 2) 完整取樣迴圈：模擬 SPI + 全速空轉（sample_rate_hz = 0），看一秒能掃幾輪
+    g._HW = hal.load_backend("sim")
+    g._spi = g._setup_spi()
+    det = g.GoalDetector([g.HoopDetector(0, g.GOAL_ENTRY_V, g.GOAL_RELEASE_V, g.GOAL_HOLDOFF_MS,
+                                         g.GOAL_MIN_WIDTH_MS)], sample_rate_hz=0.0)
+    det.start()
+    time.sleep(0.2)
+    s0, w0 = det.scans, time.perf_counter()
+    time.sleep(SCAN_SECONDS)
+    scans, wall = det.scans - s0, time.perf_counter() - w0
+    det.stop()
+    det.join(timeout=1.0)
+
+    return {
+        "feed_samples": FEED_SAMPLES,
+        "feed_per_s": round(FEED_SAMPLES / elapsed),
+        "feed_ns_per_sample": round(elapsed / FEED_SAMPLES * 1e9, 1),
+        "feed_goals": int(hoop.seq),
+        "feed_sim_goals": int(sensor.goals),
+        "scan_rate_hz": round(scans / wall, 1),
+        "scan_us": round(wall / scans * 1e6, 2) if scans else 0.0,
+    }
+
+
+# =========================
+# lcd
+# =========================
+def _lcd_frames():
+    """(名稱, 前一張, 這一張)：前一張 None = 畫面未知（開機 / 寫入失敗後整行重寫）。"""
+    game_a = ["2025-01-01 12:00:00", "ROUND 3 GAME 1", "MODE:2 LEFT:25s", "GAME SCORE: 9"]
+    game_b = ["2025-01-01 12:00:01", "ROUND 3 GAME 1", "MODE:2 LEFT:24s", "GAME SCORE: 9"]
+    game_c = ["2025-01-01 12:00:01", "ROUND 3 GAME 1", "MODE:2 LEFT:24s", "GAME SCORE: 10"]
+    return [
+        ("full_redraw", None, game_a),
+        ("countdown_tick", game_a, game_b),
+        ("goal", game_b, game_c),
+        ("no_change", game_c, game_c),
+        ("screen_change", game_c, ["NEXT GAME", "", "", ""]),
+    ]
+
+
+def bench_lcd(g):
+    import hal
+    g._HW = hal.load_backend("sim")
+    out = {}
+    for path in ("block", "per_byte"):
+        lcd = g.LCDManager(g.LCD_ADDR, "bench")
+        lcd._open_device()
+        if not lcd.available:
+            return {"error": "LCD driver not available"}
+        lcd._lcd.block_ok = (path == "block")
+        dev = g._HW.lcd_bus.device(g.LCD_ADDR)
+        res = {}
+        for name, before, after in _lcd_frames():
+            ops = nbytes = 0
+            times = []
+            for _ in range(LCD_REPS):
+                lcd._shadow = [None] * 4
+                if before is not None:
+                    lcd._draw([s.ljust(20) for s in before])
+                o0, b0 = dev.i2c_ops, dev.bytes_written
+                t0 = time.perf_counter()
+                lcd._draw([s.ljust(20) for s in after])
+                times.append(time.perf_counter() - t0)
+                ops, nbytes = dev.i2c_ops - o0, dev.bytes_written - b0
+            times.sort()
+            res[name] = {
+                "i2c_ops": ops,
+                "i2c_bytes": nbytes,
+                "write_ms": round(_percentile(times, 0.5) * 1000.0, 3),
+            }
+        out[path] = res
+    return out
+
+
+# =========================
+# status / history（init() 之後）
+# =========================
+def _load_store(g, d: str, n: int):
+    """在 d 寫 n 筆假紀錄，建立新的歷史紀錄引擎並換上；回傳載入時間（ms）。"""
+    _use_history_dir(g, d)
+    with open(g.HISTORY_JSONL_FILE, "w", encoding="utf-8") as f:
+        for rec in _fake_rounds(n, random.Random(n)):
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    t0 = time.perf_counter()
+    store = g._make_history_store()
+    store.start()
+    with store._lock:
+        store._ensure_loaded()
+    load_ms = (time.perf_counter() - t0) * 1000.0
+    g._history = store
+    return store, load_ms
+
+
+def bench_status(g, tmp: str, sizes):
+    out = {}
+    for n in sizes:
+        _load_store(g, os.path.join(tmp, f"status-{n}"), n)
+        g.get_status()
+        full, body = [], []
+        for _ in range(STATUS_REPS):
+            t0 = time.perf_counter()
+            g.get_status()
+            full.append(time.perf_counter() - t0)
+        for _ in range(STATUS_REPS):
+            t0 = time.perf_counter()
+            g.get_status_body()
+            body.append(time.perf_counter() - t0)
+        out[str(n)] = {"get_status": _latency_us(full), "status_body": _latency_us(body)}
+    return out
+
+
+def bench_history(g, tmp: str, sizes):
+    out = {}
+    rng = random.Random(7)
+    for n in sizes:
+        store, load_ms = _load_store(g, os.path.join(tmp, f"history-{n}"), n)
+        caller = []
+        t_all = time.perf_counter()
+        for rec in _fake_rounds(HISTORY_APPENDS, rng):
+            rec.pop("seq")
+            t0 = time.perf_counter()
+            g.save_round_history_entry(rec)
+            caller.append(time.perf_counter() - t0)
+        store.flush()
+        total = time.perf_counter() - t_all
+        out[str(n)] = {
+            "load_ms": round(load_ms, 2),
+            "save": _latency_us(caller),
+            "write_ms_per_entry": round(total / HISTORY_APPENDS * 1000.0, 3),
+        }
+    return out
+
+
+# =========================
+# game
+# =========================
+def bench_game(g):
+    sess = g.get_session()
+    sess.game_time = GAME_SECONDS
+    sess.running = True
+    posted0 = sess.lcd.frames_posted
+    c0, p0, w0 = time.thread_time(), time.process_time(), time.perf_counter()
+    try:
+        sess.play_single_game(1, 2)
+    finally:
+        sess.running = False
+    wall = time.perf_counter() - w0
+    cpu = time.thread_time() - c0
+    proc = time.process_time() - p0
+    return {
+        "seconds": round(wall, 2),
+        "loop_iterations": int(sess.lcd.frames_posted - posted0),
+        "goals": int(sess.game_score),
+        "loop_cpu_ms": round(cpu * 1000.0, 2),
+        "loop_cpu_pct": round(cpu / wall * 100.0, 3),
+        "process_cpu_pct": round(proc / wall * 100.0, 2),
+    }
+
+
+# =========================
+# 比較
+# =========================
+def _flatten(d, prefix=""):
+    for k, v in d.items():
+        key = f"{prefix}.{k}" if prefix else str(k)
+        if isinstance(v, dict):
+            yield from _flatten(v, key)
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            yield key, float(v)
+
+
+def _direction(key: str) -> int:
+    """+1 = 越大越好、-1 = 越小越好、0 = 不比（計數類）。"""
+    leaf = key.rsplit(".", 1)[-1]
+    if leaf == "max_us":
+        return 0       # 單次最大值太吵，不拿來判斷退步
+    if leaf.endswith("_per_s") or leaf.endswith("_hz"):
+        return 1
+    if leaf.endswith(("_us", "_ms", "_pct", "_ms_per_entry")) or leaf in ("i2c_ops", "i2c_bytes", "scan_us"):
+        return -1
+    return 0
+
+
+def compare(result: dict, baseline: dict, tolerance: float):
+    """回傳退步超過 tolerance（比例）的項目 [(key, 舊, 新, 變化比例)]。"""
+    old = dict(_flatten({k: v for k, v in baseline.items() if k != "meta"}))
+    worse = []
+    for key, new in _flatten({k: v for k, v in result.items() if k != "meta"}):
+        d = _direction(key)
+        if d == 0 or key not in old or old[key] <= 0:
+            continue
+        change = (new - old[key]) / old[key]
+        if change * d < -tolerance:
+            worse.append((key, old[key], new, round(change, 3)))
+    return worse
+
+
+def run(sections, history_sizes, history_backend):
+    tmp = tempfile.mkdtemp(prefix="basketball-bench-")
+    try:
+        g = _prepare(tmp, history_backend)
+        result = {
+            "meta": {
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "git": _git_rev(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "hw_backend": "sim",
+                "history_backend": history_backend,
+            },
+        }
+        if "sampler" in sections:
+            result["sampler"] = bench_sampler(g)
+        if "lcd" in sections:
+            result["lcd"] = bench_lcd(g)
+        if any(s in sections for s in ("status", "history", "game")):
+            stats = g.init()
+            result["meta"]["init_ms"] = stats["total_ms"]
+            try:
+                if "status" in sections:
+                    result["status"] = bench_status(g, tmp, history_sizes)
+                if "history" in sections:
+                    result["history"] = bench_history(g, tmp, history_sizes)
+                if "game" in sections:
+                    result["game"] = bench_game(g)
+            finally:
+                g.shutdown()
+        return result
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _print_summary(r):
+    if "sampler" in r:
+        s = r["sampler"]
+        print(f"sampler : feed {s['feed_per_s']:,}/s ({s['feed_ns_per_sample']} ns/sample, "
+              f"{s['feed_goals']}/{s['feed_sim_goals']} goals) | free-run scan {s['scan_rate_hz']} Hz")
+    if "lcd" in r and "error" not in r["lcd"]:
+        for path, res in r["lcd"].items():
+            cells = " ".join(f"{k}={v['i2c_ops']}ops/{v['write_ms']}ms" for k, v in res.items())
+            print(f"lcd {path:8s}: {cells}")
+    for n, s in r.get("status", {}).items():
+        print(f"status  : history={n:>6} get_status p50={s['get_status']['p50_us']}us "
+              f"p99={s['get_status']['p99_us']}us | body p50={s['status_body']['p50_us']}us")
+    for n, s in r.get("history", {}).items():
+        print(f"history : history={n:>6} load={s['load_ms']}ms save p99={s['save']['p99_us']}us "
+              f"write={s['write_ms_per_entry']}ms/entry")
+    if "game" in r:
+        s = r["game"]
+        print(f"game    : {s['seconds']}s, {s['loop_iterations']} iterations, {s['goals']} goals, "
+              f"loop cpu {s['loop_cpu_ms']}ms ({s['loop_cpu_pct']}%), process cpu {s['process_cpu_pct']}%")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="game_logic 熱路徑基準測試（模擬器）")
+    ap.add_argument("--only", default=",".join(SECTIONS), help="逗號分隔：" + ",".join(SECTIONS))
+    ap.add_argument("--history-sizes", default=",".join(str(n) for n in DEFAULT_HISTORY_SIZES))
+    ap.add_argument("--history-backend", choices=("jsonl", "sqlite"), default="jsonl")
+    ap.add_argument("--json", action="store_true")
+    ap.add_argument("--baseline", help="舊的 --json 結果；有退步就 exit 1")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="允許的退步比例（預設 0.25）")
+    args = ap.parse_args()
+
+    sections = [s.strip() for s in args.only.split(",") if s.strip()]
+    unknown = [s for s in sections if s not in SECTIONS]
+    if unknown:
+        ap.error(f"unknown section(s): {', '.join(unknown)}")
+    sizes = [int(x) for x in args.history_sizes.split(",") if x.strip()]
+
+    # game_logic 的 log 改印到 stderr，stdout 只留結果（--json 可以直接導到檔案）
+    with contextlib.redirect_stdout(sys.stderr):
+        r = run(sections, sizes, args.history_backend)
+    if args.json:
+        print(json.dumps(r, ensure_ascii=False))
+    else:
+        _print_summary(r)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            worse = compare(r, json.load(f), args.tolerance)
+        for key, old, new, change in worse:
+            print(f"⚠️ regression {key}: {old} → {new} ({change:+.0%})", file=sys.stderr)
+        return 1 if worse else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
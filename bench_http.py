@@ -0,0 +1,122 @@
+# bench_http.py
+# -*- coding: utf-8 -*-
+"""
+/status 壓測：N 個用戶端 thread，各自一條 keep-alive 連線連續打，統計 req/s 與延遲百分位。
+只用標準庫，可以在另一台電腦上對機台跑，也可以在 Pi 本機跑（會吃掉一部分 CPU，數字會偏保守）。
+
+模式：
+  full   ：每次都拿完整 body（最差情況）
+  etag   ：帶 If-None-Match（平板輪詢的實際情況，大多回 304）
+  since  ：?since=<上次版本>（差量）
+
+用法：
+  python3 bench_http.py --url http://192.168.1.50:5000/status --clients 8 --seconds 20 --mode etag
+  python3 bench_http.py --url ... --json     # 輸出 JSON（方便貼進紀錄）
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+import http.client
+from urllib.parse import urlsplit
+
+
+def _percentile(sorted_vals, q):
+    if not sorted_vals:
+        return 0.0
+    i = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[i]
+
+
+def _client(url, mode, deadline, out, errors):
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+    etag = None
+    version = None
+    lat = []
+    codes = {}
+    while time.perf_counter() < deadline:
+        headers = {}
+        p = path
+        if mode == "etag" and etag:
+            headers["If-None-Match"] = etag
+        elif mode == "since" and version is not None:
+            p = f"{path}?since={version}"
+        t0 = time.perf_counter()
+        try:
+            conn.request("GET", p, headers=headers)
+            resp = conn.getresponse()
+            body = resp.read()
+        except Exception:
+            errors.append(1)
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+            continue
+        lat.append(time.perf_counter() - t0)
+        codes[resp.status] = codes.get(resp.status, 0) + 1
+        if mode == "etag":
+            etag = resp.getheader("ETag") or etag
+        elif mode == "since" and resp.status == 200:
+            try:
+                version = json.loads(body)["version"]
+            except Exception:
+                pass
+    conn.close()
+    out.append((lat, codes))
+
+
+def run(url, clients, seconds, mode):
+    out, errors = [], []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=_client, args=(url, mode, deadline, out, errors))
+               for _ in range(clients)]
+    t0 = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    elapsed = time.perf_counter() - t0
+
+    lat = sorted(x for l, _ in out for x in l)
+    codes = {}
+    for _, c in out:
+        for k, v in c.items():
+            codes[str(k)] = codes.get(str(k), 0) + v
+    return {
+        "url": url,
+        "mode": mode,
+        "clients": clients,
+        "seconds": round(elapsed, 2),
+        "requests": len(lat),
+        "errors": len(errors),
+        "req_per_s": round(len(lat) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(_percentile(lat, 0.50) * 1000.0, 2),
+        "p99_ms": round(_percentile(lat, 0.99) * 1000.0, 2),
+        "max_ms": round((lat[-1] if lat else 0.0) * 1000.0, 2),
+        "status_codes": codes,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="/status req/s 與延遲壓測")
+    ap.add_argument("--url", default="http://127.0.0.1:5000/status")
+    ap.add_argument("--clients", type=int, default=8)
+    ap.add_argument("--seconds", type=float, default=20.0)
+    ap.add_argument("--mode", choices=("full", "etag", "since"), default="full")
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+
+    r = run(args.url, args.clients, args.seconds, args.mode)
+    if args.json:
+        print(json.dumps(r, ensure_ascii=False))
+    else:
+        print(f"{r['mode']} x{r['clients']}: {r['req_per_s']} req/s | p50={r['p50_ms']} ms "
+              f"p99={r['p99_ms']} ms max={r['max_ms']} ms | errors={r['errors']} codes={r['status_codes']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,15 +10,33 @@
 2) Mode2：45°~135° 等速來回（平滑：小步長 + 50Hz 更新）
 3) Mode3：30°~150° 隨機目標 + 隨機速度（不定速、更平滑、稍快）
 4) 開始/結束/STOP：回到 90°
-5) set_servo_angle：同 duty 不重複寫入，降低抖動與 CPU 壓力
+5) ServoController.set_angle：同 duty 不重複寫入，降低抖動與 CPU 壓力
+6) SG90 改由專屬 ServoController thread 固定 50Hz（deadline 排程）執行，
+   Mode2 角度表 / Mode3 目標速度段都預先算好，不受遊戲主迴圈、音效、LCD 影響
 """
 
 import os
+import math
 import time
 import json
 import threading
 import random
-from datetime import datetime
+import heapq
+import queue
+import signal
+import socket
+import sqlite3
+import tempfile
+import multiprocessing
+from array import array
+from collections import deque
+from datetime import datetime, timedelta
+from multiprocessing import shared_memory
+
+from goal_detect import GoalHysteresis
+from sensor_trace import TraceRecorder
+from aggregator import RoundUploader
+import metrics
 
 # -------------------------
 # 環境檢查（GPIO/SPI 常需 root）
@@ -30,45 +48,14 @@ except Exception:
     pass
 
 # -------------------------
-# GPIO / SPI
+# GPIO / SPI / I2C（hal.py；環境變數 BASKETBALL_HW = rpi / sim / dummy / auto）
 # -------------------------
-try:
-    import RPi.GPIO as GPIO
-    import spidev
-    _ON_RPI = True
-except Exception:
-    _ON_RPI = False
-
-    class _DummyGPIO:
-        BCM = 0
-        OUT = 0
-        IN = 0
-        LOW = 0
-        HIGH = 1
-        PUD_UP = 0
-
-        def setwarnings(self, *a, **k): pass
-        def setmode(self, *a, **k): pass
-        def setup(self, *a, **k): pass
-        def output(self, *a, **k): pass
-        def input(self, *a, **k): return 1
-        def PWM(self, *a, **k):
-            class _P:
-                def start(self, *a, **k): pass
-                def ChangeDutyCycle(self, *a, **k): pass
-                def stop(self, *a, **k): pass
-            return _P()
-
-    class _DummySPI:
-        def open(self, *a, **k): pass
-        def xfer2(self, x): return [0, 0, 0]
-        max_speed_hz = 0
-
-    GPIO = _DummyGPIO()
-    spidev = type("spidev", (), {"SpiDev": lambda: _DummySPI()})
-
-GPIO.setwarnings(False)
-GPIO.setmode(GPIO.BCM)
+import hal
+
+# init() 時才載入後端（import 本模組不碰硬體）
+_HW = None
+_ON_RPI = False
+GPIO = None
 
 # =========================
 # 常數 / 腳位
@@ -80,311 +67,731 @@ SERVO_MIN_ANGLE = 30.0
 SERVO_MAX_ANGLE = 150.0
 SERVO_CENTER_ANGLE = 90.0  # 你確認在 30~150 之間 90 度是安全中心
 
+# 舵機專屬 thread 的固定節拍
+SERVO_TICK_INTERVAL = 0.020   # 50Hz（與 50Hz PWM 同步，平滑又不抖）
+
 # Mode2：你指定 45~135 度等速來回
 MODE2_MIN_ANGLE = 45.0
 MODE2_MAX_ANGLE = 135.0
-MODE2_TICK_INTERVAL = 0.020   # 50Hz（與 50Hz PWM 同步，平滑又不抖）
 MODE2_SPEED_DPS = 110.0       # deg/sec（等速）
 
 # Mode3：30~150 不定速（隨機目標/隨機速度）
 MODE3_MIN_ANGLE = 30.0
 MODE3_MAX_ANGLE = 150.0
-MODE3_TICK_INTERVAL = 0.020   # 50Hz
+MODE3_SEGMENTS_AHEAD = 16     # 一次預先算好幾段（目標 + 速度）
 MODE3_SPEED_MIN_DPS = 120.0   # 稍快一點
 MODE3_SPEED_MAX_DPS = 170.0
 MODE3_TARGET_MARGIN_DEG = 1.0
 
 START_BUTTON_PIN = 17
+LCD_ADDR = 0x27
 
 # MCP3008 / IR 參數
 MCP3008_CHANNEL = 0
+# 同一個取樣 thread 要掃的籃框 channel（第一個是主籃框）；可在 game_config.json 用 hoop_channels 覆蓋
+MCP3008_CHANNELS = (MCP3008_CHANNEL,)
 GOAL_ENTRY_V = 2.00
 GOAL_RELEASE_V = 1.70
 GOAL_HOLDOFF_MS = 250
 GOAL_MIN_WIDTH_MS = 5.0
 
+# 自動校正：取樣 thread 持續以 EWMA 追蹤無球時的背景電壓（平均 / 標準差），
+# 每場 Game 開始前依背景重算 entry / release。GOAL_AUTO_CALIBRATE = False 時只統計不套用
+# （/status 仍會顯示建議值）；可在 game_config.json 用 auto_calibrate 覆蓋
+GOAL_AUTO_CALIBRATE = False
+CALIB_TAU_S = 60.0             # EWMA 時間常數（環境光漂移是分鐘~小時級）
+CALIB_DECIMATE = 16            # 每 N 個樣本取 1 個更新統計（不平均，避免低估雜訊）
+CALIB_WARMUP_S = 10.0          # 統計至少累積這麼久才會套用
+CALIB_ENTRY_SIGMA = 6.0        # entry = 背景 + max(6σ, 0.50V)
+CALIB_ENTRY_MARGIN_V = 0.50
+CALIB_RELEASE_SIGMA = 3.0      # release = 背景 + max(3σ, 0.25V)
+CALIB_RELEASE_MARGIN_V = 0.25
+CALIB_MIN_HYST_V = 0.15        # entry 與 release 至少差這麼多
+CALIB_ENTRY_MIN_V = 0.60       # entry 的合理範圍（超出就夾住）
+CALIB_ENTRY_MAX_V = 3.00
+CALIB_MAX_STD_V = 0.25         # 背景抖動超過這個（感測器被擋住 / 接觸不良）就不套用
+CALIB_PEAK_ALPHA = 0.2         # 進球峰值的 EWMA 係數
+
+# 原始波形 ring buffer（樣本數，取 2 的次方）與保留的進球事件數（給 /goal_traces）
+GOAL_RING_SIZE = 1 << 15
+GOAL_EVENT_HISTORY = 32
+
+# 取樣節拍：>0 時用 next_t += dt 固定速率取樣（同 test_pulse.py 的 PulseMeasurer），
+# 0 = 舊版全速空轉（sleep(0)）。可在 game_config.json 用 sample_rate_hz 覆蓋
+GOAL_SAMPLE_RATE_HZ = 2000.0
+# 取樣延遲統計：10us 一格、共 200 格（0~2ms），最後一格收超過的
+SAMPLE_JITTER_BUCKET_US = 10.0
+SAMPLE_JITTER_BUCKETS = 200
+# 取樣放在哪裡：game_config.json 的 sampler_mode
+#   "thread" ：與 Flask / 遊戲迴圈同一個行程的 thread（預設）
+#   "process"：獨立行程（自己的 GIL），經 shared memory 交換進球事件與波形；sampler_cpu >= 0 時釘在該核心
+SAMPLER_MODE = "thread"
+SAMPLER_CPU = -1
+SAMPLER_SYNC_S = 0.2           # 主行程多久同步一次背景統計（進球事件是即時叫醒，不受這個影響）
+SAMPLER_RESTART_S = 1.0        # 取樣行程意外結束後，等這麼久再重開
+# 原始波形錄製（sensor_trace.py 的 .bbt 格式）；game_config.json 的 trace_record = true 時開機就錄
+TRACE_RECORD = False
+
 # LCD 節流
 LCD_FPS = 6.0
+# 差異更新：兩段變動之間隔幾個沒變的字以內就合併成一次寫入
+LCD_DIFF_MERGE_GAP = 1
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-HISTORY_FILE = os.path.join(BASE_DIR, "score_history.json")
+HISTORY_FILE = os.path.join(BASE_DIR, "score_history.json")          # 舊版（整包 array），首次啟動匯入
+HISTORY_JSONL_FILE = os.path.join(BASE_DIR, "score_history.jsonl")
+HISTORY_META_FILE = os.path.join(BASE_DIR, "score_history.meta.json")
+HISTORY_DB_FILE = os.path.join(BASE_DIR, "score_history.db")
+
+# 歷史紀錄引擎："jsonl"（預設）/ "sqlite"（排行榜查詢走索引）；可在 game_config.json 用 history_backend 覆蓋
+HISTORY_BACKEND = "jsonl"
 CONFIG_FILE = os.path.join(BASE_DIR, "game_config.json")
+TRACE_DIR = os.path.join(BASE_DIR, "traces")
+# 場館排行榜（aggregator.py）：game_config.json 設了 aggregator_url 才上傳；cabinet_id 預設主機名稱
+AGGREGATOR_URL = ""
+CABINET_ID = socket.gethostname()
+UPLOAD_STATE_FILE = os.path.join(BASE_DIR, "score_history.upload.json")
+# 一台機台只能有一個行程擁有硬體與遊戲 thread（多 worker / 重複啟動時由這個檔案鎖擋住）
+INSTANCE_LOCK_FILE = os.environ.get(
+    "BASKETBALL_LOCK_FILE", os.path.join(tempfile.gettempdir(), "basketball-game.lock"))
+
+# /status 用的歷史快取視窗（最近 N 筆留在記憶體）
+HISTORY_RECENT_WINDOW = 50
+# JSONL 輪替：active 檔超過這麼多行就搬去 .1，最多保留幾個舊檔
+HISTORY_ROTATE_LINES = 50_000
+HISTORY_ROTATE_KEEP = 5
+
+# =========================
+# 執行期指標（metrics.py；app.py 的 GET /metrics 輸出）
+# =========================
+# 格子在這裡一次配好；各 thread 在建構時取好自己的子指標，熱路徑只 observe()（單位：秒）
+METRIC_SAMPLER_LOOP_BUCKETS = (25e-6, 50e-6, 100e-6, 200e-6, 500e-6, 1e-3, 2e-3, 5e-3, 10e-3, 50e-3)
+METRIC_GOAL_LATENCY_BUCKETS = (1e-3, 5e-3, 10e-3, 25e-3, 50e-3, 100e-3, 250e-3, 500e-3, 1.0, 2.5)
+METRIC_SERVO_JITTER_BUCKETS = (100e-6, 250e-6, 500e-6, 1e-3, 2e-3, 5e-3, 10e-3, 20e-3, 50e-3)
+METRIC_LCD_FLUSH_BUCKETS = (100e-6, 500e-6, 1e-3, 5e-3, 10e-3, 25e-3, 50e-3, 100e-3, 250e-3, 1.0)
+METRIC_BUZZER_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.75, 1.0, 2.0)
+METRIC_LOCK_WAIT_BUCKETS = (1e-6, 10e-6, 100e-6, 1e-3, 10e-3, 100e-3, 1.0)
+
+SAMPLER_LOOP_HIST = metrics.histogram(
+    "basketball_sampler_loop_seconds", "ADC scan + goal detection time per sampler cycle",
+    METRIC_SAMPLER_LOOP_BUCKETS)
+GOAL_LATENCY_HIST = metrics.histogram(
+    "basketball_goal_latency_seconds", "Time from ball leaving the sensor to the goal being counted",
+    METRIC_GOAL_LATENCY_BUCKETS, labelnames=("session",))
+SERVO_JITTER_HIST = metrics.histogram(
+    "basketball_servo_tick_lateness_seconds", "Servo tick lateness versus its 50Hz deadline",
+    METRIC_SERVO_JITTER_BUCKETS, labelnames=("session",))
+LCD_FLUSH_HIST = metrics.histogram(
+    "basketball_lcd_flush_seconds", "Time to write one LCD frame (I2C diff update)",
+    METRIC_LCD_FLUSH_BUCKETS, labelnames=("session",))
+BUZZER_PATTERN_HIST = metrics.histogram(
+    "basketball_buzzer_pattern_seconds", "Wall time a buzzer pattern played (shorter when preempted)",
+    METRIC_BUZZER_BUCKETS, labelnames=("session", "pattern"))
+# 同一個 channel 可能同時有好幾個 HoopDetector（狀態頁的空取樣器、降級後換上的 thread 取樣…），各拿各的鎖
+# 卻寫同一個子指標，所以這個 family 要 lock=True（只在被擋到時才 observe，多一層鎖不在熱路徑上）
+LOCK_WAIT_HIST = metrics.histogram(
+    "basketball_lock_wait_seconds", "Time spent waiting to acquire a contended lock",
+    METRIC_LOCK_WAIT_BUCKETS, labelnames=("lock", "id"), lock=True)
 
 # =========================
 # LCD（20×4 I2C）
 # =========================
-class LCDManager:
-    def __init__(self):
+def _lcd_diff_runs(old: str, new: str, merge_gap: int):
+    """
+    找出一行中有變動的字元區段 [(start, end), ...]。
+    兩段之間只隔 merge_gap 個沒變的字就合併（重寫一個字與重設游標成本相同）。
+    """
+    runs = []
+    i, n = 0, len(new)
+    while i < n:
+        if old[i] == new[i]:
+            i += 1
+            continue
+        start = end = i
+        j = i
+        while j < n:
+            if old[j] != new[j]:
+                end = j + 1
+            elif j - end >= merge_gap:
+                break
+            j += 1
+        runs.append((start, end))
+        i = end
+    return runs
+
+class LCDManager(threading.Thread):
+    """
+    LCD render thread：只有這個 thread 碰 I2C 裝置，呼叫端 show() 只是丟畫面、不等待。
+    - latest-frame-wins：還沒畫的一般畫面會被新的蓋掉（計入 dropped）
+    - force=True 是優先權：不受 LCD_FPS 節流、不會被之後的一般畫面蓋掉（畫完再畫一般畫面）
+    - shadow framebuffer：只重寫有變的字元區段
+    """
+
+    def __init__(self, addr: int = LCD_ADDR, name: str = ""):
+        super().__init__(daemon=True)
+        self.addr = int(addr)
+        self.name = str(name)
+        self._m_flush = LCD_FLUSH_HIST.labels(self.name)
         self.available = False
-        self._lock = threading.Lock()
-        self._last_lines = ["", "", "", ""]
+        self._lcd = None
+        self._cond = threading.Condition()
+        self._forced = None        # 待畫的優先畫面
+        self._normal = None        # 待畫的一般畫面（只留最新）
+        self._last_lines = None
         self._last_flush_ts = 0.0
+        # shadow framebuffer：LCD 上實際顯示的內容；None 表示未知（啟動 / 寫入失敗後整行重寫）
+        self._shadow = [None, None, None, None]
+        self.chars_written = 0
+        self.cursor_moves = 0
+
+        self._stopping = False
+        self.open_ms = 0.0         # I2C LCD 初始化花的時間（在本 thread 內，不擋 init()）
+
+        self.frames_posted = 0
+        self.frames_drawn = 0
+        self.frames_dropped = 0
+        self._write_ms_last = 0.0
+        self._write_ms_sum = 0.0
+        self._write_ms_max = 0.0
+
+    def _open_device(self):
+        t0 = time.perf_counter()
         try:
+            if _HW.SMBus is None:
+                raise RuntimeError(f"no I2C bus on {_HW.name} backend")
             import I2C_LCD_driver
-            self._lcd = I2C_LCD_driver.lcd()
+            self._lcd = I2C_LCD_driver.lcd(addr=self.addr, bus=_HW.SMBus(1))
             self.available = True
         except Exception as e:
             print("⚠️ LCD driver not available, fallback to console:", e)
             self._lcd = None
             self.available = False
+        self.open_ms = (time.perf_counter() - t0) * 1000.0
 
     def show(self, l1="", l2="", l3="", l4="", force=False):
-        now = time.monotonic()
-        if not force and (now - self._last_flush_ts) < (1.0 / LCD_FPS):
-            return
-
         lines = [
             (l1 or "")[:20].ljust(20),
             (l2 or "")[:20].ljust(20),
             (l3 or "")[:20].ljust(20),
             (l4 or "")[:20].ljust(20),
         ]
-
-        with self._lock:
-            if not force and lines == self._last_lines:
-                return
-            self._last_lines = lines
-            self._last_flush_ts = now
-
-            if self.available:
-                try:
-                    for i, s in enumerate(lines, start=1):
-                        self._lcd.lcd_display_string(s, i)
-                except Exception as e:
-                    print("⚠️ LCD write error:", e)
+        with self._cond:
+            self.frames_posted += 1
+            if force:
+                if self._forced is not None:
+                    self.frames_dropped += 1
+                if self._normal is not None:
+                    self.frames_dropped += 1
+                    self._normal = None
+                self._forced = lines
             else:
-                print("[LCD]")
-                for s in lines:
-                    print(s)
+                if self._normal is not None:
+                    self.frames_dropped += 1
+                self._normal = lines
+            self._cond.notify()
+
+    def get_stats(self):
+        with self._cond:
+            drawn = self.frames_drawn
+            return {
+                "queue_depth": int(self._forced is not None) + int(self._normal is not None),
+                "posted": int(self.frames_posted),
+                "drawn": int(drawn),
+                "dropped": int(self.frames_dropped),
+                "write_ms_last": float(self._write_ms_last),
+                "write_ms_avg": (self._write_ms_sum / drawn) if drawn else 0.0,
+                "write_ms_max": float(self._write_ms_max),
+                "chars_written": int(self.chars_written),
+            }
 
-_lcdm = LCDManager()
+    def _take_frame(self):
+        """等到有畫面可畫；一般畫面要等 LCD_FPS 節流時間到。回傳 (lines, force)。"""
+        with self._cond:
+            while True:
+                if self._stopping:
+                    return None, False
+                if self._forced is not None:
+                    lines, self._forced = self._forced, None
+                    return lines, True
+                if self._normal is not None:
+                    wait_s = self._last_flush_ts + (1.0 / LCD_FPS) - time.monotonic()
+                    if wait_s <= 0:
+                        lines, self._normal = self._normal, None
+                        return lines, False
+                    self._cond.wait(wait_s)
+                else:
+                    self._cond.wait()
+
+    def _flush_line(self, row: int, s: str):
+        old = self._shadow[row]
+        if old is None:
+            self._lcd.lcd_display_string(s, row + 1)
+            self.cursor_moves += 1
+            self.chars_written += len(s)
+        else:
+            for start, end in _lcd_diff_runs(old, s, LCD_DIFF_MERGE_GAP):
+                self._lcd.lcd_display_string_pos(s[start:end], row + 1, start)
+                self.cursor_moves += 1
+                self.chars_written += end - start
+        self._shadow[row] = s
+
+    def _draw(self, lines):
+        t0 = time.perf_counter()
+        if self.available:
+            try:
+                for row, s in enumerate(lines):
+                    if s != self._shadow[row]:
+                        self._flush_line(row, s)
+            except Exception as e:
+                print("⚠️ LCD write error:", e)
+                self._shadow = [None, None, None, None]
+        else:
+            print(f"[LCD {self.name}]" if self.name else "[LCD]")
+            for s in lines:
+                print(s)
+        dt = time.perf_counter() - t0
+        self._m_flush.observe(dt)
+        ms = dt * 1000.0
+        with self._cond:
+            self.frames_drawn += 1
+            self._write_ms_last = ms
+            self._write_ms_sum += ms
+            if ms > self._write_ms_max:
+                self._write_ms_max = ms
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
 
-def lcd_show_4_lines(l1="", l2="", l3="", l4="", force=False):
-    _lcdm.show(l1, l2, l3, l4, force=force)
+    def run(self):
+        self._open_device()
+        while True:
+            lines, force = self._take_frame()
+            if lines is None:
+                break
+            if not force and lines == self._last_lines:
+                continue
+            self._last_lines = lines
+            self._last_flush_ts = time.monotonic()
+            self._draw(lines)
 
 # =========================
 # 蜂鳴器
 # =========================
-GPIO.setup(BUZZER_PIN, GPIO.OUT)
-GPIO.output(BUZZER_PIN, GPIO.LOW)
-
-SOUND_MODE = "beep"       # "beep" / "cheer"
-SOUND_ENABLED = True      # 靜音立即生效
-
-def _buzzer_on():
-    GPIO.output(BUZZER_PIN, GPIO.HIGH)
-
-def _buzzer_off():
-    GPIO.output(BUZZER_PIN, GPIO.LOW)
+# 音效樣式：on/off 秒數交錯（第 0 個是 on）
+BUZZER_PATTERNS = {
+    "beep":      [0.10, 0.10, 0.10, 0.10],
+    "cheer":     [0.05, 0.03, 0.05, 0.03, 0.05, 0.03, 0.05, 0.03, 0.10, 0.03],
+    "countdown": [0.10, 0.05],
+    "go":        [0.35, 0.05],
+}
+
+# 優先權：同級或更高可以打斷正在播的（例如新的進球音效切掉上一顆的尾巴）
+BUZZER_PRIO_CUE = 1
+BUZZER_PRIO_GOAL = 2
+BUZZER_QUEUE_MAX = 4
+
+class BuzzerEngine(threading.Thread):
+    """
+    非阻塞蜂鳴器：呼叫端只丟樣式名稱，實際 on/off 計時在這個 thread 做。
+    - 以 deadline 計時（不累積誤差），等待用 Condition，可被搶占 / 靜音立即喚醒
+    - play() 優先權 >= 目前播放中的 → 直接切掉目前樣式改播新的
+    - stop_all() 清空佇列並立刻關閉蜂鳴器（靜音用）
+    """
 
-def _short_beep():
-    if not SOUND_ENABLED:
-        return
-    _buzzer_on()
-    time.sleep(0.10)
-    _buzzer_off()
-    time.sleep(0.05)
+    def __init__(self, pin: int = BUZZER_PIN, name: str = ""):
+        super().__init__(daemon=True)
+        self.pin = int(pin)
+        self._m_pattern = {p: BUZZER_PATTERN_HIST.labels(name, p) for p in BUZZER_PATTERNS}
+        self.muted = False         # 靜音立即生效
+        self._cond = threading.Condition()
+        self._pending = []         # heap: (-priority, seq, name)
+        self._seq = 0
+        self._gen = 0              # 被搶占 / 靜音時 +1，播放中的樣式看到就收尾
+        self._current_prio = None
+        self._stopping = False
+
+    def open(self):
+        GPIO.setup(self.pin, GPIO.OUT)
+        GPIO.output(self.pin, GPIO.LOW)
+
+    def _on(self):
+        GPIO.output(self.pin, GPIO.HIGH)
+
+    def _off(self):
+        GPIO.output(self.pin, GPIO.LOW)
+
+    def play(self, name: str, priority: int = BUZZER_PRIO_CUE, preempt: bool = True):
+        if self.muted or name not in BUZZER_PATTERNS:
+            return
+        with self._cond:
+            if preempt and self._current_prio is not None and priority >= self._current_prio:
+                self._gen += 1
+            if len(self._pending) >= BUZZER_QUEUE_MAX:
+                self._pending.remove(max(self._pending))  # 佇列滿：丟掉優先權最低（同級取最後排進來）的那個
+                heapq.heapify(self._pending)
+            self._seq += 1
+            heapq.heappush(self._pending, (-int(priority), self._seq, name))
+            self._cond.notify_all()
+
+    def stop_all(self):
+        with self._cond:
+            self._pending.clear()
+            self._gen += 1
+            self._cond.notify_all()
+        self._off()
+
+    def _play_pattern(self, durations, gen: int):
+        deadline = time.monotonic()
+        for i, d in enumerate(durations):
+            if i % 2 == 0:
+                self._on()
+            else:
+                self._off()
+            deadline += d
+            with self._cond:
+                while self._gen == gen:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._gen != gen:
+                    return
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+        self.stop_all()
 
-def _long_beep():
-    if not SOUND_ENABLED:
-        return
-    _buzzer_on()
-    time.sleep(0.35)
-    _buzzer_off()
-    time.sleep(0.05)
-
-def play_goal_sound():
-    """依 SOUND_MODE 播放進球音效；可在遊戲中切換模式。"""
-    if not SOUND_ENABLED:
-        return
-    if SOUND_MODE == "beep":
-        for _ in range(2):
-            _buzzer_on(); time.sleep(0.10)
-            _buzzer_off(); time.sleep(0.10)
-    else:
-        pattern = [0.05, 0.05, 0.05, 0.05, 0.10]
-        for d in pattern:
-            _buzzer_on(); time.sleep(d)
-            _buzzer_off(); time.sleep(0.03)
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    break
+                neg_prio, _, name = heapq.heappop(self._pending)
+                self._current_prio = -neg_prio
+                gen = self._gen
+            t0 = time.monotonic()
+            try:
+                self._play_pattern(BUZZER_PATTERNS[name], gen)
+            except Exception as e:
+                print("⚠️ buzzer error:", e)
+            finally:
+                self._off()
+                self._m_pattern[name].observe(time.monotonic() - t0)
+                with self._cond:
+                    self._current_prio = None
 
 # =========================
 # SG90 舵機 & 模式控制（方法二：PWM 不歸零）
 # =========================
-GPIO.setup(SERVO_PIN, GPIO.OUT)
-servo_pwm = GPIO.PWM(SERVO_PIN, 50)  # 50Hz
-servo_pwm.start(0)
-
-_SERVO_LOCK = threading.Lock()
-
-CURRENT_GAME_MODE = 0
-servo_current_angle = SERVO_CENTER_ANGLE
-servo_last_update = 0.0
-servo_direction = 1
-
-# Mode 參數（每次 set_mode 更新）
-servo_tick_interval = MODE2_TICK_INTERVAL
-servo_step_deg = 2.0
-
-# Mode3 狀態
-servo_mode3_target_angle = SERVO_CENTER_ANGLE
-servo_mode3_speed_dps = MODE3_SPEED_MIN_DPS
-
-_last_servo_duty = None
-
-def set_servo_angle(angle: float, force: bool = False):
+def _build_mode2_table():
     """
-    限制角度在安全範圍，持續輸出 PWM（不歸 0）。
-    同 duty 不重複寫入，避免固定角度時一直刷新造成抖動加劇。
+    Mode2 一個完整來回的角度表（45→135→45），從 90 度往上走的位置開始。
+    回傳 (table, start_index)。
     """
-    global _last_servo_duty
-
-    a = max(SERVO_MIN_ANGLE, min(SERVO_MAX_ANGLE, float(angle)))
-    duty = 2.5 + (a / 180.0) * 10.0
-
-    with _SERVO_LOCK:
-        if (not force) and (_last_servo_duty is not None) and (abs(duty - _last_servo_duty) < 0.02):
-            return
-        servo_pwm.ChangeDutyCycle(duty)
-        _last_servo_duty = duty
-
-def _servo_reset_to_center():
-    """強制回到 90 度（初始化、STOP、每場結束都呼叫）"""
-    global servo_current_angle, servo_last_update, CURRENT_GAME_MODE, servo_direction
-    CURRENT_GAME_MODE = 1
-    servo_direction = 1
-    servo_current_angle = SERVO_CENTER_ANGLE
-    set_servo_angle(servo_current_angle, force=True)
-    servo_last_update = time.monotonic()
-
-def _mode3_pick_new_target():
-    global servo_mode3_target_angle, servo_mode3_speed_dps
-    servo_mode3_target_angle = random.uniform(MODE3_MIN_ANGLE, MODE3_MAX_ANGLE)
-    servo_mode3_speed_dps = random.uniform(MODE3_SPEED_MIN_DPS, MODE3_SPEED_MAX_DPS)
-
-def servo_set_mode(mode: int):
-    """
-    Mode1：固定 90°
-    Mode2：45°~135° 等速來回
-    Mode3：30°~150° 不定速（隨機目標 + 隨機速度）
-    """
-    global CURRENT_GAME_MODE
-    global servo_current_angle, servo_last_update, servo_direction
-    global servo_tick_interval, servo_step_deg
-    global servo_mode3_target_angle, servo_mode3_speed_dps
-
-    m = int(mode)
-    CURRENT_GAME_MODE = m
-
-    now = time.monotonic()  # ✅ 全面統一 monotonic
-
-    if m == 1:
-        servo_current_angle = SERVO_CENTER_ANGLE
-        servo_direction = 1
-        set_servo_angle(servo_current_angle, force=True)
-        servo_last_update = now
-        return
-
-    if m == 2:
-        servo_current_angle = SERVO_CENTER_ANGLE
-        servo_direction = 1
-        servo_tick_interval = MODE2_TICK_INTERVAL
-        servo_step_deg = MODE2_SPEED_DPS * MODE2_TICK_INTERVAL
-        set_servo_angle(servo_current_angle, force=True)
-        servo_last_update = now
-        return
-
-    if m == 3:
-        servo_current_angle = SERVO_CENTER_ANGLE
-        servo_direction = 1
-        servo_tick_interval = MODE3_TICK_INTERVAL
-        _mode3_pick_new_target()
-        set_servo_angle(servo_current_angle, force=True)
-        servo_last_update = now
-        return
-
-def servo_tick():
+    step = MODE2_SPEED_DPS * SERVO_TICK_INTERVAL
+    up = []
+    a = MODE2_MIN_ANGLE
+    while a < MODE2_MAX_ANGLE:
+        up.append(a)
+        a += step
+    up.append(MODE2_MAX_ANGLE)
+    down = up[-2:0:-1]
+    table = up + down
+    start = next(i for i, x in enumerate(up) if x >= SERVO_CENTER_ANGLE)
+    return table, start
+
+def _build_mode3_segments(start_angle: float, n: int):
     """
-    由遊戲主迴圈高頻呼叫。
-    ✅ 這裡只用 time.monotonic()，避免時間基準混用導致伺服器卡死。
+    Mode3 預先算 n 段：每段隨機目標 + 隨機速度，展開成每個 tick 的角度。
+    走到目標附近（MODE3_TARGET_MARGIN_DEG 或一步內）就直接到位再換下一段。
+    """
+    out = []
+    a = float(start_angle)
+    for _ in range(n):
+        target = random.uniform(MODE3_MIN_ANGLE, MODE3_MAX_ANGLE)
+        step = random.uniform(MODE3_SPEED_MIN_DPS, MODE3_SPEED_MAX_DPS) * SERVO_TICK_INTERVAL
+        while abs(target - a) > max(MODE3_TARGET_MARGIN_DEG, step):
+            a += step if target > a else -step
+            out.append(max(MODE3_MIN_ANGLE, min(MODE3_MAX_ANGLE, a)))
+        a = target
+        out.append(a)
+    return out
+
+# 抖動統計：0.25ms 一格、共 80 格（0~20ms），最後一格收超過的
+SERVO_JITTER_BUCKET_MS = 0.25
+SERVO_JITTER_BUCKETS = 80
+
+class ServoController(threading.Thread):
+    """
+    舵機專屬 thread：固定 50Hz、用 next_t += dt 的 deadline 排程（同 test_pulse.py）。
+    - Mode2：預先算好的來回角度表，循環播放
+    - Mode3：預先算好多段目標/速度，用完再往後補
+    - Mode1 / 回中心：不 tick，等下一次 set_mode
+    - 統計每個 tick 的延遲（jitter）與錯過的 deadline 數
     """
-    global servo_current_angle, servo_last_update, servo_direction
-    global servo_tick_interval, servo_step_deg
-    global servo_mode3_target_angle, servo_mode3_speed_dps
-
-    if CURRENT_GAME_MODE == 1:
-        return
-
-    now = time.monotonic()
-
-    # 防禦：理論上 monotonic 不倒退，但保留保護
-    if now < servo_last_update:
-        servo_last_update = now
-        return
-
-    if (now - servo_last_update) < servo_tick_interval:
-        return
-
-    servo_last_update = now
-
-    if CURRENT_GAME_MODE == 2:
-        min_a = MODE2_MIN_ANGLE
-        max_a = MODE2_MAX_ANGLE
-
-        servo_current_angle += servo_direction * servo_step_deg
-        if servo_current_angle >= max_a:
-            servo_current_angle = max_a
-            servo_direction = -1
-        elif servo_current_angle <= min_a:
-            servo_current_angle = min_a
-            servo_direction = 1
 
-        set_servo_angle(servo_current_angle)
-        return
+    def __init__(self, pin: int = SERVO_PIN, interval: float = SERVO_TICK_INTERVAL, name: str = ""):
+        super().__init__(daemon=True)
+        self.pin = int(pin)
+        self.interval = float(interval)
+        self.pwm = None            # open() 時建立（50Hz）
+        self.angle = SERVO_CENTER_ANGLE
+        self._last_duty = None
+        self._pwm_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._mode = 1
+        self._mode_gen = 0         # set_mode() 時 +1；tick 算好的角度只在同一代才寫出去
+        self._table = None
+        self._idx = 0
+
+        self._ticks = 0
+        self._missed = 0
+        self._jitter_sum_ms = 0.0
+        self._jitter_max_ms = 0.0
+        self._jitter_hist = [0] * SERVO_JITTER_BUCKETS
+        self._m_jitter = SERVO_JITTER_HIST.labels(name)
+
+    def open(self):
+        GPIO.setup(self.pin, GPIO.OUT)
+        self.pwm = GPIO.PWM(self.pin, 50)
+        self.pwm.start(0)
+
+    def close(self):
+        if self.pwm is not None:
+            self.pwm.stop()
+
+    def set_angle(self, angle: float, force: bool = False, gen: int = None):
+        """
+        限制角度在安全範圍，持續輸出 PWM（不歸 0）。
+        同 duty 不重複寫入，避免固定角度時一直刷新造成抖動加劇。
+        gen：tick 算角度時的模式世代；之後 set_mode() 換過模式（已寫了中心角度）就不寫，避免舊角度蓋掉 90 度。
+        """
+        a = max(SERVO_MIN_ANGLE, min(SERVO_MAX_ANGLE, float(angle)))
+        duty = 2.5 + (a / 180.0) * 10.0
+
+        with self._pwm_lock:
+            if gen is not None and gen != self._mode_gen:
+                return
+            self.angle = a
+            if self.pwm is None:
+                return   # open() 失敗（init 的 servo 階段）：只記角度
+            if (not force) and (self._last_duty is not None) and (abs(duty - self._last_duty) < 0.02):
+                return
+            self.pwm.ChangeDutyCycle(duty)
+            self._last_duty = duty
 
-    if CURRENT_GAME_MODE == 3:
-        # 不定速：朝 target 走，走到就換新 target + 新速度
-        step = servo_mode3_speed_dps * servo_tick_interval
-        diff = servo_mode3_target_angle - servo_current_angle
+    def set_mode(self, mode: int):
+        m = int(mode)
+        with self._lock:
+            self._mode = m
+            self._mode_gen += 1
+            if m == 2:
+                self._table, self._idx = _build_mode2_table()
+            elif m == 3:
+                self._table = _build_mode3_segments(SERVO_CENTER_ANGLE, MODE3_SEGMENTS_AHEAD)
+                self._idx = 0
+            else:
+                self._table = None
+                self._idx = 0
+        self.set_angle(SERVO_CENTER_ANGLE, force=True)
+        self._wake.set()
+
+    def _next_angle(self):
+        # 呼叫端需持有 self._lock
+        table = self._table
+        if self._idx >= len(table):
+            if self._mode == 3:
+                self._table = table = _build_mode3_segments(table[-1], MODE3_SEGMENTS_AHEAD)
+            self._idx = 0
+        a = table[self._idx]
+        self._idx += 1
+        return a
+
+    def _record(self, late_s: float):
+        self._m_jitter.observe(max(0.0, late_s))
+        ms = max(0.0, late_s * 1000.0)
+        self._ticks += 1
+        self._jitter_sum_ms += ms
+        if ms > self._jitter_max_ms:
+            self._jitter_max_ms = ms
+        b = min(SERVO_JITTER_BUCKETS - 1, int(ms / SERVO_JITTER_BUCKET_MS))
+        self._jitter_hist[b] += 1
+
+    def get_stats(self):
+        with self._lock:
+            n = self._ticks
+            hist = list(self._jitter_hist)
+            p99 = 0.0
+            if n:
+                need = n * 0.99
+                acc = 0
+                for i, c in enumerate(hist):
+                    acc += c
+                    if acc >= need:
+                        p99 = (i + 1) * SERVO_JITTER_BUCKET_MS
+                        break
+            return {
+                "rate_hz": 1.0 / self.interval,
+                "ticks": int(n),
+                "missed": int(self._missed),
+                "jitter_avg_ms": (self._jitter_sum_ms / n) if n else 0.0,
+                "jitter_p99_ms": float(p99),
+                "jitter_max_ms": float(self._jitter_max_ms),
+            }
 
-        if abs(diff) <= max(MODE3_TARGET_MARGIN_DEG, step):
-            servo_current_angle = servo_mode3_target_angle
-            set_servo_angle(servo_current_angle)
-            _mode3_pick_new_target()
-            return
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
 
-        servo_current_angle += (step if diff > 0 else -step)
-        servo_current_angle = max(MODE3_MIN_ANGLE, min(MODE3_MAX_ANGLE, servo_current_angle))
-        set_servo_angle(servo_current_angle)
-        return
+    def run(self):
+        dt = self.interval
+        next_t = time.perf_counter()
+        while not self._stopping:
+            with self._lock:
+                active = self._table is not None
+            if not active:
+                self._wake.wait()
+                self._wake.clear()
+                next_t = time.perf_counter()
+                continue
+
+            now = time.perf_counter()
+            late = now - next_t
+            with self._lock:
+                if self._table is None:
+                    continue
+                self._record(late)
+                if late > dt:
+                    # 落後超過一拍：記錄錯過的 deadline，重新對齊避免越積越慢
+                    self._missed += int(late / dt)
+                    next_t = now
+                angle = self._next_angle()
+                gen = self._mode_gen
+
+            try:
+                self.set_angle(angle, gen=gen)
+            except Exception as e:
+                print("⚠️ servo write error:", e)
+
+            next_t += dt
+            wait_s = next_t - time.perf_counter()
+            if wait_s > 0 and self._wake.wait(wait_s):
+                # set_mode() 叫醒：新模式從現在起重新計拍
+                self._wake.clear()
+                next_t = time.perf_counter()
 
 # =========================
 # MCP3008 / IR 讀取
 # =========================
 def _setup_spi():
     try:
-        spi_dev = spidev.SpiDev()
+        spi_dev = _HW.SpiDev()
         spi_dev.open(0, 0)
         spi_dev.max_speed_hz = 1_000_000
         return spi_dev
     except Exception as e:
         print("⚠️ SPI open failed:", e)
-        return spidev.SpiDev()  # dummy
+        return hal.DummySPI()
+
+_spi = None   # init() 時開啟
 
-_spi = _setup_spi()
+ADC_TO_V = 3.3 / 1023.0
 
 def read_adc_channel(ch: int) -> int:
     val = _spi.xfer2([1, (8 + ch) << 4, 0])
     return ((val[1] & 3) << 8) + val[2]
 
+def read_adc_channels(channels) -> list:
+    """
+    一次掃描多個 channel，回傳 raw 值 list。
+    MCP3008 每次轉換都要 CS 拉高再拉低才會開始下一次（CS 一直保持低會接著吐 LSB-first 與 0），
+    而 spidev 的一次 xfer2 整段都維持 CS，所以不能把多個 frame 串成一次傳輸；
+    這裡改成同一個 thread 內連續送，每個 channel 一次 xfer2。
+    """
+    xfer = _spi.xfer2
+    out = []
+    for ch in channels:
+        val = xfer([1, (8 + ch) << 4, 0])
+        out.append(((val[1] & 3) << 8) + val[2])
+    return out
+
 def read_ir_voltage() -> float:
     raw = read_adc_channel(MCP3008_CHANNEL)
-    return raw * 3.3 / 1023.0
+    return raw * ADC_TO_V
 
 # =========================
 # 設定 & 歷史紀錄
 # =========================
+def _parse_session_specs(items):
+    """
+    game_config.json 的 sessions 清單 → [{"id", "hoop_channel", "servo_pin", ...}, ...]。
+    id / channel / 腳位 / LCD 位址不能重複；設定欄位（game1_mode 等）可省略，用頂層設定。
+    不合法就丟 ValueError（整個清單不採用）。
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError("sessions must be a non-empty list")
+    specs, ids, channels, pins, addrs = [], set(), set(), set(), set()
+    for it in items:
+        sp = {
+            "id": str(it["id"]).strip(),
+            "hoop_channel": int(it["hoop_channel"]),
+            "servo_pin": int(it["servo_pin"]),
+            "buzzer_pin": int(it["buzzer_pin"]),
+            "button_pin": int(it["button_pin"]),
+            "lcd_addr": int(str(it.get("lcd_addr", LCD_ADDR)), 0),
+        }
+        if not sp["id"] or sp["id"] in ids:
+            raise ValueError(f"bad or duplicate session id {sp['id']!r}")
+        if not 0 <= sp["hoop_channel"] <= 7 or sp["hoop_channel"] in channels:
+            raise ValueError(f"session {sp['id']}: bad or duplicate hoop_channel")
+        own = {sp["servo_pin"], sp["buzzer_pin"], sp["button_pin"]}
+        if len(own) != 3 or own & pins:
+            raise ValueError(f"session {sp['id']}: GPIO pin used twice")
+        if sp["lcd_addr"] in addrs:
+            raise ValueError(f"session {sp['id']}: duplicate lcd_addr")
+        for k in ("game1_mode", "game2_mode"):
+            if k in it and int(it[k]) in (1, 2, 3):
+                sp[k] = int(it[k])
+        if "game_time" in it:
+            sp["game_time"] = max(3, min(3600, int(it["game_time"])))
+        if it.get("sound_mode") in ("beep", "cheer"):
+            sp["sound_mode"] = it["sound_mode"]
+        ids.add(sp["id"])
+        channels.add(sp["hoop_channel"])
+        pins |= own
+        addrs.add(sp["lcd_addr"])
+        specs.append(sp)
+    return specs
+
+def _session_specs():
+    """沒設定 sessions 時：單一 "main"，用單機版的腳位 / channel。"""
+    if SESSION_SPECS is not None:
+        return SESSION_SPECS
+    return [{
+        "id": "main",
+        "hoop_channel": MCP3008_CHANNELS[0],
+        "servo_pin": SERVO_PIN,
+        "buzzer_pin": BUZZER_PIN,
+        "button_pin": START_BUTTON_PIN,
+        "lcd_addr": LCD_ADDR,
+    }]
+
+def _scan_channels(specs):
+    """取樣 thread 要掃的 channel：各 session 的籃框在前，hoop_channels 裡其餘的（額外籃框）接在後面。"""
+    own = [sp["hoop_channel"] for sp in specs]
+    return tuple(own + [c for c in MCP3008_CHANNELS if c not in own])
+
 def _load_config():
-    global GAME1_MODE, GAME2_MODE, GAME_TIME, SOUND_MODE
+    global GAME1_MODE, GAME2_MODE, GAME_TIME, SOUND_MODE, HISTORY_BACKEND, GOAL_SAMPLE_RATE_HZ
+    global MCP3008_CHANNELS, TRACE_RECORD, GOAL_AUTO_CALIBRATE, SESSION_SPECS
+    global AGGREGATOR_URL, CABINET_ID, SAMPLER_MODE, SAMPLER_CPU
     if not os.path.exists(CONFIG_FILE):
         return
     try:
@@ -394,6 +801,15 @@ def _load_config():
         g2 = int(cfg.get("game2_mode", GAME2_MODE))
         gt = int(cfg.get("game_time", GAME_TIME))
         sm = str(cfg.get("sound_mode", SOUND_MODE))
+        hb = str(cfg.get("history_backend", HISTORY_BACKEND))
+        sr = float(cfg.get("sample_rate_hz", GOAL_SAMPLE_RATE_HZ))
+        hc = [int(c) for c in cfg.get("hoop_channels", MCP3008_CHANNELS)]
+        tr = bool(cfg.get("trace_record", TRACE_RECORD))
+        ac = bool(cfg.get("auto_calibrate", GOAL_AUTO_CALIBRATE))
+        au = str(cfg.get("aggregator_url") or "").strip()
+        cid = str(cfg.get("cabinet_id") or CABINET_ID).strip()
+        spm = str(cfg.get("sampler_mode", SAMPLER_MODE))
+        spc = int(cfg.get("sampler_cpu", SAMPLER_CPU))
         if g1 in (1, 2, 3):
             GAME1_MODE = g1
         if g2 in (1, 2, 3):
@@ -401,23 +817,67 @@ def _load_config():
         GAME_TIME = max(3, min(3600, gt))
         if sm in ("beep", "cheer"):
             SOUND_MODE = sm
+        if hb in ("jsonl", "sqlite"):
+            HISTORY_BACKEND = hb
+        GOAL_SAMPLE_RATE_HZ = max(0.0, min(20000.0, sr))
+        if hc and len(set(hc)) == len(hc) and all(0 <= c <= 7 for c in hc):
+            MCP3008_CHANNELS = tuple(hc)
+        TRACE_RECORD = tr
+        GOAL_AUTO_CALIBRATE = ac
+        AGGREGATOR_URL = au
+        if cid:
+            CABINET_ID = cid[:64]
+        if spm in ("thread", "process"):
+            SAMPLER_MODE = spm
+        SAMPLER_CPU = max(-1, spc)
+        if "sessions" in cfg:
+            try:
+                SESSION_SPECS = _parse_session_specs(cfg["sessions"])
+                if "hoop_channels" not in cfg:
+                    # 沒另外指定就只掃各 session 的籃框（不要多掃預設的 channel 0）
+                    MCP3008_CHANNELS = tuple(sp["hoop_channel"] for sp in SESSION_SPECS)
+            except (KeyError, TypeError, AttributeError, ValueError) as e:
+                print("⚠️ config sessions ignored (single session):", e)
     except Exception as e:
         print("⚠️ config load error:", e)
 
+# 各 session 的平板可能同時改設定：組內容 + 寫檔整段排隊，後寫的一定是較新的快照
+_CONFIG_LOCK = threading.Lock()
+
 def _save_config():
+    # 頂層的遊戲設定 = 預設 session（單機版格式不變）；有 sessions 清單時各 session 的設定寫回清單
+    with _CONFIG_LOCK:
+        _save_config_locked()
+
+def _save_config_locked():
     try:
-        cfg = {
+        main = _sessions[0].settings() if _sessions else {
             "game1_mode": int(GAME1_MODE),
             "game2_mode": int(GAME2_MODE),
             "game_time": int(GAME_TIME),
             "sound_mode": str(SOUND_MODE),
         }
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(cfg, f, ensure_ascii=False, indent=2)
+        cfg = {
+            **main,
+            "history_backend": str(HISTORY_BACKEND),
+            "sample_rate_hz": float(GOAL_SAMPLE_RATE_HZ),
+            "sampler_mode": str(SAMPLER_MODE),
+            "sampler_cpu": int(SAMPLER_CPU),
+            "hoop_channels": list(MCP3008_CHANNELS),
+            "trace_record": bool(TRACE_RECORD),
+            "auto_calibrate": bool(GOAL_AUTO_CALIBRATE),
+            "cabinet_id": str(CABINET_ID),
+            "aggregator_url": str(AGGREGATOR_URL),
+        }
+        if SESSION_SPECS is not None:
+            cfg["sessions"] = [sess.spec() for sess in _sessions] or SESSION_SPECS
+        # 設定檔裡有整個場館的配置（sessions 腳位 / channel）：寫到一半斷電會讓下次開機退回單一 main，一定要原子寫入
+        _write_json_atomic(CONFIG_FILE, cfg)
     except Exception as e:
         print("⚠️ config save error:", e)
 
 def _load_history():
+    """讀舊版 score_history.json（整個 array）；只在第一次匯入 JSONL 時使用。"""
     if not os.path.exists(HISTORY_FILE):
         return []
     try:
@@ -427,28 +887,650 @@ def _load_history():
     except Exception:
         return []
 
-def _save_history_all(history_list):
+def _write_jsonl_atomic(path: str, records):
+    """先寫暫存檔 + fsync，再 os.replace，寫到一半斷電也不會毀掉原檔。"""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _write_json_atomic(path: str, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _entry_total_score(h) -> int:
     try:
-        with open(HISTORY_FILE, "w", encoding="utf-8") as f:
-            json.dump(history_list, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print("[HISTORY] save error:", e)
+        return int(h.get("round_total_score", 0))
+    except Exception:
+        return 0
+
+def _entry_seq(h) -> int:
+    """紀錄的單調序號；加入 seq 之前的舊紀錄為 0（不上傳）。"""
+    try:
+        return int(h.get("seq", 0))
+    except Exception:
+        return 0
+
+def _new_history_epoch() -> str:
+    return os.urandom(8).hex()
+
+def _jsonl_tail_seq(f, size: int, tail_bytes: int = 8192):
+    """JSONL 檔最後一筆有效紀錄的 seq（檔內 seq 遞增，所以就是最大值）；讀不到回 None（呼叫端就整檔掃）。"""
+    f.seek(max(0, size - tail_bytes))
+    lines = f.read(size - f.tell()).splitlines()
+    for line in reversed(lines[1:] if size > tail_bytes else lines):
+        try:
+            h = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(h, dict):
+            return _entry_seq(h)
+    return None
+
+class HistoryStore:
+    """
+    歷史紀錄（JSON Lines，一行一筆，append + fsync）。
+    - 第一次啟動：若只有舊版 score_history.json，整包匯入成 JSONL
+    - 載入時逐行讀，只保留最近 HISTORY_RECENT_WINDOW 筆與最高分在記憶體
+    - 壞行（斷電造成的半行）會在載入時觸發壓縮（重寫成只含有效行）
+    - 行數超過 HISTORY_ROTATE_LINES 就輪替成 .1/.2/...，最高分/筆數記在 meta 檔
+    - 寫檔交給背景 writer thread，Round End 畫面不會被 fsync 卡住
+    - append() 幫每筆蓋上單調遞增的 seq（寫在紀錄裡，重開機接著編；上傳場館排行榜用）
+    - epoch：這份歷史紀錄的代號（第一次載入時產生、記在 meta 檔）；歷史被清掉重來、seq 從 1 編起時會換一個
+    """
+
+    def __init__(self, path: str = None, meta_path: str = None, legacy_path: str = None):
+        self.path = path or HISTORY_JSONL_FILE
+        self.meta_path = meta_path or HISTORY_META_FILE
+        self.legacy_path = legacy_path or HISTORY_FILE
+
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._recent = deque(maxlen=HISTORY_RECENT_WINDOW)
+        self._best = 0
+        self.version = 0           # 每新增一筆 +1（/status 判斷 history 區塊是否要重送）
+        self._lines = 0            # 目前 active 檔的行數
+        self._archived_best = 0
+        self._archived_count = 0
+        self._archived_seq = 0     # 已輪替出去的紀錄中最大的 seq
+        self._seq = 0
+        self.epoch = ""
+
+        self._q = queue.Queue()
+        self._writer = None
+
+    # ---------- 載入 / 匯入 ----------
+    def _import_legacy(self):
+        if os.path.exists(self.path) or not os.path.exists(self.legacy_path):
+            return
+        legacy = _load_history()
+        try:
+            _write_jsonl_atomic(self.path, [h for h in legacy if isinstance(h, dict)])
+            print(f"[HISTORY] imported {len(legacy)} rounds from {os.path.basename(self.legacy_path)}")
+        except Exception as e:
+            print("[HISTORY] import error:", e)
+
+    def _load_meta(self):
+        if not os.path.exists(self.meta_path):
+            return
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self._archived_best = int(meta.get("archived_best", 0))
+            self._archived_count = int(meta.get("archived_count", 0))
+            self._archived_seq = int(meta.get("archived_seq", 0))
+            self.epoch = str(meta.get("epoch", ""))
+        except Exception as e:
+            print("[HISTORY] meta load error:", e)
+
+    def _save_meta_locked(self):
+        _write_json_atomic(self.meta_path, {
+            "archived_best": int(self._archived_best),
+            "archived_count": int(self._archived_count),
+            "archived_seq": int(self._archived_seq),
+            "epoch": str(self.epoch),
+        })
+
+    def _ensure_loaded(self):
+        # 呼叫端需持有 self._lock
+        if self._loaded:
+            return
+        self._loaded = True
+        self._import_legacy()
+        self._load_meta()
+        self._best = self._archived_best
+        self._seq = self._archived_seq
+        if not self.epoch:
+            self.epoch = _new_history_epoch()
+            try:
+                self._save_meta_locked()
+            except Exception as e:
+                print("[HISTORY] meta save error:", e)
+
+        if not os.path.exists(self.path):
+            return
+
+        bad = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        h = json.loads(line)
+                    except ValueError:
+                        bad += 1
+                        continue
+                    if not isinstance(h, dict):
+                        bad += 1
+                        continue
+                    self._lines += 1
+                    self._recent.append(h)
+                    self._best = max(self._best, _entry_total_score(h))
+                    self._seq = max(self._seq, _entry_seq(h))
+        except Exception as e:
+            print("[HISTORY] load error:", e)
+            return
+
+        if bad:
+            print(f"[HISTORY] {bad} broken line(s), compacting")
+            self._compact_locked()
+
+    # ---------- 壓縮 / 輪替 ----------
+    def _valid_records(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    h = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(h, dict):
+                    yield h
+
+    def _compact_locked(self):
+        try:
+            records = list(self._valid_records())
+            _write_jsonl_atomic(self.path, records)
+            self._lines = len(records)
+        except Exception as e:
+            print("[HISTORY] compact error:", e)
+
+    def compact(self):
+        """把 active 檔重寫成只含有效行（先把排隊中的寫入做完）。"""
+        self.flush()
+        with self._lock:
+            self._ensure_loaded()
+            if os.path.exists(self.path):
+                self._compact_locked()
+
+    def _rotate_locked(self):
+        try:
+            for i in range(HISTORY_ROTATE_KEEP - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+
+            self._archived_count += self._lines
+            self._archived_best = self._best
+            self._archived_seq = self._seq
+            self._lines = 0
+            self._save_meta_locked()
+            print(f"[HISTORY] rotated, archived_count={self._archived_count}")
+        except Exception as e:
+            print("[HISTORY] rotate error:", e)
+
+    # ---------- 寫入 ----------
+    def _append_to_disk(self, entry: dict):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._lines += 1
+            except Exception as e:
+                print("[HISTORY] save error:", e)
+                return
+            if self._lines >= HISTORY_ROTATE_LINES:
+                self._rotate_locked()
+
+    def _writer_loop(self):
+        while True:
+            entry = self._q.get()
+            try:
+                self._append_to_disk(entry)
+            finally:
+                self._q.task_done()
+
+    def start(self):
+        if self._writer is not None:
+            return
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+
+    def flush(self):
+        """等背景 writer 把排隊中的紀錄寫完。"""
+        if self._writer is not None:
+            self._q.join()
+
+    def append(self, entry: dict):
+        with self._lock:
+            self._ensure_loaded()
+            self._seq += 1
+            entry["seq"] = self._seq
+            self._recent.append(entry)
+            self._best = max(self._best, _entry_total_score(entry))
+            self.version += 1
+        if self._writer is not None:
+            self._q.put(entry)
+        else:
+            self._append_to_disk(entry)
+
+    def summary(self, max_recent: int = 10):
+        n = max(0, min(int(max_recent), HISTORY_RECENT_WINDOW))
+        with self._lock:
+            self._ensure_loaded()
+            recent = list(self._recent)[-n:] if n > 0 else []
+            return recent, self._best
+
+    def get_epoch(self) -> str:
+        with self._lock:
+            self._ensure_loaded()
+            return self.epoch
+
+    def records_after(self, seq: int, limit: int = 100):
+        """
+        seq 大於指定值的紀錄（舊到新，最多 limit 筆）；上傳補傳用。
+        聚合端斷線期間被輪替出去的場次也要補，所以從最舊的輪替檔（.N … .1）一路看到 active 檔。
+        鎖只拿來開檔（之後輪替改名也不影響已開的檔）並記下 active 檔目前的長度，讀檔在鎖外，
+        /status 與寫檔不會被卡住；最後一筆 seq 不大於 seq 的輪替檔直接略過，全部已上傳時不讀檔。
+        """
+        seq = int(seq)
+        self.flush()
+        with self._lock:
+            self._ensure_loaded()
+            if seq >= self._seq:
+                return []
+            files = []
+            for path in [f"{self.path}.{i}" for i in range(HISTORY_ROTATE_KEEP, 0, -1)] + [self.path]:
+                try:
+                    f = open(path, "rb")
+                except FileNotFoundError:
+                    continue
+                files.append((f, os.fstat(f.fileno()).st_size))
+        out = []
+        try:
+            for f, size in files:
+                if len(out) >= int(limit):
+                    break
+                if f is not files[-1][0]:
+                    tail = _jsonl_tail_seq(f, size)
+                    if tail is not None and tail <= seq:
+                        continue
+                f.seek(0)
+                pos = 0
+                for line in f:
+                    pos += len(line)
+                    if pos > size:
+                        break   # 開檔之後才 append 的行留給下一次
+                    try:
+                        h = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(h, dict) and _entry_seq(h) > seq:
+                        out.append(h)
+                        if len(out) >= int(limit):
+                            break
+        finally:
+            for f, _ in files:
+                f.close()
+        return out
+
+    # ---------- 查詢（JSONL 只能掃 active 檔；大量資料請改用 sqlite） ----------
+    def _scan(self):
+        self.flush()
+        with self._lock:
+            self._ensure_loaded()
+            if not os.path.exists(self.path):
+                return []
+            out = []
+            for i, h in enumerate(self._valid_records(), start=1):
+                r = dict(h)
+                r["id"] = i
+                out.append(r)
+            return out
+
+    def page(self, limit: int = 20, before: int = None):
+        rows = self._scan()
+        if before is not None:
+            rows = [r for r in rows if r["id"] < int(before)]
+        return list(reversed(rows[-int(limit):])) if limit > 0 else []
+
+    def top(self, k: int = 10, game1_mode: int = None, game2_mode: int = None, day: str = None):
+        rows = [r for r in self._scan() if _history_row_match(r, game1_mode, game2_mode, day)]
+        rows.sort(key=lambda r: (-_entry_total_score(r), r["id"]))
+        return rows[:int(k)]
+
+    def daily(self, days: int = 7, game1_mode: int = None, game2_mode: int = None):
+        since = _history_day_start(days)
+        agg = {}
+        for r in self._scan():
+            d = str(r.get("start_time", ""))[:10]
+            if d < since or not _history_row_match(r, game1_mode, game2_mode, None):
+                continue
+            a = agg.setdefault(d, {"day": d, "rounds": 0, "best": 0, "total": 0})
+            sc = _entry_total_score(r)
+            a["rounds"] += 1
+            a["best"] = max(a["best"], sc)
+            a["total"] += sc
+        out = sorted(agg.values(), key=lambda a: a["day"], reverse=True)
+        for a in out:
+            a["avg"] = round(a["total"] / a["rounds"], 2) if a["rounds"] else 0.0
+        return out
+
+def _history_row_match(r, game1_mode, game2_mode, day) -> bool:
+    if game1_mode is not None and r.get("game1_mode") != int(game1_mode):
+        return False
+    if game2_mode is not None and r.get("game2_mode") != int(game2_mode):
+        return False
+    if day is not None and not str(r.get("start_time", "")).startswith(day):
+        return False
+    return True
+
+def _history_day_start(days: int) -> str:
+    """回傳 N 天前（含今天）的日期字串 YYYY-MM-DD，給 start_time 範圍查詢用。"""
+    d = datetime.now().date() - timedelta(days=max(1, int(days)) - 1)
+    return d.isoformat()
+
+def _history_next_day(day: str) -> str:
+    return (datetime.strptime(day, "%Y-%m-%d").date() + timedelta(days=1)).isoformat()
+
+class SQLiteHistoryStore:
+    """
+    SQLite 歷史紀錄引擎（與 HistoryStore 同介面）。
+    - rounds 表 + 索引：round_total_score、start_time、(game1_mode, game2_mode, round_total_score)
+    - 分頁 / 模式 top-K / 每日統計都是索引查詢，不用在 Python 掃全部
+    - 第一次建立時從 score_history.jsonl（或舊版 score_history.json）匯入
+    - 寫入同樣交給背景 writer thread
+    - epoch 記在 meta 表；從 JSONL 匯入時沿用 JSONL 的 epoch（seq 接著編，不算重來）
+    """
+
+    _COLUMNS = ("round_id", "start_time", "game1_mode", "game2_mode",
+                "game1_score", "game2_score", "round_total_score")
+
+    def __init__(self, path: str = None):
+        self.path = path or HISTORY_DB_FILE
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._conn = None
+        self._recent = deque(maxlen=HISTORY_RECENT_WINDOW)
+        self._best = 0
+        self.version = 0           # 每新增一筆 +1（/status 判斷 history 區塊是否要重送）
+        self._seq = 0
+        self.epoch = ""
+
+        self._q = queue.Queue()
+        self._writer = None
+
+    def _ensure_loaded(self):
+        # 呼叫端需持有 self._lock
+        if self._loaded:
+            return
+        self._loaded = True
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rounds ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " round_id INTEGER, start_time TEXT,"
+            " game1_mode INTEGER, game2_mode INTEGER,"
+            " game1_score INTEGER, game2_score INTEGER,"
+            " round_total_score INTEGER, extra TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_rounds_total ON rounds(round_total_score)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_rounds_start ON rounds(start_time)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_rounds_modes"
+            " ON rounds(game1_mode, game2_mode, round_total_score)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.commit()
+        self._conn = conn
+
+        if conn.execute("SELECT COUNT(*) FROM rounds").fetchone()[0] == 0:
+            self._import_existing()
+
+        row = conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()
+        if row is not None:
+            self.epoch = str(row[0])
+        else:
+            self.epoch = self.epoch or _new_history_epoch()   # _import_existing() 可能已經沿用 JSONL 的
+            with conn:
+                conn.execute("INSERT INTO meta (key, value) VALUES ('epoch', ?)", (self.epoch,))
+
+        rows = conn.execute(
+            "SELECT * FROM rounds ORDER BY id DESC LIMIT ?", (HISTORY_RECENT_WINDOW,)
+        ).fetchall()
+        self._recent.extend(self._row_to_entry(r, with_id=False) for r in reversed(rows))
+        best = conn.execute("SELECT MAX(round_total_score) FROM rounds").fetchone()[0]
+        self._best = int(best or 0)
+        seq = conn.execute("SELECT MAX(CAST(json_extract(extra, '$.seq') AS INTEGER)) FROM rounds").fetchone()[0]
+        self._seq = int(seq or 0)
+
+    def _import_existing(self):
+        src = HistoryStore()
+        try:
+            with src._lock:
+                src._ensure_loaded()
+                records = list(src._valid_records()) if os.path.exists(src.path) else []
+        except Exception as e:
+            print("[HISTORY] sqlite import error:", e)
+            return
+        if not records:
+            return
+        self.epoch = src.epoch
+        with self._conn:
+            self._conn.executemany(self._insert_sql(), [self._entry_to_row(h) for h in records])
+        print(f"[HISTORY] imported {len(records)} rounds into sqlite")
+
+    def _insert_sql(self):
+        cols = ", ".join(self._COLUMNS + ("extra",))
+        marks = ", ".join("?" * (len(self._COLUMNS) + 1))
+        return f"INSERT INTO rounds ({cols}) VALUES ({marks})"
+
+    def _entry_to_row(self, h: dict):
+        extra = {k: v for k, v in h.items() if k not in self._COLUMNS}
+        return tuple(h.get(c) for c in self._COLUMNS) + (
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+        )
+
+    def _row_to_entry(self, r, with_id: bool = True) -> dict:
+        h = {c: r[c] for c in self._COLUMNS}
+        if r["extra"]:
+            try:
+                h.update(json.loads(r["extra"]))
+            except ValueError:
+                pass
+        if with_id:
+            h["id"] = int(r["id"])
+        return h
+
+    # ---------- 寫入 ----------
+    def _append_to_disk(self, entry: dict):
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.execute(self._insert_sql(), self._entry_to_row(entry))
+            except Exception as e:
+                print("[HISTORY] sqlite save error:", e)
+
+    def _writer_loop(self):
+        while True:
+            entry = self._q.get()
+            try:
+                self._append_to_disk(entry)
+            finally:
+                self._q.task_done()
+
+    def start(self):
+        if self._writer is not None:
+            return
+        with self._lock:
+            self._ensure_loaded()
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+
+    def flush(self):
+        if self._writer is not None:
+            self._q.join()
+
+    def compact(self):
+        self.flush()
+        with self._lock:
+            self._ensure_loaded()
+            self._conn.execute("VACUUM")
+
+    def append(self, entry: dict):
+        with self._lock:
+            self._ensure_loaded()
+            self._seq += 1
+            entry["seq"] = self._seq
+            self._recent.append(entry)
+            self._best = max(self._best, _entry_total_score(entry))
+            self.version += 1
+        if self._writer is not None:
+            self._q.put(entry)
+        else:
+            self._append_to_disk(entry)
+
+    def summary(self, max_recent: int = 10):
+        n = max(0, min(int(max_recent), HISTORY_RECENT_WINDOW))
+        with self._lock:
+            self._ensure_loaded()
+            recent = list(self._recent)[-n:] if n > 0 else []
+            return recent, self._best
+
+    def records_after(self, seq: int, limit: int = 100):
+        """seq 大於指定值的紀錄（舊到新，最多 limit 筆）；上傳補傳用。"""
+        self.flush()
+        rows = self._query(
+            "SELECT * FROM rounds WHERE CAST(json_extract(extra, '$.seq') AS INTEGER) > ?"
+            " ORDER BY id LIMIT ?",
+            (int(seq), int(limit)),
+        )
+        return [self._row_to_entry(r, with_id=False) for r in rows]
+
+    def get_epoch(self) -> str:
+        with self._lock:
+            self._ensure_loaded()
+            return self.epoch
+
+    # ---------- 查詢 ----------
+    def _query(self, sql: str, args=()):
+        with self._lock:
+            self._ensure_loaded()
+            return self._conn.execute(sql, args).fetchall()
+
+    def page(self, limit: int = 20, before: int = None):
+        if before is None:
+            rows = self._query("SELECT * FROM rounds ORDER BY id DESC LIMIT ?", (int(limit),))
+        else:
+            rows = self._query(
+                "SELECT * FROM rounds WHERE id < ? ORDER BY id DESC LIMIT ?",
+                (int(before), int(limit)),
+            )
+        return [self._row_to_entry(r) for r in rows]
+
+    @staticmethod
+    def _where(game1_mode, game2_mode, day=None, since=None):
+        conds, args = [], []
+        if game1_mode is not None:
+            conds.append("game1_mode = ?")
+            args.append(int(game1_mode))
+        if game2_mode is not None:
+            conds.append("game2_mode = ?")
+            args.append(int(game2_mode))
+        if day is not None:
+            conds.append("start_time >= ? AND start_time < ?")
+            args += [day, _history_next_day(day)]
+        if since is not None:
+            conds.append("start_time >= ?")
+            args.append(since)
+        return (" WHERE " + " AND ".join(conds)) if conds else "", args
+
+    def top(self, k: int = 10, game1_mode: int = None, game2_mode: int = None, day: str = None):
+        where, args = self._where(game1_mode, game2_mode, day=day)
+        rows = self._query(
+            f"SELECT * FROM rounds{where} ORDER BY round_total_score DESC, id ASC LIMIT ?",
+            args + [int(k)],
+        )
+        return [self._row_to_entry(r) for r in rows]
+
+    def daily(self, days: int = 7, game1_mode: int = None, game2_mode: int = None):
+        where, args = self._where(game1_mode, game2_mode, since=_history_day_start(days))
+        rows = self._query(
+            "SELECT substr(start_time, 1, 10) AS day, COUNT(*) AS rounds,"
+            " MAX(round_total_score) AS best, SUM(round_total_score) AS total,"
+            f" AVG(round_total_score) AS avg FROM rounds{where}"
+            " GROUP BY day ORDER BY day DESC",
+            args,
+        )
+        return [
+            {
+                "day": r["day"],
+                "rounds": int(r["rounds"]),
+                "best": int(r["best"] or 0),
+                "total": int(r["total"] or 0),
+                "avg": round(float(r["avg"] or 0.0), 2),
+            }
+            for r in rows
+        ]
+
+def _make_history_store():
+    if HISTORY_BACKEND == "sqlite":
+        return SQLiteHistoryStore()
+    return HistoryStore()
+
+_history = HistoryStore()  # 初始化區會依 HISTORY_BACKEND 重建
+_uploader = None           # RoundUploader；有設 aggregator_url 才建立
 
 def save_round_history_entry(entry: dict):
-    history = _load_history()
-    history.append(entry)
-    _save_history_all(history)
+    _history.append(entry)   # 蓋上 seq
+    if _uploader is not None:
+        _uploader.submit(entry)
+    _notify_state_changed()
 
 def get_history_summary(max_recent: int = 10):
-    history = _load_history()
-    recent = history[-max_recent:]
-    best = 0
-    for h in history:
-        try:
-            best = max(best, int(h.get("round_total_score", 0)))
-        except Exception:
-            pass
-    return recent, best
+    return _history.summary(max_recent)
+
+def get_history_page(limit: int = 20, before: int = None):
+    """最新在前；before 帶上一頁最後一筆的 id 取下一頁。"""
+    limit = max(1, min(200, int(limit)))
+    return _history.page(limit, before)
+
+def get_history_top(k: int = 10, game1_mode: int = None, game2_mode: int = None, day: str = None):
+    """依 round_total_score 取前 K 名；可限定模式組合與日期（YYYY-MM-DD，格式不對丟 ValueError）。"""
+    k = max(1, min(100, int(k)))
+    if day is not None:
+        day = datetime.strptime(day, "%Y-%m-%d").date().isoformat()   # 兩種引擎都用同一種字串比對
+    return _history.top(k, game1_mode, game2_mode, day)
+
+def get_history_daily(days: int = 7, game1_mode: int = None, game2_mode: int = None):
+    """最近 N 天每日統計（rounds / best / total / avg）。"""
+    days = max(1, min(366, int(days)))
+    return _history.daily(days, game1_mode, game2_mode)
 
 def _format_time_now_str() -> str:
     return datetime.now().strftime("%Y/%m/%d %H:%M:%S")
@@ -456,515 +1538,1893 @@ def _format_time_now_str() -> str:
 # =========================
 # 高頻 IR 進球偵測 Thread
 # =========================
-class GoalDetector(threading.Thread):
-    def __init__(self, entry_v: float, release_v: float, holdoff_ms: int, min_width_ms: float):
-        super().__init__(daemon=True)
-        self.entry_v = float(entry_v)
-        self.release_v = float(release_v)
-        self.holdoff_s = float(holdoff_ms) / 1000.0
-        self.min_width_ms = float(min_width_ms)
+class SampleRing:
+    """
+    預先配置的 (timestamp, voltage) ring buffer，單一 writer（取樣 thread）、多個 reader。
+    - writer 先寫 slot 再把 seq +1，完全不用 lock
+    - reader 複製後再看一次 seq，只保留確定沒被覆寫的那段（seq 編號 > head - size）
+    """
 
-        self._lock = threading.Lock()
-        self.enabled = False
-        self._stop = False
+    def __init__(self, size: int = None):
+        n = 1
+        while n < int(size or GOAL_RING_SIZE):
+            n <<= 1
+        self.size = n
+        self._mask = n - 1
+        self._t = array("d", [0.0]) * n
+        self._v = array("f", [0.0]) * n
+        self.seq = 0               # 已寫入的樣本總數（下一筆的序號）
+
+    def push(self, t: float, v: float):
+        i = self.seq & self._mask
+        self._t[i] = t
+        self._v[i] = v
+        self.seq += 1
+
+    def _oldest(self, head: int) -> int:
+        return max(0, head - self.size + 1)
+
+    def _bisect_t(self, lo: int, hi: int, t: float) -> int:
+        """在序號 [lo, hi) 內找第一個 timestamp >= t 的序號（時間單調遞增）。"""
+        mask = self._mask
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._t[mid & mask] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def window(self, t0: float, t1: float):
+        """回傳 timestamp 在 [t0, t1] 內的樣本 [(t, v), ...]；已被覆寫的部分會略過。"""
+        head = self.seq
+        lo = self._oldest(head)
+        start = self._bisect_t(lo, head, t0)
+        end = self._bisect_t(start, head, t1 + 1e-9)
+        mask = self._mask
+        out = [(self._t[i & mask], self._v[i & mask]) for i in range(start, end)]
+        # 複製期間 writer 可能繞回來覆寫最舊的幾筆：丟掉不安全的前段
+        safe_from = self._oldest(self.seq)
+        if start < safe_from:
+            out = out[safe_from - start:]
+        return out
+
+    def latest_t(self) -> float:
+        head = self.seq
+        return self._t[(head - 1) & self._mask] if head else 0.0
+
+def _hist_percentile(hist, total: int, q: float, bucket: float) -> float:
+    """固定格距直方圖的百分位（回傳該格上緣）。"""
+    if total <= 0:
+        return 0.0
+    need = total * q
+    acc = 0
+    for i, c in enumerate(hist):
+        acc += c
+        if acc >= need:
+            return (i + 1) * bucket
+    return len(hist) * bucket
+
+class ThresholdCalibrator:
+    """
+    單一籃框的背景電壓統計 + entry / release 建議值。
+    feed() / observe_peak() 只由取樣 thread 呼叫；suggest() 只讀 float，任何 thread 都可呼叫。
+    """
+
+    def __init__(self, entry_v: float, release_v: float):
+        self.default_entry_v = float(entry_v)
+        self.default_release_v = float(release_v)
+        self.mean_v = 0.0
+        self.var_v = 0.0
+        self.peak_v = 0.0          # 有效進球峰值的 EWMA（0 = 還沒看過）
+        self.idle_s = 0.0          # 已累積的背景統計時間
+        self._t_last = None
+        self._skip = 0
+
+    def feed(self, t: float, v: float):
+        """餵一個無球樣本（呼叫端負責排除事件中 / holdoff 期間的樣本）。"""
+        self._skip += 1
+        if self._skip < CALIB_DECIMATE:
+            return
+        self._skip = 0
+        if self._t_last is None:
+            self._t_last = t
+            self.mean_v = v
+            return
+        dt = t - self._t_last
+        self._t_last = t
+        if dt <= 0:
+            return
+        if dt > 1.0:
+            dt = 1.0   # 中間有一大段被排除（例如一直有球），不要一次跳太多
+        a = 1.0 - math.exp(-dt / CALIB_TAU_S)
+        d = v - self.mean_v
+        self.mean_v += a * d
+        self.var_v = (1.0 - a) * (self.var_v + a * d * d)
+        self.idle_s += dt
+
+    def observe_peak(self, peak_v: float):
+        if self.peak_v <= 0.0:
+            self.peak_v = float(peak_v)
+        else:
+            self.peak_v += CALIB_PEAK_ALPHA * (float(peak_v) - self.peak_v)
+
+    def suggest(self):
+        """回傳 (ready, entry_v, release_v)；ready = False 時為預設門檻。"""
+        mean = self.mean_v
+        std = math.sqrt(max(0.0, self.var_v))
+        if self.idle_s < CALIB_WARMUP_S or std > CALIB_MAX_STD_V:
+            return False, self.default_entry_v, self.default_release_v
+
+        entry = mean + max(CALIB_ENTRY_SIGMA * std, CALIB_ENTRY_MARGIN_V)
+        # 看過進球峰值：entry 不超過背景與峰值的中點（同 test_calib_gp2y.py 的建議值）
+        if self.peak_v > mean:
+            entry = min(entry, (mean + self.peak_v) / 2.0)
+        entry = max(CALIB_ENTRY_MIN_V, min(CALIB_ENTRY_MAX_V, entry))
+        release = mean + max(CALIB_RELEASE_SIGMA * std, CALIB_RELEASE_MARGIN_V)
+        if entry - CALIB_MIN_HYST_V < release:
+            # 峰值太低把 entry 壓下來，release 已經放不進背景雜訊之上：雜訊回不到 release 以下，
+            # 判定會一直卡在事件中（漏球 / 寬度拉長）。這種情況不套用，維持預設門檻
+            return False, self.default_entry_v, self.default_release_v
+        return True, entry, release
+
+    def get_stats(self):
+        ready, entry, release = self.suggest()
+        return {
+            "baseline_v": float(self.mean_v),
+            "baseline_std_v": float(math.sqrt(max(0.0, self.var_v))),
+            "baseline_idle_s": float(self.idle_s),
+            "calib_ready": bool(ready),
+            "calib_entry_v": float(entry),
+            "calib_release_v": float(release),
+            "calib_peak_v": float(self.peak_v),
+        }
+
+class HoopDetector:
+    """
+    單一籃框（一個 MCP3008 channel）的遲滯進球判定 + 計分 + 原始波形。
+    feed() 只由取樣 thread 呼叫；遲滯狀態只有取樣 thread 會碰，不用 lock。
+    """
 
-        self.in_zone = False
-        self.holdoff_until = 0.0
-        self.event_start = 0.0
-        self.peak_v = 0.0
+    def __init__(self, channel: int, entry_v: float, release_v: float, holdoff_ms: int,
+                 min_width_ms: float, on_goal=None, ring=None):
+        self.channel = int(channel)
+        # 遲滯判定本身是純邏輯（goal_detect.GoalHysteresis），離線重播工具用同一份規則
+        self.det = GoalHysteresis(entry_v, release_v, holdoff_ms, min_width_ms)
+        self.calib = ThresholdCalibrator(entry_v, release_v)
+        self.on_goal = on_goal     # 有效進球時呼叫（在取樣 thread 上，請保持輕量）
+
+        # _lock 只保護進球事件（低頻）；每個樣本的發佈走 ring buffer / 單一屬性賦值，不拿 lock
+        self._lock = metrics.TimedLock(LOCK_WAIT_HIST.labels("hoop", self.channel))
+        self.enabled = False
+        self._reset_gen = 0        # set_enabled() 時 +1，取樣 thread 看到就重置遲滯狀態
 
         self.seq = 0
         self.last_event_peak_v = 0.0
         self.last_event_width_ms = 0.0
         self.last_event_ts = ""
+        self.last_event_t = 0.0    # 最後一個進球的 t_release（perf_counter；算進球延遲用）
+        self._events = deque(maxlen=GOAL_EVENT_HISTORY)
 
+        self.ring = ring if ring is not None else SampleRing(GOAL_RING_SIZE)
         self.sensor_v = 0.0
-        self.last_eff_rate = 0.0
+
+        self._gen = -1
 
     def set_enabled(self, flag: bool):
         with self._lock:
             self.enabled = bool(flag)
-            self.in_zone = False
-            self.holdoff_until = 0.0
-            self.event_start = 0.0
-            self.peak_v = 0.0
+            self._reset_gen += 1
 
-    def consume_since(self, last_seq: int) -> int:
+    def set_thresholds(self, entry_v: float, release_v: float):
+        """換門檻（取樣 thread 下一個樣本就生效）。"""
         with self._lock:
-            return max(0, self.seq - int(last_seq))
+            self.det.entry_v = float(entry_v)
+            self.det.release_v = float(release_v)
+
+    def apply_calibration(self, enabled: bool) -> bool:
+        """
+        enabled：用背景統計的建議值；否則回到預設門檻。回傳是否套用了校正值。
+        只在兩場 Game 之間呼叫（事件判定中途換門檻會讓寬度 / holdoff 失真）。
+        """
+        ready, entry, release = self.calib.suggest()
+        if enabled and ready:
+            self.set_thresholds(entry, release)
+            return True
+        self.set_thresholds(self.calib.default_entry_v, self.calib.default_release_v)
+        return False
 
     def get_debug(self):
+        calib = self.calib.get_stats()
         with self._lock:
             return {
+                **calib,
+                "channel": int(self.channel),
                 "sensor_v": float(self.sensor_v),
-                "entry_v": float(self.entry_v),
-                "release_v": float(self.release_v),
-                "holdoff_ms": int(self.holdoff_s * 1000),
-                "min_width_ms": float(self.min_width_ms),
+                "entry_v": float(self.det.entry_v),
+                "release_v": float(self.det.release_v),
+                "holdoff_ms": int(self.det.holdoff_s * 1000),
+                "min_width_ms": float(self.det.min_width_ms),
+                "enabled": bool(self.enabled),
                 "event_seq": int(self.seq),
                 "last_event_peak_v": float(self.last_event_peak_v),
                 "last_event_width_ms": float(self.last_event_width_ms),
                 "last_event_ts": str(self.last_event_ts),
-                "last_eff_rate_hz": float(self.last_eff_rate),
             }
 
+    def get_traces(self, n: int = 5, pre_ms: float = 100.0, post_ms: float = 100.0):
+        """最近 n 個進球事件前後的原始波形（時間以事件 entry 為 0，單位 ms）。"""
+        with self._lock:
+            events = list(self._events)[-int(n):] if n > 0 else []
+        out = []
+        for ev in events:
+            t_entry = ev["t_entry"]
+            samples = self.ring.window(t_entry - pre_ms / 1000.0, ev["t_release"] + post_ms / 1000.0)
+            out.append({
+                "seq": ev["seq"],
+                "ts": ev["ts"],
+                "peak_v": ev["peak_v"],
+                "width_ms": ev["width_ms"],
+                "samples": [[round((t - t_entry) * 1000.0, 3), round(v, 4)] for t, v in samples],
+            })
+        return out
+
+    def get_waveform(self, ms: float = 500.0):
+        """最近 ms 毫秒的原始波形（時間以最新一筆為 0，單位 ms）。"""
+        t_end = self.ring.latest_t()
+        samples = self.ring.window(t_end - ms / 1000.0, t_end)
+        return [[round((t - t_end) * 1000.0, 3), round(v, 4)] for t, v in samples]
+
+    def _publish_event(self, t_entry: float, t_release: float, peak_v: float, width_ms: float):
+        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        with self._lock:
+            self.seq += 1
+            self.last_event_peak_v = float(peak_v)
+            self.last_event_width_ms = float(width_ms)
+            self.last_event_ts = ts
+            self.last_event_t = t_release
+            self._events.append({
+                "seq": self.seq,
+                "t_entry": t_entry,
+                "t_release": t_release,
+                "peak_v": float(peak_v),
+                "width_ms": float(width_ms),
+                "ts": ts,
+            })
+        self.calib.observe_peak(peak_v)
+        if self.on_goal is not None:
+            self.on_goal(self)
+
+    def feed(self, t: float, v: float):
+        """取樣 thread 每個樣本呼叫一次：存波形 + 遲滯判定。"""
+        self.ring.push(t, v)
+        self.sensor_v = v
+
+        if self._gen != self._reset_gen:
+            self._gen = self._reset_gen
+            self.det.reset()
+
+        det = self.det
+        if not det.in_zone and t >= det.holdoff_until and v < det.entry_v:
+            self.calib.feed(t, v)
+
+        if not self.enabled:
+            return
+        ev = det.step(t, v)
+        if ev is not None:
+            self._publish_event(*ev)
+
+class GoalDetector(threading.Thread):
+    """
+    單一取樣 thread：每個週期依序讀所有籃框的 MCP3008 channel（read_adc_channels），
+    各自餵給自己的 HoopDetector。固定速率 / 延遲統計對整個掃描週期計算。
+    """
+
+    def __init__(self, hoops, sample_rate_hz: float = 0.0):
+        super().__init__(daemon=True)
+        self.hoops = list(hoops)
+        self._channels = [h.channel for h in self.hoops]
+        self._stopping = False
+        self.last_eff_rate = 0.0
+        self.scans = 0
+        self.recorder = None       # TraceRecorder；非 None 時每個週期的原始 ADC 都寫進去
+
+        # 固定速率取樣
+        self.sample_rate_hz = max(0.0, float(sample_rate_hz))
+        self.overruns = 0
+        self._jitter_hist = array("L", [0]) * SAMPLE_JITTER_BUCKETS
+        self.jitter_p50_us = 0.0
+        self.jitter_p99_us = 0.0
+        self.jitter_max_us = 0.0
+
+    def hoop(self, channel: int) -> HoopDetector:
+        for h in self.hoops:
+            if h.channel == int(channel):
+                return h
+        raise KeyError(f"no hoop on channel {channel}")
+
+    def set_sample_rate(self, hz: float):
+        """0 = 全速空轉；>0 = 固定速率（下一個取樣週期生效）。"""
+        self.sample_rate_hz = max(0.0, float(hz))
+
+    def start_recording(self, recorder):
+        self.recorder = recorder
+
+    def stop(self):
+        self._stopping = True
+
+    def close(self):
+        """shutdown() 在 stop() 之後呼叫：等 thread 結束再釋放取樣用的資源（thread 模式沒有要釋放的）。"""
+
+    def stop_recording(self, timeout: float = 1.0):
+        """拔掉 recorder，等取樣 thread 跑完目前這一輪（之後不會再 push）再關檔。"""
+        rec = self.recorder
+        if rec is None:
+            return None
+        self.recorder = None
+        seq = self.scans
+        deadline = time.monotonic() + timeout
+        while self.scans == seq and self.is_alive() and time.monotonic() < deadline:
+            time.sleep(0.002)
+        rec.close()
+        return rec
+
+    def get_debug(self):
+        return {
+            "last_eff_rate_hz": float(self.last_eff_rate),
+            "target_rate_hz": float(self.sample_rate_hz),
+            "jitter_p50_us": float(self.jitter_p50_us),
+            "jitter_p99_us": float(self.jitter_p99_us),
+            "jitter_max_us": float(self.jitter_max_us),
+            "overruns": int(self.overruns),
+            "sampler_mode": "thread",
+            "sampler_pid": os.getpid(),
+            "sampler_alive": self.is_alive(),
+            "sampler_restarts": 0,
+        }
+
+    def _publish_rate_window(self, t: float, hz_cnt: int, hz_t0: float, jit_max: float):
+        """每秒一次：發佈實際掃描率與延遲百分位，並清空直方圖。"""
+        hist = self._jitter_hist
+        total = sum(hist)
+        self.last_eff_rate = hz_cnt / (t - hz_t0)
+        self.jitter_p50_us = _hist_percentile(hist, total, 0.50, SAMPLE_JITTER_BUCKET_US)
+        self.jitter_p99_us = _hist_percentile(hist, total, 0.99, SAMPLE_JITTER_BUCKET_US)
+        self.jitter_max_us = jit_max
+        for i in range(len(hist)):
+            hist[i] = 0
+
     def run(self):
         hz_cnt = 0
         hz_t0 = time.perf_counter()
+        hist = self._jitter_hist
+        last_bucket = SAMPLE_JITTER_BUCKETS - 1
+        jit_max = 0.0
+        next_t = hz_t0
+        channels = self._channels
+        pairs = list(zip(range(len(self.hoops)), self.hoops))
+        loop_hist = SAMPLER_LOOP_HIST
         try:
-            while not self._stop:
+            while not self._stopping:
                 t = time.perf_counter()
+                rate = self.sample_rate_hz
+                if rate > 0:
+                    late_us = (t - next_t) * 1e6
+                    if late_us > 0:
+                        b = int(late_us / SAMPLE_JITTER_BUCKET_US)
+                        hist[b if b < last_bucket else last_bucket] += 1
+                        if late_us > jit_max:
+                            jit_max = late_us
+                    else:
+                        hist[0] += 1
+
                 try:
-                    v = read_ir_voltage()
+                    raws = read_adc_channels(channels)
                 except Exception:
-                    v = 0.0
+                    raws = None
+                for i, h in pairs:
+                    h.feed(t, raws[i] * ADC_TO_V if raws else 0.0)
+                rec = self.recorder
+                if rec is not None:
+                    rec.push(t, raws)
+                self.scans += 1
+                loop_hist.observe(time.perf_counter() - t)
 
                 hz_cnt += 1
                 if (t - hz_t0) >= 1.0:
-                    eff = hz_cnt / (t - hz_t0)
+                    self._publish_rate_window(t, hz_cnt, hz_t0, jit_max)
+                    jit_max = 0.0
                     hz_cnt = 0
                     hz_t0 = t
-                    with self._lock:
-                        self.last_eff_rate = eff
-
-                with self._lock:
-                    self.sensor_v = v
-                    enabled = self.enabled
-                    in_zone = self.in_zone
-                    holdoff_until = self.holdoff_until
-                    event_start = self.event_start
-                    peak_v = self.peak_v
-
-                if enabled:
-                    if t >= holdoff_until:
-                        if (not in_zone) and (v >= self.entry_v):
-                            in_zone = True
-                            event_start = t
-                            peak_v = v
-                        elif in_zone:
-                            if v > peak_v:
-                                peak_v = v
-                            if v <= self.release_v:
-                                width_ms = (t - event_start) * 1000.0
-                                valid = (width_ms >= self.min_width_ms)
-
-                                with self._lock:
-                                    if valid:
-                                        self.seq += 1
-                                        self.last_event_peak_v = float(peak_v)
-                                        self.last_event_width_ms = float(width_ms)
-                                        self.last_event_ts = datetime.now().strftime(
-                                            "%Y-%m-%d %H:%M:%S.%f"
-                                        )[:-3]
-                                    self.in_zone = False
-                                    self.holdoff_until = t + self.holdoff_s
-                                    self.event_start = 0.0
-                                    self.peak_v = 0.0
-
-                                in_zone = False
-                            else:
-                                with self._lock:
-                                    self.in_zone = True
-                                    self.event_start = event_start
-                                    self.peak_v = float(peak_v)
-
-                        with self._lock:
-                            self.in_zone = in_zone
-
-                time.sleep(0)
+
+                if rate > 0:
+                    # 精準節拍：next_t += dt；落後超過一拍就記一次 overrun 並重新對齊
+                    dt = 1.0 / rate
+                    next_t += dt
+                    sleep_s = next_t - time.perf_counter()
+                    if sleep_s > 0:
+                        time.sleep(sleep_s)
+                    elif sleep_s < -dt:
+                        self.overruns += 1
+                        next_t = time.perf_counter()
+                else:
+                    next_t = time.perf_counter()
+                    time.sleep(0)
 
         except Exception as e:
             print("⚠️ GoalDetector stopped:", e)
 
-_goal = GoalDetector(GOAL_ENTRY_V, GOAL_RELEASE_V, GOAL_HOLDOFF_MS, GOAL_MIN_WIDTH_MS)
+def _on_extra_goal(hoop):
+    _notify_state_changed()
+
+def _make_goal_detector(channels, mode: str = None):
+    """所有籃框共用一個取樣 thread（或取樣行程）；屬於 session 的籃框由 GameSession.bind_hoop() 換上自己的進球 callback。"""
+    if (mode or SAMPLER_MODE) == "process":
+        return ProcessGoalDetector(channels, GOAL_SAMPLE_RATE_HZ, SAMPLER_CPU)
+    return GoalDetector(
+        [
+            HoopDetector(ch, GOAL_ENTRY_V, GOAL_RELEASE_V, GOAL_HOLDOFF_MS, GOAL_MIN_WIDTH_MS,
+                         on_goal=_on_extra_goal)
+            for ch in channels
+        ],
+        sample_rate_hz=GOAL_SAMPLE_RATE_HZ,
+    )
 
 # =========================
-# 遊戲狀態
+# 行程隔離取樣（sampler_mode = "process"）
 # =========================
-STATE_LOCK = threading.Lock()
+def _seqlock_write(q, fn):
+    """seqlock 寫端（每個區塊只有一個 writer）：q[0] 變奇數 → 寫欄位 → 變偶數。"""
+    q[0] += 1
+    try:
+        fn()
+    finally:
+        q[0] += 1
 
-CURRENT_ROUND = 0
-CURRENT_GAME = 0  # 0/1/2
+def _seqlock_read(q, fn, tries: int = 100):
+    """
+    seqlock 讀端：讀之前序號是偶數、讀完沒變，才算拿到完整的一份。
+    一直讀不到（writer 寫到一半就掛了）就回最後一次的結果，不要卡住呼叫端。
+    """
+    out = None
+    for _ in range(tries):
+        s = q[0]
+        if s & 1:
+            time.sleep(0)
+            continue
+        out = fn()
+        if q[0] == s:
+            return out
+    return out if out is not None else fn()
+
+def _ring_size(size: int) -> int:
+    n = 2
+    while n < int(size):
+        n <<= 1
+    return n
+
+class _ShmHoopViews:
+    __slots__ = ("ctl_q", "ctl_d", "st_q", "st_d", "ev", "head", "t", "v")
+
+class _ShmBlock:
+    """
+    取樣行程與主行程共用的記憶體配置（multiprocessing.shared_memory；各欄位都是 memoryview，8 byte 對齊）：
+      表頭：stop 旗標、目標取樣率（主 → 取樣）；取樣統計（取樣 → 主，seqlock）；
+           取樣迴圈時間的 histogram（取樣行程寫、主行程的 /metrics 直接讀，計數單調遞增不用 seqlock）
+      每個籃框：控制區（啟用 / reset / 門檻，主 → 取樣，seqlock）
+               狀態區 + 最近 GOAL_EVENT_HISTORY 個進球事件（取樣 → 主，seqlock）
+               波形 ring（head + t[] + v[]，協定同 SampleRing：slot 寫完才推進 head）
+      結尾：每次掃描一個 byte，ADC 讀取失敗 = 1（slot 同波形 ring；錄製 .bbt 時寫回 -1 用）
+    """
 
-GAME1_MODE = 1
-GAME2_MODE = 2
-GAME_TIME = 30  # 預設每場 30 秒
+    STATS_Q = 2    # seq, overruns
+    STATS_D = 4    # eff_rate_hz, jitter_p50_us, jitter_p99_us, jitter_max_us
+    LOOP_D = metrics.Histogram.size(len(METRIC_SAMPLER_LOOP_BUCKETS))
+    CTL_Q = 3      # seq, enabled, reset_gen
+    CTL_D = 2      # entry_v, release_v
+    ST_Q = 2       # seq, event_seq
+    ST_D = 6       # mean_v, var_v, peak_v, idle_s, last_peak_v, last_width_ms
+    EV_D = 6       # 每個事件：seq, t_entry, t_release, peak_v, width_ms, 牆鐘時間
+
+    def __init__(self, shm, n_hoops: int, ring_size: int):
+        self.shm = shm
+        self._off = 0
+        self._views = []
+        buf = shm.buf
+        self.stop = self._take(buf, "Q", 1)
+        self.rate = self._take(buf, "d", 1)
+        self.stats_q = self._take(buf, "Q", self.STATS_Q)
+        self.stats_d = self._take(buf, "d", self.STATS_D)
+        self.loop_hist = self._take(buf, "d", self.LOOP_D)
+        self.hoops = []
+        for _ in range(n_hoops):
+            v = _ShmHoopViews()
+            v.ctl_q = self._take(buf, "Q", self.CTL_Q)
+            v.ctl_d = self._take(buf, "d", self.CTL_D)
+            v.st_q = self._take(buf, "Q", self.ST_Q)
+            v.st_d = self._take(buf, "d", self.ST_D)
+            v.ev = self._take(buf, "d", self.EV_D * GOAL_EVENT_HISTORY)
+            v.head = self._take(buf, "Q", 1)
+            v.t = self._take(buf, "d", ring_size)
+            v.v = self._take(buf, "f", ring_size)
+            self.hoops.append(v)
+        self.read_failed = self._take(buf, "B", ring_size)   # 放最後：1 byte 一格，不影響前面的 8 byte 對齊
+
+    @classmethod
+    def nbytes(cls, n_hoops: int, ring_size: int) -> int:
+        hdr = 8 * (2 + cls.STATS_Q + cls.STATS_D + cls.LOOP_D)
+        per_hoop = 8 * (cls.CTL_Q + cls.CTL_D + cls.ST_Q + cls.ST_D + cls.EV_D * GOAL_EVENT_HISTORY + 1) + 12 * ring_size
+        return hdr + n_hoops * per_hoop + ring_size
+
+    def _take(self, buf, fmt: str, n: int):
+        size = n * {"f": 4, "B": 1}.get(fmt, 8)
+        mv = buf[self._off:self._off + size].cast(fmt)
+        self._off += size
+        self._views.append(mv)
+        return mv
+
+    def close(self):
+        """放掉所有 memoryview 再關 mapping（之後任何讀寫都會丟 ValueError，只在行程結束前呼叫）。"""
+        for mv in self._views:
+            mv.release()
+        self._views = []
+        self.shm.close()
+
+class SharedSampleRing(SampleRing):
+    """SampleRing 的共享記憶體版：slot 與 head 都在 _ShmBlock 裡；取樣行程 push()，主行程 window()。"""
+
+    def __init__(self, views):
+        self.size = len(views.t)
+        self._mask = self.size - 1
+        self._t = views.t
+        self._v = views.v
+        self._head = views.head
+
+    @property
+    def seq(self):
+        return self._head[0]
+
+    @seq.setter
+    def seq(self, n):
+        self._head[0] = n
+
+class _ShmHoopDetector(HoopDetector):
+    """
+    取樣行程裡的 HoopDetector：啟用 / 門檻從控制區讀（序號有變才讀），
+    進球事件與背景統計寫回狀態區，波形直接寫進共享 ring。
+    """
+
+    def __init__(self, index: int, views, channel: int, holdoff_ms: int, min_width_ms: float, notify):
+        self.index = index
+        self._views = views
+        self._ctl_q = views.ctl_q
+        self._ctl_seen = -1
+        self._notify = notify
+        super().__init__(channel, views.ctl_d[0], views.ctl_d[1], holdoff_ms, min_width_ms,
+                         ring=SharedSampleRing(views))
+
+        # 取樣行程重開：事件序號與背景統計接著用（writer 寫到一半掛掉的話序號會停在奇數，先補回偶數）
+        if views.st_q[0] & 1:
+            views.st_q[0] += 1
+        st = views.st_d
+        self.seq = int(views.st_q[1])
+        self.calib.mean_v, self.calib.var_v, self.calib.peak_v, self.calib.idle_s = st[0], st[1], st[2], st[3]
+        self.last_event_peak_v, self.last_event_width_ms = st[4], st[5]
+
+    def _apply_control(self):
+        q, d = self._ctl_q, self._views.ctl_d
+        seen, enabled, gen, entry, release = _seqlock_read(q, lambda: (q[0], q[1], q[2], d[0], d[1]))
+        self._ctl_seen = seen
+        self.enabled = bool(enabled)
+        self._reset_gen = int(gen)
+        self.det.entry_v = float(entry)
+        self.det.release_v = float(release)
+
+    def _write_status(self):
+        st = self._views.st_d
+        c = self.calib
+        st[0], st[1], st[2], st[3] = c.mean_v, c.var_v, c.peak_v, c.idle_s
+        st[4], st[5] = self.last_event_peak_v, self.last_event_width_ms
+
+    def publish_status(self):
+        _seqlock_write(self._views.st_q, self._write_status)
+
+    def _publish_event(self, t_entry: float, t_release: float, peak_v: float, width_ms: float):
+        self.seq += 1
+        self.last_event_peak_v = float(peak_v)
+        self.last_event_width_ms = float(width_ms)
+        self.calib.observe_peak(peak_v)
+        seq = self.seq
+        views = self._views
+        base = ((seq - 1) % GOAL_EVENT_HISTORY) * _ShmBlock.EV_D
+
+        def write():
+            views.ev[base:base + _ShmBlock.EV_D] = array("d", (seq, t_entry, t_release, peak_v, width_ms, time.time()))
+            views.st_q[1] = seq
+            self._write_status()
+
+        _seqlock_write(views.st_q, write)
+        self._notify(self.index)
+
+    def feed(self, t: float, v: float):
+        if self._ctl_q[0] != self._ctl_seen:
+            self._apply_control()
+        HoopDetector.feed(self, t, v)
+
+class _ShmGoalDetector(GoalDetector):
+    """
+    取樣行程裡的 GoalDetector（直接在行程的主 thread 呼叫 run()）：
+    stop 旗標 / 目標取樣率每個週期讀共享表頭；每秒把取樣統計與背景統計寫回去，順便確認主行程還在。
+    """
 
-GAME_RUNNING = False
-PRE_COUNTDOWN_ACTIVE = False
-PRE_COUNTDOWN_VALUE = 0
+    def __init__(self, blk, hoops, parent_pid: int):
+        self._blk = blk
+        self._parent_pid = parent_pid
+        super().__init__(hoops, blk.rate[0])
+
+    @property
+    def _stopping(self):
+        return self._blk.stop[0] != 0
+
+    @_stopping.setter
+    def _stopping(self, flag):
+        if flag:
+            self._blk.stop[0] = 1
+
+    @property
+    def sample_rate_hz(self):
+        return self._blk.rate[0]
+
+    @sample_rate_hz.setter
+    def sample_rate_hz(self, hz):
+        self._blk.rate[0] = hz
+
+    def _publish_rate_window(self, t: float, hz_cnt: int, hz_t0: float, jit_max: float):
+        GoalDetector._publish_rate_window(self, t, hz_cnt, hz_t0, jit_max)
+        blk = self._blk
+
+        def write():
+            d = blk.stats_d
+            d[0], d[1], d[2], d[3] = self.last_eff_rate, self.jitter_p50_us, self.jitter_p99_us, self.jitter_max_us
+            blk.stats_q[1] = self.overruns
+
+        _seqlock_write(blk.stats_q, write)
+        for h in self.hoops:
+            h.publish_status()
+        if os.getppid() != self._parent_pid:
+            print("⚠️ sampler: parent process gone, exiting")
+            self._stopping = True
+
+class _ShmReadFailures:
+    """
+    取樣行程裡頂替 recorder 的位置：GoalDetector.run() 每次掃描（各籃框 feed 完）呼叫 push()，
+    把這次掃描的 ADC 是否讀取失敗記進 _ShmBlock.read_failed（主行程錄製時才能把失敗寫成 -1，而不是 0 V）。
+    """
 
-NEXT_GAME_HINT_ACTIVE = False
-NEXT_GAME_HINT_MESSAGE = ""
+    def __init__(self, blk, ring):
+        self._flags = blk.read_failed
+        self._ring = ring
 
-GAME1_SCORE = 0
-GAME2_SCORE = 0
-CURRENT_GAME_SCORE = 0
-ROUND_TOTAL_SCORE = 0
-REMAINING_TIME = 0
-ROUND_START_TIME_ISO = None
+    def push(self, t: float, raws):
+        ring = self._ring
+        self._flags[(ring.seq - 1) & ring._mask] = 0 if raws else 1
 
-BUTTON_PRESS_COUNT = 0  # 實體按鍵 debug
+def _sampler_process_main(shm_name: str, hw_name: str, channels, holdoff_ms: int, min_width_ms: float,
+                          conn, cpu: int, parent_pid: int):
+    """取樣行程的進入點（spawn 出來的新直譯器）：只開 SPI，跑取樣 + 進球判定。"""
+    global _HW, _spi
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # Ctrl-C 由主行程處理，再經 stop 旗標叫這裡停
+    if cpu >= 0:
+        try:
+            os.sched_setaffinity(0, {int(cpu)})
+        except (AttributeError, OSError) as e:
+            print(f"⚠️ sampler: cannot pin to CPU {cpu}:", e)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    blk = _ShmBlock(shm, len(channels), _ring_size(GOAL_RING_SIZE))
+    SAMPLER_LOOP_HIST.attach(blk.loop_hist)   # 重開後接著累加（Prometheus counter 不會倒退）
 
-# =========================
-# 倒數邏輯
-# =========================
-def pre_start_countdown():
-    global PRE_COUNTDOWN_ACTIVE, PRE_COUNTDOWN_VALUE
-    with STATE_LOCK:
-        if not GAME_RUNNING:
-            return
-        PRE_COUNTDOWN_ACTIVE = True
+    def notify(index: int):
+        conn.send_bytes(bytes((index,)))   # 主行程那端關了會丟 OSError，取樣迴圈就此結束
 
-    for val in [3, 2, 1]:
-        with STATE_LOCK:
-            if not GAME_RUNNING:
-                PRE_COUNTDOWN_ACTIVE = False
-                PRE_COUNTDOWN_VALUE = 0
-                return
-            PRE_COUNTDOWN_VALUE = val
+    try:
+        _HW = hal.load_backend(hw_name)
+        _spi = _setup_spi()
+        hoops = [
+            _ShmHoopDetector(i, blk.hoops[i], ch, holdoff_ms, min_width_ms, notify)
+            for i, ch in enumerate(channels)
+        ]
+        det = _ShmGoalDetector(blk, hoops, parent_pid)
+        det.recorder = _ShmReadFailures(blk, hoops[0].ring)
+        print(f"[SAMPLER] pid {os.getpid()} channels {list(channels)} cpu {sorted(os.sched_getaffinity(0))}")
+        det.run()
+    finally:
+        conn.close()
+        blk.close()
 
-        lcd_show_4_lines("", str(val), "", "", force=True)
-        _short_beep()
-        time.sleep(1.0)
+class ProcessHoop(HoopDetector):
+    """
+    主行程這邊的籃框（sampler_mode = "process"）：介面同 HoopDetector，GameSession / 狀態頁不用分兩種。
+    啟用 / 門檻寫進控制區；進球事件與背景統計由 ProcessGoalDetector 的事件 thread 呼叫 sync() 同步過來。
+    """
 
-    with STATE_LOCK:
-        if not GAME_RUNNING:
-            PRE_COUNTDOWN_ACTIVE = False
-            PRE_COUNTDOWN_VALUE = 0
+    def __init__(self, index: int, views, channel: int, entry_v: float, release_v: float,
+                 holdoff_ms: int, min_width_ms: float, on_goal=None):
+        self.index = index
+        self._views = views
+        super().__init__(channel, entry_v, release_v, holdoff_ms, min_width_ms, on_goal=on_goal,
+                         ring=SharedSampleRing(views))
+        self._write_control()
+
+    @property
+    def sensor_v(self):
+        ring = self.ring
+        head = ring.seq
+        return float(ring._v[(head - 1) & ring._mask]) if head else 0.0
+
+    @sensor_v.setter
+    def sensor_v(self, v):
+        pass   # 最新電壓就是 ring 的最後一筆
+
+    def detach(self):
+        """共享記憶體要關了：把 ring 複製成本地的 SampleRing，之後狀態頁 / 波形讀最後的數值，sync() 不再做事。"""
+        shared = self.ring
+        ring = SampleRing(shared.size)
+        ring._t[:] = array("d", shared._t)
+        ring._v[:] = array("f", shared._v)
+        ring.seq = shared.seq
+        self.ring = ring
+        self._views = None
+
+    def _write_control(self):
+        views = self._views
+        if views is None:
             return
-        PRE_COUNTDOWN_VALUE = 0
-
-    lcd_show_4_lines("", "GO!", "", "", force=True)
-    _long_beep()
-    time.sleep(0.5)
+        with self._lock:
+            def write():
+                views.ctl_q[1] = 1 if self.enabled else 0
+                views.ctl_q[2] = self._reset_gen
+                views.ctl_d[0] = self.det.entry_v
+                views.ctl_d[1] = self.det.release_v
+            _seqlock_write(views.ctl_q, write)
 
-    with STATE_LOCK:
-        PRE_COUNTDOWN_ACTIVE = False
-        PRE_COUNTDOWN_VALUE = 0
+    def set_enabled(self, flag: bool):
+        HoopDetector.set_enabled(self, flag)
+        self._write_control()
 
-# =========================
-# 單場 Game
-# =========================
-def play_single_game(game_index: int, mode: int):
-    global CURRENT_GAME_SCORE, ROUND_TOTAL_SCORE, REMAINING_TIME
-    global GAME1_SCORE, GAME2_SCORE
+    def set_thresholds(self, entry_v: float, release_v: float):
+        HoopDetector.set_thresholds(self, entry_v, release_v)
+        self._write_control()
 
-    # 每場開始先回中心，再進入模式（你要求開始/結束都回 90）
-    _servo_reset_to_center()
-    servo_set_mode(mode)
+    def apply_calibration(self, enabled: bool) -> bool:
+        self.sync()
+        return HoopDetector.apply_calibration(self, enabled)
 
-    with _goal._lock:
-        last_seq = _goal.seq
-    _goal.set_enabled(True)
+    def feed(self, t: float, v: float):
+        raise RuntimeError("ProcessHoop is fed by the sampler process")
 
-    CURRENT_GAME_SCORE = 0
-    REMAINING_TIME = int(GAME_TIME)
-    start_time = time.time()
+    def sync(self):
+        """從狀態區同步背景統計與新的進球事件；有新進球就呼叫 on_goal（在呼叫端的 thread 上）。"""
+        views = self._views
+        if views is None:
+            return
+        st_q, st_d, ev = views.st_q, views.st_d, views.ev
+        seq, st, evs = _seqlock_read(st_q, lambda: (int(st_q[1]), st_d.tolist(), ev.tolist()))
+        c = self.calib
+        c.mean_v, c.var_v, c.peak_v, c.idle_s = st[0], st[1], st[2], st[3]
 
-    while True:
-        with STATE_LOCK:
-            if not GAME_RUNNING:
-                break
+        with self._lock:
+            new = seq > self.seq
+            if new:
+                width = _ShmBlock.EV_D
+                for n in range(max(self.seq + 1, seq - GOAL_EVENT_HISTORY + 1), seq + 1):
+                    b = ((n - 1) % GOAL_EVENT_HISTORY) * width
+                    ev_seq, t_entry, t_release, peak_v, width_ms, wall = evs[b:b + width]
+                    if int(ev_seq) != n:
+                        continue
+                    ts = datetime.fromtimestamp(wall).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+                    self._events.append({
+                        "seq": n,
+                        "t_entry": t_entry,
+                        "t_release": t_release,
+                        "peak_v": float(peak_v),
+                        "width_ms": float(width_ms),
+                        "ts": ts,
+                    })
+                    self.last_event_ts = ts
+                    self.last_event_t = t_release
+                self.seq = seq
+                self.last_event_peak_v = float(st[4])
+                self.last_event_width_ms = float(st[5])
+        if new and self.on_goal is not None:
+            self.on_goal(self)
+
+class ProcessGoalDetector(GoalDetector):
+    """
+    sampler_mode = "process"：ADC 取樣 + 遲滯判定在另一個行程（spawn 出來的直譯器，自己的 GIL），
+    Flask / 遊戲迴圈 / LCD 再忙，也不會讓取樣延遲或漏掉 GOAL_MIN_WIDTH_MS 等級的短脈衝。
+    - 兩邊經 _ShmBlock（shared memory）交換；取樣行程進球時從 pipe 送 1 byte，
+      本 thread（主行程裡的事件 thread）被叫醒後同步事件、呼叫各籃框的 on_goal
+    - cpu >= 0 時取樣行程用 os.sched_setaffinity 釘在該核心
+    - 取樣行程意外結束會自動重開（事件序號、波形 ring、背景統計都在共享記憶體裡，接著用）
+    - 錄製（.bbt）由本 thread 從共享 ring 撈樣本寫入，不佔取樣行程
+    對外介面同 GoalDetector。
+    """
 
-        elapsed = time.time() - start_time
-        left = max(0, int(GAME_TIME) - int(elapsed))
-        REMAINING_TIME = left
+    def __init__(self, channels, sample_rate_hz: float = 0.0, cpu: int = -1):
+        ring_size = _ring_size(GOAL_RING_SIZE)
+        self._shm = shared_memory.SharedMemory(create=True, size=_ShmBlock.nbytes(len(channels), ring_size))
+        self._blk = _ShmBlock(self._shm, len(channels), ring_size)
+        SAMPLER_LOOP_HIST.attach(self._blk.loop_hist)   # /metrics 讀取樣行程寫的那份
+        self._hist_attached = True
+        hoops = [
+            ProcessHoop(i, self._blk.hoops[i], ch, GOAL_ENTRY_V, GOAL_RELEASE_V, GOAL_HOLDOFF_MS,
+                        GOAL_MIN_WIDTH_MS, on_goal=_on_extra_goal)
+            for i, ch in enumerate(channels)
+        ]
+        super().__init__(hoops, sample_rate_hz)
+        self._blk.rate[0] = self.sample_rate_hz
+        self.cpu = int(cpu)
+        self.proc = None
+        self.restarts = 0
+        self._conn = None
+        self._hw_name = _HW.name
+        self._rec_seq = 0
+        self._closed_debug = None   # close() 之後 get_debug() 回傳的最後數值
+
+    def set_sample_rate(self, hz: float):
+        GoalDetector.set_sample_rate(self, hz)
+        if self._closed_debug is None:
+            self._blk.rate[0] = self.sample_rate_hz
+
+    def start_recording(self, recorder):
+        self._rec_seq = min(h.ring.seq for h in self.hoops)
+        self.recorder = recorder
+
+    def _spawn(self):
+        ctx = multiprocessing.get_context("spawn")   # 不能 fork：主行程已經有一堆 thread 與鎖
+        recv, send = ctx.Pipe(duplex=False)
+        proc = ctx.Process(
+            target=_sampler_process_main,
+            name="goal-sampler",
+            args=(self._shm.name, self._hw_name, self._channels, GOAL_HOLDOFF_MS, GOAL_MIN_WIDTH_MS,
+                  send, self.cpu, os.getpid()),
+            daemon=True,
+        )
+        proc.start()
+        send.close()
+        self._conn, self.proc = recv, proc
+
+    def start(self):
+        self._spawn()
+        GoalDetector.start(self)
+
+    def stop(self):
+        if self._closed_debug is None:
+            self._blk.stop[0] = 1
+        self._stopping = True
+
+    def close(self):
+        """
+        等事件 thread 結束（重開等待 + 收掉取樣行程最多約 SAMPLER_RESTART_S + 1.5 秒）才放掉 memoryview 並關 mapping；
+        留到直譯器結束的話 SharedMemory.__del__ 會丟 BufferError。關之前先留下統計與各籃框的波形，狀態頁之後照樣能讀。
+        """
+        if self._closed_debug is not None:
+            return
+        if self.is_alive():   # 沒 start 過的 thread 不能 join
+            self.join(timeout=SAMPLER_RESTART_S + SAMPLER_SYNC_S + 2.0)
+        if self.is_alive():
+            print("⚠️ sampler event thread did not exit, shared memory left open")
+            return
+        self._closed_debug = self.get_debug()
+        for h in self.hoops:
+            h.detach()
+        # 事件 thread 沒 start 過（例如 sensor 階段中途失敗）就沒人 unlink / detach，這裡補做
+        self._release_hist()
+        self._unlink()
+        self._blk.close()
 
-        # 更新 SG90
-        servo_tick()
+    def get_debug(self):
+        if self._closed_debug is not None:
+            return dict(self._closed_debug, sampler_alive=False)
+        q, d = self._blk.stats_q, self._blk.stats_d
+        overruns, stats = _seqlock_read(q, lambda: (int(q[1]), d.tolist()))
+        proc = self.proc
+        return {
+            "last_eff_rate_hz": float(stats[0]),
+            "target_rate_hz": float(self.sample_rate_hz),
+            "jitter_p50_us": float(stats[1]),
+            "jitter_p99_us": float(stats[2]),
+            "jitter_max_us": float(stats[3]),
+            "overruns": overruns,
+            "sampler_mode": "process",
+            "sampler_pid": int(proc.pid or 0) if proc is not None else 0,
+            "sampler_alive": bool(proc is not None and proc.is_alive()),
+            "sampler_restarts": int(self.restarts),
+        }
 
-        # 進球事件
-        add = _goal.consume_since(last_seq)
-        if add > 0:
-            with _goal._lock:
-                last_seq = _goal.seq
-            CURRENT_GAME_SCORE += add
-            ROUND_TOTAL_SCORE += add
-            play_goal_sound()
+    def _drain_recorder(self, rec):
+        """
+        把共享 ring 裡還沒錄的掃描寫進 recorder（電壓換回原始 ADC 值；讀取失敗的掃描寫 None → -1）。
+        最新一筆先不錄：取樣行程推進 head 之後才寫它的失敗旗標。
+        """
+        rings = [h.ring for h in self.hoops]
+        head = min(r.seq for r in rings) - 1
+        first = rings[0]
+        start = max(self._rec_seq, head - first.size + 2)
+        mask = first._mask
+        failed = self._blk.read_failed
+        for n in range(start, head):
+            i = n & mask
+            rec.push(first._t[i], None if failed[i] else [int(round(r._v[i] / ADC_TO_V)) for r in rings])
+        self._rec_seq = max(self._rec_seq, head)
 
-        if game_index == 1:
-            GAME1_SCORE = CURRENT_GAME_SCORE
-        else:
-            GAME2_SCORE = CURRENT_GAME_SCORE
+    def run(self):
+        hoops = self.hoops
+        next_sync = 0.0
+        try:
+            while not self._stopping:
+                conn = self._conn
+                try:
+                    if conn.poll(SAMPLER_SYNC_S):
+                        data = conn.recv_bytes()
+                        while conn.poll(0):
+                            data += conn.recv_bytes()
+                        for i in set(data):
+                            if i < len(hoops):
+                                hoops[i].sync()
+                except (EOFError, OSError):
+                    time.sleep(SAMPLER_SYNC_S)   # 取樣行程那端關了；下面重開
+
+                now = time.monotonic()
+                if now >= next_sync:
+                    next_sync = now + SAMPLER_SYNC_S
+                    for h in hoops:
+                        h.sync()
+
+                if not self.proc.is_alive() and not self._stopping:
+                    print(f"⚠️ sampler process exited (code {self.proc.exitcode}), restarting")
+                    conn.close()
+                    time.sleep(SAMPLER_RESTART_S)
+                    if self._stopping:
+                        break
+                    self.restarts += 1
+                    self._spawn()
+
+                rec = self.recorder
+                if rec is not None:
+                    self._drain_recorder(rec)
+                self.scans += 1
+        except Exception as e:
+            print("⚠️ ProcessGoalDetector stopped:", e)
+        finally:
+            self._blk.stop[0] = 1
+            proc = self.proc
+            if proc is not None:
+                proc.join(timeout=1.0)
+                if proc.is_alive():
+                    proc.terminate()
+                    proc.join(timeout=0.5)
+            if self._conn is not None:
+                self._conn.close()
+            self._release_hist()
+            # 這裡只 unlink：狀態頁之後還可能讀到最後的數值，mapping 由 shutdown() 的 close() 關
+            self._unlink()
+
+    def _release_hist(self):
+        if self._hist_attached:
+            SAMPLER_LOOP_HIST.detach()   # 留住最後的數值，不讓 histogram 卡住 shared memory 的 mapping
+            self._hist_attached = False
+
+    def _unlink(self):
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
 
-        # LCD 顯示：第 3 行先顯示 Mode，再顯示秒數
-        line1 = _format_time_now_str()
-        line2 = f"ROUND {CURRENT_ROUND} GAME {game_index}"
-        line3 = f"MODE:{mode} LEFT:{left:02d}s"
-        line4 = f"GAME SCORE: {CURRENT_GAME_SCORE}"
-        lcd_show_4_lines(line1, line2, line3, line4)
+# 初始化區依設定（sessions / hoop_channels / sample_rate_hz / sampler_mode）建立
+_goal = None
+_IDLE_GOAL = None
 
-        if left <= 0:
-            break
+def _goal_or_idle(hoop):
+    """
+    回傳 (GoalDetector, HoopDetector) 給狀態頁用；init 還沒建立取樣（或 sensor 連退路都失敗）時
+    用一個沒啟動的空取樣器代替，數值都是預設 / 0，狀態頁不會因此 500。
+    """
+    global _IDLE_GOAL
+    if _goal is not None and hoop is not None:
+        return _goal, hoop
+    if _IDLE_GOAL is None:
+        _IDLE_GOAL = GoalDetector([HoopDetector(MCP3008_CHANNEL, GOAL_ENTRY_V, GOAL_RELEASE_V, GOAL_HOLDOFF_MS,
+                                                GOAL_MIN_WIDTH_MS)])
+    return _IDLE_GOAL, _IDLE_GOAL.hoops[0]
 
-        # 主迴圈小 sleep（servo_tick 內部有節流；這裡留給 OS 排程）
-        time.sleep(0.005)
+# =========================
+# 預設遊戲設定（game_config.json 頂層；各 session 可各自覆蓋）
+# =========================
+GAME1_MODE = 1
+GAME2_MODE = 2
+GAME_TIME = 30  # 預設每場 30 秒
+SOUND_MODE = "beep"       # "beep" / "cheer"
 
-    _goal.set_enabled(False)
-    _servo_reset_to_center()
+# 多機台（arena）：game_config.json 的 sessions 清單，一個元素是一台機台的硬體 + 設定，例如
+#   {"id": "A", "hoop_channel": 0, "servo_pin": 23, "buzzer_pin": 25, "button_pin": 17, "lcd_addr": "0x27"}
+# None = 沒設定，只有一個 "main"（單機版腳位）
+SESSION_SPECS = None
 
 # =========================
-# Game1 → Game2 過場
+# 狀態變更通知（給 /events SSE 推送）
 # =========================
-def game1_to_game2_transition():
-    global NEXT_GAME_HINT_ACTIVE, NEXT_GAME_HINT_MESSAGE
+_STATE_COND = threading.Condition()
+_STATE_CHANGE_SEQ = 0
+
+def _notify_state_changed():
+    """分數 / 倒數 / Round 開始結束 / 設定 等變更時呼叫，喚醒等待中的推送連線。"""
+    global _STATE_CHANGE_SEQ
+    with _STATE_COND:
+        _STATE_CHANGE_SEQ += 1
+        _STATE_COND.notify_all()
+
+def wait_state_change(last_seq: int, timeout: float) -> int:
+    """等到變更序號不等於 last_seq（或逾時），回傳目前序號。任何 session 有變更都會叫醒。"""
+    with _STATE_COND:
+        if _STATE_CHANGE_SEQ == last_seq:
+            _STATE_COND.wait(timeout)
+        return _STATE_CHANGE_SEQ
 
-    time.sleep(2.0)
+# =========================
+# 版本化狀態（/status 的 ETag / since= 差量）
+# =========================
+class StatusTracker:
+    """
+    每個 session 一個。每次取狀態時與上一份快照比對：有欄位變動就 version +1，並記錄每個欄位最後變動的版本。
+    - ETag = version，內容沒變就回 304
+    - since=v 只回 version > v 之後變動過的欄位
+    - history 區塊只在 HistoryStore.version 變了才重新取/比對
+    - 同一個 version 的 JSON body 只序列化一次
+    """
 
-    lcd_show_4_lines("", "", "", "", force=True)
-    _short_beep()
-    time.sleep(0.6)
+    def __init__(self, session):
+        self._session = session
+        self._lock = threading.Lock()
+        self.version = 0
+        self._snapshot = {}
+        self._key_ver = {}
+        self._history_ver = None
+        self._body = None
+        self._body_ver = -1
+
+    def refresh(self) -> int:
+        with self._lock:
+            hv = (id(_history), _history.version)
+            fields = self._session.status_fields(include_history=(hv != self._history_ver))
+            self._history_ver = hv
+
+            changed = [k for k, v in fields.items() if self._snapshot.get(k, _MISSING) != v]
+            if changed:
+                self.version += 1
+                now_iso = datetime.now().isoformat(timespec="seconds")
+                for k in changed:
+                    self._snapshot[k] = fields[k]
+                    self._key_ver[k] = self.version
+                self._snapshot["timestamp"] = now_iso
+                self._key_ver["timestamp"] = self.version
+            return self.version
+
+    def body(self):
+        """回傳 (version, 完整狀態 JSON bytes)；同版本重用快取。"""
+        self.refresh()
+        with self._lock:
+            if self._body_ver != self.version:
+                st = dict(self._snapshot)
+                st["status_version"] = self.version
+                self._body = json.dumps(st, ensure_ascii=False).encode("utf-8")
+                self._body_ver = self.version
+            return self._body_ver, self._body
+
+    def since(self, since_ver: int):
+        """回傳 (version, 變動欄位 dict, 是否為完整狀態)。since 比目前還新（例如伺服器重啟）就回完整狀態。"""
+        ver = self.refresh()
+        with self._lock:
+            if since_ver is None or since_ver < 0 or since_ver > ver:
+                changed, full = dict(self._snapshot), True
+            else:
+                changed = {k: self._snapshot[k] for k, kv in self._key_ver.items() if kv > since_ver}
+                full = False
+        return ver, changed, full
 
-    with STATE_LOCK:
-        NEXT_GAME_HINT_ACTIVE = True
-        NEXT_GAME_HINT_MESSAGE = "NEXT GAME"
+_MISSING = object()
 
-    lcd_show_4_lines("NEXT GAME", "", "", "", force=True)
-    time.sleep(1.0)
+# =========================
+# 遊戲 Session（一台機台一個）
+# =========================
+class GameSession:
+    """
+    一台機台：一個籃框（MCP3008 channel）+ 舵機 + 蜂鳴器 + LCD + Start 按鈕，以及它的 Round 狀態與流程。
+    - 舵機 / 蜂鳴器 / LCD thread 每個 session 各一組；取樣 thread（GoalDetector）與歷史紀錄全部共用
+    - 狀態欄位由 self.lock 保護；Round 流程在自己的 thread 上跑，各 session 可同時進行、互不等待
+    """
 
-    with STATE_LOCK:
-        NEXT_GAME_HINT_ACTIVE = False
-        NEXT_GAME_HINT_MESSAGE = ""
+    def __init__(self, sid: str, hoop_channel: int, servo_pin: int, buzzer_pin: int, button_pin: int,
+                 lcd_addr: int = LCD_ADDR, game1_mode: int = None, game2_mode: int = None,
+                 game_time: int = None, sound_mode: str = None):
+        self.id = str(sid)
+        self.hoop_channel = int(hoop_channel)
+        self.button_pin = int(button_pin)
+
+        self.lcd = LCDManager(lcd_addr, name=self.id)
+        self.buzzer = BuzzerEngine(buzzer_pin, name=self.id)
+        self.servo = ServoController(servo_pin, name=self.id)
+        self.hoop = None           # bind_hoop()：GoalDetector 上對應 channel 的 HoopDetector
+        self.extra_hoops = []      # 不屬於任何 session 的籃框（hoop_channels），跟預設 session 一起比賽
+        self.hoop_scores = {}      # 本場各籃框（channel）的分數：主籃框 = game_score，額外籃框各自計分（對戰用）
+
+        self.lock = metrics.TimedLock(LOCK_WAIT_HIST.labels("session", self.id))
+        self._m_goal_latency = GOAL_LATENCY_HIST.labels(self.id)
+        # Round 主迴圈的喚醒訊號：進球（取樣 thread）、stop() 會 set
+        self.wake = threading.Event()
+        self.tracker = StatusTracker(self)
+
+        # 設定（下一個 Round 生效）
+        self.game1_mode = int(GAME1_MODE if game1_mode is None else game1_mode)
+        self.game2_mode = int(GAME2_MODE if game2_mode is None else game2_mode)
+        self.game_time = int(GAME_TIME if game_time is None else game_time)
+        self.sound_mode = str(SOUND_MODE if sound_mode is None else sound_mode)
+
+        # Round 狀態
+        self.round = 0
+        self.game = 0              # 0/1/2
+        self.running = False
+        self.pre_countdown_active = False
+        self.pre_countdown_value = 0
+        self.next_hint_active = False
+        self.next_hint_message = ""
+        self.game1_score = 0
+        self.game2_score = 0
+        self.game_score = 0
+        self.round_total = 0
+        self.remaining_time = 0
+        self.round_start_iso = None
+        self.current_game_mode = 0
+        self.button_press_count = 0  # 實體按鍵 debug
+
+    @classmethod
+    def from_spec(cls, sp: dict):
+        return cls(sp["id"], sp["hoop_channel"], sp["servo_pin"], sp["buzzer_pin"], sp["button_pin"],
+                   sp["lcd_addr"], sp.get("game1_mode"), sp.get("game2_mode"),
+                   sp.get("game_time"), sp.get("sound_mode"))
+
+    def settings(self):
+        with self.lock:
+            return {
+                "game1_mode": int(self.game1_mode),
+                "game2_mode": int(self.game2_mode),
+                "game_time": int(self.game_time),
+                "sound_mode": str(self.sound_mode),
+            }
 
-    pre_start_countdown()
+    def spec(self):
+        """寫回 game_config.json sessions 清單的元素（腳位 + 目前設定）。"""
+        return {
+            "id": self.id,
+            "hoop_channel": self.hoop_channel,
+            "servo_pin": self.servo.pin,
+            "buzzer_pin": self.buzzer.pin,
+            "button_pin": self.button_pin,
+            "lcd_addr": hex(self.lcd.addr),
+            **self.settings(),
+        }
 
-# =========================
-# Round 主流程
-# =========================
-def round_thread(round_start_time_iso: str, g1_mode: int, g2_mode: int, g_time: int):
-    global CURRENT_ROUND, CURRENT_GAME, CURRENT_GAME_MODE
-    global GAME_RUNNING, ROUND_START_TIME_ISO
-    global GAME1_SCORE, GAME2_SCORE, CURRENT_GAME_SCORE, ROUND_TOTAL_SCORE, REMAINING_TIME
-    global GAME_TIME
+    # ---------- 裝置 ----------
+    def bind_hoop(self, hoop, extra=()):
+        self.hoop = hoop
+        self.extra_hoops = list(extra)
+        for h in [hoop] + self.extra_hoops:
+            h.on_goal = self._on_goal
+
+    def _on_goal(self, hoop):
+        # 取樣 thread 上呼叫：只叫醒自己的 Round 主迴圈
+        self.wake.set()
+        _notify_state_changed()
+
+    def lcd_show(self, l1="", l2="", l3="", l4="", force=False):
+        """丟一張畫面給 LCD render thread（不阻塞）；force=True 為優先畫面。"""
+        self.lcd.show(l1, l2, l3, l4, force=force)
+
+    def _short_beep(self):
+        self.buzzer.play("countdown")
+
+    def _long_beep(self):
+        self.buzzer.play("go")
+
+    def play_goal_sound(self):
+        """依 sound_mode 播放進球音效；可在遊戲中切換模式。不阻塞呼叫端。"""
+        self.buzzer.play("beep" if self.sound_mode == "beep" else "cheer", priority=BUZZER_PRIO_GOAL)
+
+    def servo_reset_to_center(self):
+        """強制回到 90 度（初始化、STOP、每場結束都呼叫）"""
+        self.current_game_mode = 1
+        self.servo.set_mode(1)
+
+    def servo_set_mode(self, mode: int):
+        """
+        Mode1：固定 90°
+        Mode2：45°~135° 等速來回
+        Mode3：30°~150° 不定速（隨機目標 + 隨機速度）
+        實際運動由 ServoController thread 以固定 50Hz 執行。
+        """
+        m = int(mode)
+        self.current_game_mode = m
+        self.servo.set_mode(m)
+
+    # ---------- 倒數 ----------
+    def pre_start_countdown(self):
+        with self.lock:
+            if not self.running:
+                return
+            self.pre_countdown_active = True
+
+        for val in [3, 2, 1]:
+            with self.lock:
+                if not self.running:
+                    self.pre_countdown_active = False
+                    self.pre_countdown_value = 0
+                    stopped = True
+                else:
+                    self.pre_countdown_value = val
+                    stopped = False
+            _notify_state_changed()
+            if stopped:
+                return
 
-    with STATE_LOCK:
-        if GAME_RUNNING:
+            self.lcd_show("", str(val), "", "", force=True)
+            self._short_beep()
+            time.sleep(1.0)
+
+        with self.lock:
+            stopped = not self.running
+            if stopped:
+                self.pre_countdown_active = False
+            self.pre_countdown_value = 0
+        _notify_state_changed()
+        if stopped:
             return
-        GAME_RUNNING = True
-        CURRENT_ROUND += 1
-        CURRENT_GAME = 0
-        CURRENT_GAME_MODE = 0
-        ROUND_START_TIME_ISO = round_start_time_iso
 
-        GAME1_SCORE = 0
-        GAME2_SCORE = 0
-        CURRENT_GAME_SCORE = 0
-        ROUND_TOTAL_SCORE = 0
-        REMAINING_TIME = 0
+        self.lcd_show("", "GO!", "", "", force=True)
+        self._long_beep()
+        time.sleep(0.5)
+
+        with self.lock:
+            self.pre_countdown_active = False
+            self.pre_countdown_value = 0
+        _notify_state_changed()
+
+    # ---------- 單場 Game ----------
+    def play_single_game(self, game_index: int, mode: int):
+        hoop = self.hoop
+
+        # 每場開始先回中心，再進入模式（你要求開始/結束都回 90）
+        self.servo_reset_to_center()
+        self.servo_set_mode(mode)
+
+        hoops = [hoop] + self.extra_hoops
+        last_seq = {}
+        for h in hoops:
+            with h._lock:
+                last_seq[h.channel] = h.seq
+            h.set_enabled(True)
+        scores = {h.channel: 0 for h in hoops}
+        self.hoop_scores = scores
+
+        self.game_score = 0
+        self.remaining_time = int(self.game_time)
+        start_time = time.monotonic()
+        _notify_state_changed()
+
+        # 事件驅動：只在 進球 / 倒數換秒（或 LCD 時鐘換秒）/ stop 時醒來
+        while True:
+            self.wake.clear()
+            with self.lock:
+                if not self.running:
+                    break
+
+            elapsed = time.monotonic() - start_time
+            left = max(0, int(self.game_time) - int(elapsed))
+            changed = (left != self.remaining_time)
+            self.remaining_time = left
+
+            # 進球事件：主籃框算進本 session 的分數，額外籃框只記在 hoop_scores
+            add = 0
+            for h in hoops:
+                with h._lock:
+                    seq = h.seq
+                    t_goal = h.last_event_t
+                n = max(0, seq - last_seq[h.channel])
+                if n == 0:
+                    continue
+                last_seq[h.channel] = seq
+                # 球離開感測器 → 計分（取樣行程的 perf_counter 與主行程同一個 CLOCK_MONOTONIC，可直接相減）
+                self._m_goal_latency.observe(time.perf_counter() - t_goal)
+                scores[h.channel] += n
+                changed = True
+                if h is hoop:
+                    add = n
+                else:
+                    self.play_goal_sound()
+            if add > 0:
+                self.game_score += add
+                self.round_total += add
+                changed = True
+                self.play_goal_sound()
+
+            if game_index == 1:
+                self.game1_score = self.game_score
+            else:
+                self.game2_score = self.game_score
 
-        GAME_TIME = int(g_time)
+            if changed:
+                _notify_state_changed()
 
-    try:
-        # Round 開始先回中心
-        _servo_reset_to_center()
+            # LCD 顯示：第 3 行先顯示 Mode，再顯示秒數
+            line1 = _format_time_now_str()
+            line2 = f"ROUND {self.round} GAME {game_index}"
+            line3 = f"MODE:{mode} LEFT:{left:02d}s"
+            line4 = f"GAME SCORE: {self.game_score}"
+            self.lcd_show(line1, line2, line3, line4)
 
-        # Game1
-        with STATE_LOCK:
-            CURRENT_GAME = 1
-            CURRENT_GAME_MODE = int(g1_mode)
+            if left <= 0:
+                break
 
-        pre_start_countdown()
-        with STATE_LOCK:
-            if not GAME_RUNNING:
-                raise RuntimeError("stopped during Game1 countdown")
+            # 睡到下一個整秒（倒數秒數或 LCD 第 1 行時鐘，取較近者），中途進球 / stop 會被叫醒
+            now_mono = time.monotonic()
+            next_left_tick = start_time + int(now_mono - start_time) + 1
+            wall = time.time()
+            next_clock_tick = now_mono + (int(wall) + 1 - wall)
+            self.wake.wait(max(0.0, min(next_left_tick, next_clock_tick) - now_mono))
 
-        play_single_game(1, int(g1_mode))
+        for h in hoops:
+            h.set_enabled(False)
+        self.servo_reset_to_center()
 
-        with STATE_LOCK:
-            if not GAME_RUNNING:
-                raise RuntimeError("stopped after Game1")
+    # ---------- Game1 → Game2 過場 ----------
+    def game1_to_game2_transition(self):
+        time.sleep(2.0)
 
-        # 過場
-        game1_to_game2_transition()
-        with STATE_LOCK:
-            if not GAME_RUNNING:
-                raise RuntimeError("stopped during transition")
+        self.lcd_show("", "", "", "", force=True)
+        self._short_beep()
+        time.sleep(0.6)
 
-        # Game2
-        with STATE_LOCK:
-            CURRENT_GAME = 2
-            CURRENT_GAME_MODE = int(g2_mode)
+        with self.lock:
+            self.next_hint_active = True
+            self.next_hint_message = "NEXT GAME"
+        _notify_state_changed()
 
-        play_single_game(2, int(g2_mode))
+        self.lcd_show("NEXT GAME", "", "", "", force=True)
+        time.sleep(1.0)
 
-        with STATE_LOCK:
-            if not GAME_RUNNING:
-                raise RuntimeError("stopped after Game2")
+        with self.lock:
+            self.next_hint_active = False
+            self.next_hint_message = ""
+        _notify_state_changed()
+
+        self.pre_start_countdown()
+
+    def apply_goal_calibration(self):
+        """
+        每場 Game 開始前：依背景統計更新自己籃框的門檻（auto_calibrate 關閉時回到預設門檻）。
+        不屬於任何 session 的額外籃框跟著預設 session 一起更新；別的 session 的籃框可能正在比賽，不動。
+        """
+        for h in [self.hoop] + self.extra_hoops:
+            if h.apply_calibration(GOAL_AUTO_CALIBRATE):
+                d = h.det
+                print(f"[CALIB] ch{h.channel} entry={d.entry_v:.2f}V release={d.release_v:.2f}V "
+                      f"(baseline={h.calib.mean_v:.2f}V)")
+        _notify_state_changed()
+
+    # ---------- Round 主流程 ----------
+    def round_thread(self, round_start_time_iso: str, g1_mode: int, g2_mode: int, g_time: int):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.round += 1
+            self.game = 0
+            self.current_game_mode = 0
+            self.round_start_iso = round_start_time_iso
 
-        # Round 結束畫面
-        time.sleep(2.0)
-        line1 = _format_time_now_str()
-        line2 = f"ROUND {CURRENT_ROUND} GAME 2"
-        line3 = "Round End"
-        line4 = f"ROUND SCORE:{ROUND_TOTAL_SCORE}"
-        lcd_show_4_lines(line1, line2, line3, line4, force=True)
-
-        entry = {
-            "round_id": int(CURRENT_ROUND),
-            "start_time": str(ROUND_START_TIME_ISO),
-            "game1_mode": int(g1_mode),
-            "game2_mode": int(g2_mode),
-            "game1_score": int(GAME1_SCORE),
-            "game2_score": int(GAME2_SCORE),
-            "round_total_score": int(ROUND_TOTAL_SCORE),
-        }
-        save_round_history_entry(entry)
+            self.game1_score = 0
+            self.game2_score = 0
+            self.game_score = 0
+            self.round_total = 0
+            self.remaining_time = 0
 
-    except Exception as e:
-        print("[ROUND] stopped or error:", e)
+            self.game_time = int(g_time)
+        _notify_state_changed()
 
-    finally:
-        with STATE_LOCK:
-            GAME_RUNNING = False
-            CURRENT_GAME = 0
-            CURRENT_GAME_MODE = 0
-            REMAINING_TIME = 0
-        _goal.set_enabled(False)
-        _servo_reset_to_center()
+        try:
+            # Round 開始先回中心
+            self.servo_reset_to_center()
+            self.apply_goal_calibration()
+
+            # Game1
+            with self.lock:
+                self.game = 1
+                self.current_game_mode = int(g1_mode)
+            _notify_state_changed()
+
+            self.pre_start_countdown()
+            with self.lock:
+                if not self.running:
+                    raise RuntimeError("stopped during Game1 countdown")
+
+            self.play_single_game(1, int(g1_mode))
+
+            with self.lock:
+                if not self.running:
+                    raise RuntimeError("stopped after Game1")
+
+            # 過場（球已停、還沒開始倒數：趁這時更新門檻）
+            self.apply_goal_calibration()
+            self.game1_to_game2_transition()
+            with self.lock:
+                if not self.running:
+                    raise RuntimeError("stopped during transition")
+
+            # Game2
+            with self.lock:
+                self.game = 2
+                self.current_game_mode = int(g2_mode)
+            _notify_state_changed()
+
+            self.play_single_game(2, int(g2_mode))
+
+            with self.lock:
+                if not self.running:
+                    raise RuntimeError("stopped after Game2")
+
+            # Round 結束畫面
+            time.sleep(2.0)
+            line1 = _format_time_now_str()
+            line2 = f"ROUND {self.round} GAME 2"
+            line3 = "Round End"
+            line4 = f"ROUND SCORE:{self.round_total}"
+            self.lcd_show(line1, line2, line3, line4, force=True)
+
+            entry = {
+                "round_id": int(self.round),
+                "start_time": str(self.round_start_iso),
+                "game1_mode": int(g1_mode),
+                "game2_mode": int(g2_mode),
+                "game1_score": int(self.game1_score),
+                "game2_score": int(self.game2_score),
+                "round_total_score": int(self.round_total),
+                "session": self.id,
+            }
+            save_round_history_entry(entry)
 
-# =========================
-# 提供給 Flask 的 API
-# =========================
-def start_game():
-    global GAME1_MODE, GAME2_MODE, GAME_TIME
-    with STATE_LOCK:
-        if GAME_RUNNING:
+        except Exception as e:
+            print(f"[ROUND {self.id}] stopped or error:", e)
+
+        finally:
+            with self.lock:
+                self.running = False
+                self.game = 0
+                self.current_game_mode = 0
+                self.remaining_time = 0
+            _notify_state_changed()
+            self._disable_hoops()
+            self.servo_reset_to_center()
+
+    # ---------- 操作 ----------
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            g1 = int(self.game1_mode)
+            g2 = int(self.game2_mode)
+            gt = int(self.game_time)
+
+        round_start_time_iso = datetime.now().isoformat(timespec="seconds")
+        t = threading.Thread(
+            target=self.round_thread,
+            args=(round_start_time_iso, g1, g2, gt),
+            daemon=True,
+        )
+        t.start()
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+        self.wake.set()
+        _notify_state_changed()
+        self._disable_hoops()
+        self.servo_reset_to_center()
+
+    def _disable_hoops(self):
+        if self.hoop is None:
+            return   # sensor 沒初始化成功
+        for h in [self.hoop] + self.extra_hoops:
+            h.set_enabled(False)
+
+    def press_button(self):
+        with self.lock:
+            self.button_press_count += 1
+            count = self.button_press_count
+        print(f"[BUTTON] {self.id} pressed, count={count} → start()")
+        self.start()
+
+    def set_sound_mode(self, mode: str):
+        if mode not in ("beep", "cheer"):
             return
-        g1 = int(GAME1_MODE)
-        g2 = int(GAME2_MODE)
-        gt = int(GAME_TIME)
-
-    round_start_time_iso = datetime.now().isoformat(timespec="seconds")
-    t = threading.Thread(
-        target=round_thread,
-        args=(round_start_time_iso, g1, g2, gt),
-        daemon=True,
-    )
-    t.start()
-
-def stop_game():
-    global GAME_RUNNING
-    with STATE_LOCK:
-        GAME_RUNNING = False
-    _goal.set_enabled(False)
-    _servo_reset_to_center()
-
-def set_sound_mode(mode: str):
-    global SOUND_MODE
-    if mode not in ("beep", "cheer"):
-        return
-    with STATE_LOCK:
-        SOUND_MODE = mode
-    _save_config()
-
-def set_mute(muted: bool):
-    global SOUND_ENABLED
-    with STATE_LOCK:
-        SOUND_ENABLED = (not muted)
+        with self.lock:
+            self.sound_mode = mode
+        _save_config()
+        _notify_state_changed()
+
+    def set_mute(self, muted: bool):
+        with self.lock:
+            self.buzzer.muted = bool(muted)
         if muted:
-            _buzzer_off()
-
-def set_game_time(seconds: int):
-    global GAME_TIME
-    try:
-        s = int(seconds)
-    except Exception:
-        return
-    s = max(3, min(3600, s))
-    with STATE_LOCK:
-        GAME_TIME = s
-    _save_config()
-
-def set_game_modes(game1_mode: int, game2_mode: int):
-    global GAME1_MODE, GAME2_MODE
-    try:
-        g1 = int(game1_mode)
-        g2 = int(game2_mode)
-    except Exception:
-        return
-    if g1 not in (1, 2, 3) or g2 not in (1, 2, 3):
-        return
-    with STATE_LOCK:
-        GAME1_MODE = g1
-        GAME2_MODE = g2
-    _save_config()
+            self.buzzer.stop_all()
+        _notify_state_changed()
 
-def get_status():
-    with STATE_LOCK:
-        history_recent, history_best = get_history_summary()
-        dbg = _goal.get_debug()
+    def set_game_time(self, seconds: int):
+        try:
+            s = int(seconds)
+        except Exception:
+            return
+        s = max(3, min(3600, s))
+        with self.lock:
+            self.game_time = s
+        _save_config()
+        _notify_state_changed()
 
-        status = {
-            "round": int(CURRENT_ROUND),
-            "game": int(CURRENT_GAME),
+    def set_game_modes(self, game1_mode: int, game2_mode: int):
+        try:
+            g1 = int(game1_mode)
+            g2 = int(game2_mode)
+        except Exception:
+            return
+        if g1 not in (1, 2, 3) or g2 not in (1, 2, 3):
+            return
+        with self.lock:
+            self.game1_mode = g1
+            self.game2_mode = g2
+        _save_config()
+        _notify_state_changed()
+
+    # ---------- 狀態 ----------
+    def status_fields(self, include_history: bool = True):
+        """
+        /status 的版本化欄位（不含 timestamp）：只有遊戲狀態、設定、進球事件、歷史會變，
+        閒置時內容完全不變（ETag / since= 才有意義）。一直在跳的量測值放 debug_fields()。
+        include_history=False 時不取歷史區塊。
+        """
+        goal, hoop = _goal_or_idle(self.hoop)
+        with self.lock:
+            dbg = hoop.get_debug()
+            rec = goal.recorder
+            trace = rec.get_stats() if rec is not None else None
+
+            status = {
+                "session_id": self.id,
+                "round": int(self.round),
+                "game": int(self.game),
+
+                "score": int(self.game_score),
+                "round_total": int(self.round_total),
+
+                "game1_mode": int(self.game1_mode),
+                "game2_mode": int(self.game2_mode),
+                "current_game_mode": int(self.current_game_mode),
+
+                "game1_score": int(self.game1_score),
+                "game2_score": int(self.game2_score),
+                "hoop_scores": {str(ch): int(n) for ch, n in self.hoop_scores.items()},
+                "remaining_time": int(self.remaining_time),
+
+                "running": bool(self.running or self.pre_countdown_active),
+                "sound_mode": str(self.sound_mode),
+                "muted": bool(self.buzzer.muted),
+                "game_time": int(self.game_time),
+
+                "pre_countdown_active": bool(self.pre_countdown_active),
+                "pre_countdown_value": int(self.pre_countdown_value),
+
+                "next_game_hint_active": bool(self.next_hint_active),
+                "next_game_hint_message": str(self.next_hint_message),
+
+                "round_start_time": self.round_start_iso,
+
+                "button_press_count": int(self.button_press_count),
+                "hw_backend": str(_HW.name),
+                "startup": _lifecycle.get_stats(),
+
+                # 進球判定設定 + 最後一個進球（只在進球 / 換門檻時變）
+                "goal_entry_v": float(dbg["entry_v"]),
+                "goal_release_v": float(dbg["release_v"]),
+                "goal_holdoff_ms": int(dbg["holdoff_ms"]),
+                "goal_min_width_ms": float(dbg["min_width_ms"]),
+                "goal_event_seq": int(dbg["event_seq"]),
+                "goal_auto_calibrate": bool(GOAL_AUTO_CALIBRATE),
+                "last_event_peak_v": float(dbg["last_event_peak_v"]),
+                "last_event_width_ms": float(dbg["last_event_width_ms"]),
+                "last_event_ts": str(dbg["last_event_ts"]),
+                "sensor_target_rate_hz": float(goal.sample_rate_hz),
+                "sensor_sampler_mode": "process" if isinstance(goal, ProcessGoalDetector) else "thread",
+
+                # 原始波形錄製 / 場館排行榜上傳（開關）
+                "trace_recording": trace is not None,
+                "trace_file": os.path.basename(trace["file"]) if trace else "",
+                "cabinet_id": str(CABINET_ID),
+                "upload_enabled": _uploader is not None,
+            }
 
-            "score": int(CURRENT_GAME_SCORE),
-            "round_total": int(ROUND_TOTAL_SCORE),
+        if include_history:
+            history_recent, history_best = get_history_summary()
+            status["history_recent"] = history_recent
+            status["history_best"] = int(history_best)
+        return status
+
+    def debug_fields(self):
+        """量測值（電壓、背景統計、取樣率 / 延遲、舵機 / LCD 計數…）：每次都不一樣，不算進 /status 的版本。"""
+        goal, hoop = _goal_or_idle(self.hoop)
+        with self.lock:
+            dbg = dict(hoop.get_debug(), **goal.get_debug())
+            hoops = [h.get_debug() for h in goal.hoops]
+            servo = self.servo.get_stats()
+            lcd = self.lcd.get_stats()
+            rec = goal.recorder
+            trace = rec.get_stats() if rec is not None else None
+            upload = _uploader.get_stats() if _uploader is not None else None
 
-            "game1_mode": int(GAME1_MODE),
-            "game2_mode": int(GAME2_MODE),
-            "current_game_mode": int(CURRENT_GAME_MODE),
+            return {
+                # IR debug
+                "sensor_v": float(dbg["sensor_v"]),
+                "goal_baseline_v": float(dbg["baseline_v"]),
+                "goal_baseline_std_v": float(dbg["baseline_std_v"]),
+                "goal_calib_ready": bool(dbg["calib_ready"]),
+                "goal_calib_entry_v": float(dbg["calib_entry_v"]),
+                "goal_calib_release_v": float(dbg["calib_release_v"]),
+                "sensor_eff_rate_hz": float(dbg["last_eff_rate_hz"]),
+                "sensor_jitter_p50_us": float(dbg["jitter_p50_us"]),
+                "sensor_jitter_p99_us": float(dbg["jitter_p99_us"]),
+                "sensor_jitter_max_us": float(dbg["jitter_max_us"]),
+                "sensor_overruns": int(dbg["overruns"]),
+                "sensor_sampler_pid": int(dbg["sampler_pid"]),
+                "sensor_sampler_alive": bool(dbg["sampler_alive"]),
+                "sensor_sampler_restarts": int(dbg["sampler_restarts"]),
+                "hoops": hoops,
+
+                # 原始波形錄製
+                "trace_samples": int(trace["samples"]) if trace else 0,
+                "trace_dropped": int(trace["dropped"]) if trace else 0,
+
+                # 場館排行榜上傳
+                "upload_acked_seq": int(upload["acked_seq"]) if upload else 0,
+                "upload_pending": int(upload["pending"]) if upload else 0,
+                "upload_last_error": str(upload["last_error"]) if upload else "",
+
+                # SG90 motion thread
+                "servo_angle": float(self.servo.angle),
+                "servo_rate_hz": float(servo["rate_hz"]),
+                "servo_ticks": int(servo["ticks"]),
+                "servo_missed_deadlines": int(servo["missed"]),
+                "servo_jitter_avg_ms": float(servo["jitter_avg_ms"]),
+                "servo_jitter_p99_ms": float(servo["jitter_p99_ms"]),
+                "servo_jitter_max_ms": float(servo["jitter_max_ms"]),
+
+                # LCD render thread
+                "lcd_queue_depth": int(lcd["queue_depth"]),
+                "lcd_frames_drawn": int(lcd["drawn"]),
+                "lcd_frames_dropped": int(lcd["dropped"]),
+                "lcd_write_ms_last": float(lcd["write_ms_last"]),
+                "lcd_write_ms_avg": float(lcd["write_ms_avg"]),
+                "lcd_write_ms_max": float(lcd["write_ms_max"]),
+            }
 
-            "game1_score": int(GAME1_SCORE),
-            "game2_score": int(GAME2_SCORE),
-            "remaining_time": int(REMAINING_TIME),
+    def get_status(self):
+        """完整狀態（版本化欄位 + 量測值），給 SSE 與不走 ETag 的呼叫端。"""
+        status = self.status_fields()
+        status.update(self.debug_fields())
+        status["timestamp"] = datetime.now().isoformat(timespec="seconds")
+        return status
+
+# init() 時依 SESSION_SPECS 建立；第一個是預設 session（不帶 session id 的 API 都作用在它上面）
+_sessions = []
+_sessions_by_id = {}
+
+class UnknownSessionError(KeyError):
+    """session id 不存在（app.py 轉成 404）。"""
+
+def _build_sessions():
+    global _sessions, _sessions_by_id
+    _sessions = [GameSession.from_spec(sp) for sp in _session_specs()]
+    _sessions_by_id = {s.id: s for s in _sessions}
+
+def get_session(session_id: str = None) -> GameSession:
+    """session_id 省略 = 預設 session；不存在丟 UnknownSessionError。"""
+    if session_id is None:
+        return _sessions[0]
+    sess = _sessions_by_id.get(str(session_id))
+    if sess is None:
+        raise UnknownSessionError(session_id)
+    return sess
+
+def list_sessions():
+    """各 session 的摘要（給 /sessions）。"""
+    out = []
+    for s in _sessions:
+        with s.lock:
+            out.append({
+                "id": s.id,
+                "hoop_channel": s.hoop_channel,
+                "running": bool(s.running or s.pre_countdown_active),
+                "round": int(s.round),
+                "game": int(s.game),
+                "round_total": int(s.round_total),
+                "remaining_time": int(s.remaining_time),
+            })
+    return out
 
-            "running": bool(GAME_RUNNING or PRE_COUNTDOWN_ACTIVE),
-            "sound_mode": str(SOUND_MODE),
-            "muted": bool(not SOUND_ENABLED),
-            "game_time": int(GAME_TIME),
+# =========================
+# 提供給 Flask 的 API（session_id 省略 = 預設 session）
+# =========================
+def start_game(session_id: str = None):
+    get_session(session_id).start()
 
-            "pre_countdown_active": bool(PRE_COUNTDOWN_ACTIVE),
-            "pre_countdown_value": int(PRE_COUNTDOWN_VALUE),
+def stop_game(session_id: str = None):
+    get_session(session_id).stop()
 
-            "next_game_hint_active": bool(NEXT_GAME_HINT_ACTIVE),
-            "next_game_hint_message": str(NEXT_GAME_HINT_MESSAGE),
+def set_sound_mode(mode: str, session_id: str = None):
+    get_session(session_id).set_sound_mode(mode)
 
-            "round_start_time": ROUND_START_TIME_ISO,
+def set_mute(muted: bool, session_id: str = None):
+    get_session(session_id).set_mute(muted)
 
-            "history_recent": history_recent,
-            "history_best": int(history_best),
+def set_game_time(seconds: int, session_id: str = None):
+    get_session(session_id).set_game_time(seconds)
 
-            "button_press_count": int(BUTTON_PRESS_COUNT),
+def set_game_modes(game1_mode: int, game2_mode: int, session_id: str = None):
+    get_session(session_id).set_game_modes(game1_mode, game2_mode)
 
-            # IR debug
-            "sensor_v": float(dbg["sensor_v"]),
-            "goal_entry_v": float(dbg["entry_v"]),
-            "goal_release_v": float(dbg["release_v"]),
-            "goal_holdoff_ms": int(dbg["holdoff_ms"]),
-            "goal_min_width_ms": float(dbg["min_width_ms"]),
-            "goal_event_seq": int(dbg["event_seq"]),
-            "last_event_peak_v": float(dbg["last_event_peak_v"]),
-            "last_event_width_ms": float(dbg["last_event_width_ms"]),
-            "last_event_ts": str(dbg["last_event_ts"]),
-            "sensor_eff_rate_hz": float(dbg["last_eff_rate_hz"]),
+def set_auto_calibrate(enabled: bool):
+    """開關門檻自動校正（所有籃框）；各 session 下一場 Game 開始前生效。"""
+    global GOAL_AUTO_CALIBRATE
+    GOAL_AUTO_CALIBRATE = bool(enabled)
+    _save_config()
+    _notify_state_changed()
+
+def start_trace_recording():
+    """開始把所有籃框 channel 的原始 ADC 錄進 TRACE_DIR；已在錄就不動。"""
+    global TRACE_RECORD
+    if _goal.recorder is None:
+        _goal.start_recording(TraceRecorder(TRACE_DIR, [h.channel for h in _goal.hoops], ADC_TO_V))
+    TRACE_RECORD = True
+    _save_config()
+    _notify_state_changed()
 
-            "timestamp": datetime.now().isoformat(timespec="seconds"),
-        }
-    return status
+def stop_trace_recording():
+    global TRACE_RECORD
+    _goal.stop_recording()
+    TRACE_RECORD = False
+    _save_config()
+    _notify_state_changed()
+
+def get_status(session_id: str = None):
+    return get_session(session_id).get_status()
+
+def get_goal_traces(n: int = 5, pre_ms: float = 100.0, post_ms: float = 100.0, channel: int = None):
+    """最近 n 個進球前後的原始 IR 波形（調 GOAL_ENTRY_V / GOAL_RELEASE_V 用）。"""
+    n = max(1, min(GOAL_EVENT_HISTORY, int(n)))
+    pre_ms = max(0.0, min(2000.0, float(pre_ms)))
+    post_ms = max(0.0, min(2000.0, float(post_ms)))
+    hoop = get_session().hoop if channel is None else _goal.hoop(channel)
+    return hoop.get_traces(n, pre_ms, post_ms)
+
+def get_waveform(ms: float = 500.0, channel: int = None):
+    """最近 ms 毫秒的原始 IR 波形。"""
+    hoop = get_session().hoop if channel is None else _goal.hoop(channel)
+    return hoop.get_waveform(max(1.0, min(5000.0, float(ms))))
+
+def get_status_body(session_id: str = None):
+    return get_session(session_id).tracker.body()
+
+def get_status_since(since_ver: int, session_id: str = None):
+    return get_session(session_id).tracker.since(since_ver)
+
+def get_status_debug(session_id: str = None):
+    """不算版本的量測值（/status/debug）。"""
+    return get_session(session_id).debug_fields()
+
+def _collect_metrics():
+    """/metrics 被抓時才跑：把既有的統計（取樣率、overrun、進球數、LCD 丟幀、舵機漏拍、上傳積壓）轉成指標。"""
+    yield ("basketball_info", "gauge", "Cabinet identity (value is always 1)",
+           [({"cabinet": CABINET_ID, "hw": _HW.name if _HW else "",
+              "sampler_mode": "process" if isinstance(_goal, ProcessGoalDetector) else "thread"}, 1)])
+    if _goal is not None:
+        dbg = _goal.get_debug()
+        yield ("basketball_sampler_rate_hz", "gauge", "Effective sampler scan rate over the last second",
+               [({}, dbg["last_eff_rate_hz"])])
+        yield ("basketball_sampler_target_rate_hz", "gauge", "Configured sampler scan rate (0 = free running)",
+               [({}, dbg["target_rate_hz"])])
+        yield ("basketball_sampler_overruns_total", "counter", "Sampler cycles that fell more than one period behind",
+               [({}, dbg["overruns"])])
+        yield ("basketball_sampler_restarts_total", "counter", "Sampler process restarts (process mode)",
+               [({}, dbg["sampler_restarts"])])
+        yield ("basketball_sampler_up", "gauge", "Whether the sampler thread / process is running",
+               [({}, 1 if dbg["sampler_alive"] else 0)])
+        yield ("basketball_goal_events_total", "counter", "Goal events detected per hoop channel",
+               [({"channel": str(h.channel)}, h.seq) for h in _goal.hoops])
+    sessions = list(_sessions)
+    lcd = [(s.id, s.lcd.get_stats()) for s in sessions]
+    servo = [(s.id, s.servo.get_stats()) for s in sessions]
+    yield ("basketball_lcd_frames_dropped_total", "counter", "LCD frames replaced before being drawn",
+           [({"session": sid}, st["dropped"]) for sid, st in lcd])
+    yield ("basketball_servo_missed_deadlines_total", "counter", "Servo ticks skipped because the thread ran late",
+           [({"session": sid}, st["missed"]) for sid, st in servo])
+    yield ("basketball_round_running", "gauge", "Whether a round is in progress",
+           [({"session": s.id}, 1 if s.running else 0) for s in sessions])
+    if _uploader is not None:
+        up = _uploader.get_stats()
+        yield ("basketball_upload_pending", "gauge", "Rounds waiting to be uploaded to the aggregator",
+               [({}, up["pending"])])
+        yield ("basketball_upload_errors_total", "counter", "Failed uploads to the aggregator",
+               [({}, up["errors"])])
+
+metrics.register_collector(_collect_metrics)
+
+def get_metrics_text() -> str:
+    """Prometheus text format（GET /metrics）。"""
+    return metrics.render()
 
 # =========================
 # 實體 Start 按鈕監聽
 # =========================
-GPIO.setup(START_BUTTON_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+_BUTTON_STOP = threading.Event()
+
+def _acquire_instance_lock():
+    """
+    拿行程層級的獨占鎖（flock，行程結束自動釋放）；已被別的行程拿走就丟 RuntimeError。
+    回傳要一直開著的檔案物件；沒有 fcntl 的平台（Windows）不檢查。
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return None
+    f = open(INSTANCE_LOCK_FILE, "a+")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.seek(0)
+        owner = f.read().strip() or "?"
+        f.close()
+        raise RuntimeError(f"hardware already owned by pid {owner} ({INSTANCE_LOCK_FILE})")
+    f.seek(0)
+    f.truncate()
+    f.write(str(os.getpid()))
+    f.flush()
+    return f
 
 def start_button_monitor_loop():
-    global BUTTON_PRESS_COUNT
-    last_pressed = 0.0
-    print("[BUTTON] monitor started, waiting for GPIO 17 LOW ...")
-    while True:
+    """一個 thread 輪詢所有 session 的 Start 按鈕；看下降緣，按住不放不會擋住別台的按鈕。"""
+    sessions = list(_sessions)
+    last_pressed = {s.id: 0.0 for s in sessions}
+    held = set()
+    pins = ", ".join(f"{s.id}=GPIO {s.button_pin}" for s in sessions)
+    print(f"[BUTTON] monitor started, waiting for LOW ({pins}) ...")
+    while not _BUTTON_STOP.is_set():
         try:
-            if GPIO.input(START_BUTTON_PIN) == GPIO.LOW:
+            for s in sessions:
+                if GPIO.input(s.button_pin) != GPIO.LOW:
+                    held.discard(s.id)
+                    continue
+                if s.id in held:
+                    continue
+                held.add(s.id)
                 now = time.time()
-                if now - last_pressed > 0.8:
-                    last_pressed = now
-                    BUTTON_PRESS_COUNT += 1
-                    print(f"[BUTTON] pressed, count={BUTTON_PRESS_COUNT} → start_game()")
-                    start_game()
-
-                while GPIO.input(START_BUTTON_PIN) == GPIO.LOW:
-                    time.sleep(0.03)
+                if now - last_pressed[s.id] > 0.8:
+                    last_pressed[s.id] = now
+                    s.press_button()
 
             time.sleep(0.03)
         except Exception as e:
@@ -972,11 +3432,245 @@ def start_button_monitor_loop():
             time.sleep(0.3)
 
 # =========================
-# 初始化
+# 初始化 / 關閉（生命週期）
 # =========================
-_load_config()
-_goal.start()
-threading.Thread(target=start_button_monitor_loop, daemon=True).start()
+def _init_hal():
+    global _HW, _ON_RPI, GPIO
+    _HW = hal.load_backend()
+    _ON_RPI = _HW.name == "rpi"
+    GPIO = _HW.GPIO
+    GPIO.setwarnings(False)
+    GPIO.setmode(GPIO.BCM)
+    print(f"[HW] backend = {_HW.name}")
+
+def _init_sessions():
+    _build_sessions()
+    print(f"[INIT] sessions = {[s.id for s in _sessions]}")
+
+def _init_lcd():
+    for s in _sessions:
+        s.lcd.start()   # I2C LCD 初始化在 render thread 內做，完成前的畫面照樣排隊
+        s.lcd_show("Basketball Ready", "", "", "", force=True)
+
+def _init_buzzer():
+    for s in _sessions:
+        s.buzzer.open()
+        s.buzzer.start()
+
+def _init_servo():
+    for s in _sessions:
+        s.servo.open()
+        s.servo.start()
+        s.servo_reset_to_center()
+
+def _bind_hoops():
+    owned = {s.hoop_channel for s in _sessions}
+    extra = [h for h in _goal.hoops if h.channel not in owned]
+    for i, s in enumerate(_sessions):
+        # hoop_channels 裡不屬於任何 session 的籃框跟預設 session 一起比賽（同一個 Round，各自計分）
+        s.bind_hoop(_goal.hoop(s.hoop_channel), extra if i == 0 else ())
+
+def _init_sensor():
+    global _spi, _goal
+    if SAMPLER_MODE == "thread":
+        _spi = _setup_spi()    # process 模式只有取樣行程開 SPI
+    _goal = _make_goal_detector(_scan_channels(_session_specs()))
+    _bind_hoops()
+    _goal.start()
+    if TRACE_RECORD:
+        _goal.start_recording(TraceRecorder(TRACE_DIR, [h.channel for h in _goal.hoops], ADC_TO_V))
+
+def _init_sensor_fallback():
+    """
+    sensor 階段失敗時：改用 DummySPI（永遠無訊號）+ thread 取樣，遊戲流程 / 狀態頁照常（不會進球）。
+    取樣已經在跑（失敗的是之後的步驟，例如開錄製檔）就不換。
+    """
+    global _spi, _goal
+    if _goal is not None:
+        if _goal.is_alive():
+            return
+        _goal.stop()
+        _goal.close()   # process 模式：放掉 shared memory，不然每次降級開機都在 /dev/shm 留一塊
+    _spi = hal.DummySPI()
+    _goal = _make_goal_detector(_scan_channels(_session_specs()), mode="thread")
+    _bind_hoops()
+    _goal.start()
+    print("⚠️ sensor unavailable, running with a dummy ADC (no goals will be detected)")
+
+def _init_history():
+    global _history
+    store = _make_history_store()
+    store.start()
+    with store._lock:
+        store._ensure_loaded()   # JSONL 是 lazy 載入：趁這時讀，不要拖到第一次 /status
+    _history = store
+
+def _init_uploader():
+    global _uploader
+    if not AGGREGATOR_URL:
+        return
+    _uploader = RoundUploader(AGGREGATOR_URL, CABINET_ID, UPLOAD_STATE_FILE, backlog=_history.records_after,
+                              epoch=_history.get_epoch())
+    _uploader.start()
+    print(f"[UPLOAD] cabinet {CABINET_ID} → {AGGREGATOR_URL} (acked seq {_uploader.acked_seq})")
+
+def _init_button():
+    for s in _sessions:
+        GPIO.setup(s.button_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+    threading.Thread(target=start_button_monitor_loop, daemon=True).start()
+
+class Lifecycle:
+    """
+    init()：config → sessions → 硬體後端，之後各裝置互不相依，平行初始化；每個階段記錄耗時（ms）。
+    shutdown()：停止各 thread、寫完歷史紀錄、釋放 GPIO。
+    thread 只能 start 一次，所以 shutdown() 之後（或 init() 失敗之後）不能再 init()。
+    """
+
+    # 互不相依、可平行的階段（都在 config + hal 之後）
+    PARALLEL_PHASES = (
+        ("sensor", _init_sensor),
+        ("servo", _init_servo),
+        ("buzzer", _init_buzzer),
+        ("lcd", _init_lcd),
+        ("history", _init_history),
+    )
+    # 失敗時的退路（沒有的階段失敗就只記在 errors，該裝置不可用）
+    FALLBACKS = {
+        "sensor": _init_sensor_fallback,
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = "new"         # new / starting / ready / degraded（有階段失敗，靠退路或少了該裝置在跑）/ stopped / failed
+        self.phases_ms = {}
+        self.errors = {}
+        self.total_ms = 0.0
+        self._instance_lock = None
+
+    def _run_phase(self, name: str, fn):
+        t0 = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            self.errors[name] = str(e)
+            print(f"⚠️ init {name} failed:", e)
+        finally:
+            self.phases_ms[name] = round((time.perf_counter() - t0) * 1000.0, 2)
+
+    def init(self):
+        with self._lock:
+            if self.state != "new":
+                if self.state == "stopped":
+                    raise RuntimeError("game_logic already shut down")
+                if self.state == "failed":
+                    raise RuntimeError(f"game_logic init failed: {self.errors}")
+                return
+            self._instance_lock = _acquire_instance_lock()
+            self.state = "starting"
+            t0 = time.perf_counter()
+
+            self._run_phase("config", _load_config)
+            self._run_phase("sessions", _init_sessions)
+            self._run_phase("hal", _init_hal)
+            if "hal" in self.errors:
+                self._fail(f"hardware backend failed: {self.errors['hal']}")
+
+            threads = [
+                threading.Thread(target=self._run_phase, args=(name, fn), daemon=True)
+                for name, fn in self.PARALLEL_PHASES
+            ]
+            for th in threads:
+                th.start()
+            for th in threads:
+                th.join()
+            for name, fn in self.FALLBACKS.items():
+                if name in self.errors:
+                    self._run_phase(name + "_fallback", fn)
+            if _goal is None:
+                self._fail(f"goal sensor failed: {self.errors.get('sensor_fallback') or self.errors.get('sensor')}")
+            self._run_phase("uploader", _init_uploader)   # 要等歷史紀錄載入（補傳）
+            # 按鈕最後開：按下去就會 start_game()，其他裝置要先就緒
+            self._run_phase("button", _init_button)
+
+            self.total_ms = round((time.perf_counter() - t0) * 1000.0, 2)
+            self.state = "degraded" if self.errors else "ready"
+            print(f"[INIT] {self.state} in {self.total_ms:.1f} ms {self.phases_ms}")
+        _notify_state_changed()
+
+    @staticmethod
+    def _try(what: str, fn, *args):
+        """shutdown 的每一步各自吃掉例外：前面失敗（例如某個裝置沒初始化成功）也要走到寫歷史紀錄 / 釋放 GPIO。"""
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"⚠️ shutdown {what} failed:", e)
+
+    def _fail(self, msg: str):
+        """
+        init() 中途放棄（呼叫端持有 self._lock）：已經建立 / 啟動的 session 與裝置 thread 照 shutdown 的步驟收掉，
+        放開獨占鎖讓別的行程（或修好後重開的本行程）能拿到硬體。thread 不能重 start，所以狀態停在 failed。
+        """
+        self.state = "failed"
+        self._teardown()
+        if self._instance_lock is not None:
+            self._try("instance lock", self._instance_lock.close)
+            self._instance_lock = None
+        print("[INIT] failed:", msg)
+        raise RuntimeError(msg)
+
+    def shutdown(self):
+        with self._lock:
+            if self.state not in ("ready", "degraded"):
+                return
+            self.state = "stopped"
+            self._teardown()
+            print("[INIT] shut down")
+
+    def _teardown(self):
+        # 呼叫端需持有 self._lock
+        _BUTTON_STOP.set()
+        for s in _sessions:
+            self._try(f"session {s.id}", s.stop)
+        if _goal is not None:
+            if _goal.recorder is not None:
+                self._try("trace recorder", _goal.stop_recording)
+            _goal.stop()
+        threads = [_goal] if _goal is not None else []
+        for s in _sessions:
+            # hal 沒載入就失敗時 GPIO 還是 None，停裝置也要各自吃掉例外
+            self._try(f"servo {s.id} stop", s.servo.stop)
+            self._try(f"buzzer {s.id} stop", s.buzzer.stop)
+            self._try(f"lcd {s.id} stop", s.lcd.stop)
+            threads += [s.servo, s.buzzer, s.lcd]
+        for th in threads:
+            if th.is_alive():   # 初始化失敗的裝置 thread 沒 start 過，不能 join
+                th.join(timeout=1.0)
+        if _goal is not None:
+            self._try("sensor", _goal.close)
+        self._try("history flush", _history.flush)
+        if _uploader is not None:
+            _uploader.stop()
+            self._try("uploader", _uploader.join, 1.0)
+        for s in _sessions:
+            self._try(f"servo {s.id}", s.servo.close)
+        if GPIO is not None:
+            self._try("GPIO cleanup", GPIO.cleanup)
+
+    def get_stats(self):
+        return {
+            "state": self.state,
+            "total_ms": float(self.total_ms),
+            "phases_ms": dict(self.phases_ms),
+            "lcd_open_ms": round(max((float(s.lcd.open_ms) for s in _sessions), default=0.0), 2),
+            "errors": dict(self.errors),
+        }
+
+_lifecycle = Lifecycle()
+
+def init():
+    """初始化硬體與背景 thread（重複呼叫沒有作用）；回傳各階段耗時。"""
+    _lifecycle.init()
+    return _lifecycle.get_stats()
 
-_servo_reset_to_center()
-lcd_show_4_lines("Basketball Ready", "", "", "", force=True)
+def shutdown():
+    _lifecycle.shutdown()
@@ -0,0 +1,262 @@
+# goal_detect.py
+# -*- coding: utf-8 -*-
+"""
+進球判定（hysteresis + holdoff + 最小寬度）的純邏輯，不碰任何硬體。
+
+- GoalHysteresis：逐樣本的判定器，GoalDetector 取樣 thread 直接使用
+- detect_events()：同一套規則的 NumPy 版本，一次處理整段錄好的 (t, v)
+- grid_search()：對同一段資料同時跑多組門檻
+- CLI：把錄好的波形檔重播，找出最適合這台機台的 GOAL_ENTRY_V / GOAL_RELEASE_V / GOAL_HOLDOFF_MS / GOAL_MIN_WIDTH_MS
+
+判定規則（與原本 GoalDetector.run() 相同）：
+1) holdoff 期間（上一個事件 release 後 holdoff_ms 內）不處理樣本
+2) 不在事件中且 v >= entry_v → 事件開始（記錄 entry 時間與 peak）
+3) 事件中：更新 peak；v <= release_v → 事件結束，寬度 >= min_width_ms 才算進球
+4) 不論有效與否，事件結束後都進入 holdoff
+
+用法：
+  python3 goal_detect.py trace.csv --entry 1.8:2.2:0.1 --release 1.5,1.6,1.7 \
+      --holdoff 150,250 --min-width 3,5 --expected 42
+"""
+
+import argparse
+import json
+import os
+import sys
+
+np = None   # numpy 延後到第一次用到才 import（import 本模組要便宜）
+
+
+class GoalHysteresis:
+    """逐樣本進球判定器（純邏輯）；step() 回傳有效事件或 None。"""
+
+    def __init__(self, entry_v: float, release_v: float, holdoff_ms: float, min_width_ms: float):
+        self.entry_v = float(entry_v)
+        self.release_v = float(release_v)
+        self.holdoff_s = float(holdoff_ms) / 1000.0
+        self.min_width_ms = float(min_width_ms)
+        self.reset()
+
+    def reset(self):
+        self.in_zone = False
+        self.holdoff_until = 0.0
+        self.event_start = 0.0
+        self.peak_v = 0.0
+
+    def step(self, t: float, v: float):
+        """
+        餵一個樣本。事件結束且寬度足夠時回傳 (t_entry, t_release, peak_v, width_ms)，否則 None。
+        """
+        if t < self.holdoff_until:
+            return None
+        if not self.in_zone:
+            if v >= self.entry_v:
+                self.in_zone = True
+                self.event_start = t
+                self.peak_v = v
+            return None
+
+        if v > self.peak_v:
+            self.peak_v = v
+        if v > self.release_v:
+            return None
+
+        t_entry, peak_v = self.event_start, self.peak_v
+        width_ms = (t - t_entry) * 1000.0
+        self.in_zone = False
+        self.holdoff_until = t + self.holdoff_s
+        self.event_start = 0.0
+        self.peak_v = 0.0
+        if width_ms >= self.min_width_ms:
+            return (t_entry, t, peak_v, width_ms)
+        return None
+
+
+def _require_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError("需要 numpy：pip3 install numpy")
+        np = numpy
+
+
+def _event_pairs(t, entry_idx, release_idx, holdoff_s: float):
+    """
+    依 holdoff 規則挑出 (entry, release) 樣本索引配對。
+    entry_idx / release_idx 是預先向量化算好的候選索引，這裡每個事件只做兩次 searchsorted。
+    """
+    n = len(t)
+    starts, ends = [], []
+    p = 0
+    ne, nr = len(entry_idx), len(release_idx)
+    while p < n:
+        k = np.searchsorted(entry_idx, p)
+        if k >= ne:
+            break
+        i = int(entry_idx[k])
+        r = np.searchsorted(release_idx, i, side="right")
+        if r >= nr:
+            break  # 資料結束時還在事件中：不算
+        j = int(release_idx[r])
+        starts.append(i)
+        ends.append(j)
+        p = max(int(np.searchsorted(t, t[j] + holdoff_s, side="left")), j + 1)
+    return np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+
+
+def _finish_events(t, v, starts, ends, min_width_ms: float):
+    if len(starts) == 0:
+        empty = np.zeros(0)
+        return {"t_entry": empty, "t_release": empty, "peak_v": empty, "width_ms": empty}
+    width_ms = (t[ends] - t[starts]) * 1000.0
+    # peak：每個 [start, end] 區段的最大值（v 尾端補一個元素讓 end+1 不越界）
+    vv = np.append(v, v[-1])
+    bounds = np.empty(len(starts) * 2, dtype=np.int64)
+    bounds[0::2] = starts
+    bounds[1::2] = ends + 1
+    peak_v = np.maximum.reduceat(vv, bounds)[0::2]
+    ok = width_ms >= float(min_width_ms)
+    return {
+        "t_entry": t[starts][ok],
+        "t_release": t[ends][ok],
+        "peak_v": peak_v[ok],
+        "width_ms": width_ms[ok],
+    }
+
+
+def detect_events(t, v, entry_v: float, release_v: float, holdoff_ms: float, min_width_ms: float):
+    """
+    NumPy 版判定：t（秒，遞增）、v（伏特）→ dict of arrays：t_entry / t_release / peak_v / width_ms（只含有效事件）。
+    """
+    _require_numpy()
+    t = np.asarray(t, dtype=np.float64)
+    v = np.asarray(v, dtype=np.float64)
+    entry_idx = np.flatnonzero(v >= float(entry_v))
+    release_idx = np.flatnonzero(v <= float(release_v))
+    starts, ends = _event_pairs(t, entry_idx, release_idx, float(holdoff_ms) / 1000.0)
+    return _finish_events(t, v, starts, ends, min_width_ms)
+
+
+def grid_search(t, v, entries, releases, holdoffs, min_widths):
+    """
+    對所有門檻組合（release < entry）計算進球數與寬度統計。
+    同一個 entry / release 的候選索引只算一次；同一組 (entry, release, holdoff) 的配對也共用給所有 min_width。
+    """
+    _require_numpy()
+    t = np.asarray(t, dtype=np.float64)
+    v = np.asarray(v, dtype=np.float64)
+    entry_cache = {e: np.flatnonzero(v >= e) for e in entries}
+    release_cache = {r: np.flatnonzero(v <= r) for r in releases}
+
+    results = []
+    for e in entries:
+        for r in releases:
+            if r >= e:
+                continue
+            for h in holdoffs:
+                starts, ends = _event_pairs(t, entry_cache[e], release_cache[r], h / 1000.0)
+                for w in min_widths:
+                    ev = _finish_events(t, v, starts, ends, w)
+                    widths = ev["width_ms"]
+                    results.append({
+                        "entry_v": float(e),
+                        "release_v": float(r),
+                        "holdoff_ms": float(h),
+                        "min_width_ms": float(w),
+                        "goals": int(len(widths)),
+                        "width_ms_median": float(np.median(widths)) if len(widths) else 0.0,
+                        "peak_v_median": float(np.median(ev["peak_v"])) if len(widths) else 0.0,
+                    })
+    return results
+
+
+def load_trace(path: str):
+    """
+    讀錄好的波形檔，回傳 (t, v) 兩個 numpy array。
+    - .bbt：sensor_trace 錄的二進位檔（第一個 channel）
+    - .npy：N×2 陣列（t 秒, v 伏特）
+    - 其他：CSV / 空白分隔文字，每行 "t,v"（可有標頭）
+    """
+    _require_numpy()
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".bbt":
+        import sensor_trace
+        return sensor_trace.load_trace(path)
+    if ext == ".npy":
+        arr = np.load(path)
+    else:
+        arr = np.genfromtxt(path, delimiter="," if ext == ".csv" else None, comments="#")
+        arr = arr[~np.isnan(arr).any(axis=1)]  # 去掉標頭 / 壞行
+    return np.ascontiguousarray(arr[:, 0], dtype=np.float64), np.ascontiguousarray(arr[:, 1], dtype=np.float64)
+
+
+def _parse_values(spec: str):
+    """'1.8,2.0' 或 'start:stop:step'（含 stop）"""
+    if ":" in spec:
+        a, b, step = (float(x) for x in spec.split(":"))
+        n = int(round((b - a) / step)) + 1
+        return [round(a + i * step, 6) for i in range(max(0, n))]
+    return [float(x) for x in spec.split(",") if x.strip()]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="重播錄好的 IR 波形，對多組門檻做進球判定 grid search")
+    ap.add_argument("trace", nargs="+", help="波形檔（.bbt / .csv / .txt / .npy）；多個檔會接起來")
+    ap.add_argument("--entry", default="2.0", help="entry 門檻 V，例如 1.8,2.0 或 1.6:2.4:0.1")
+    ap.add_argument("--release", default="1.7", help="release 門檻 V")
+    ap.add_argument("--holdoff", default="250", help="holdoff ms")
+    ap.add_argument("--min-width", default="5", help="最小寬度 ms")
+    ap.add_argument("--expected", type=int, default=None, help="實際進球數；有給就依誤差排序")
+    ap.add_argument("--top", type=int, default=20, help="顯示前幾名")
+    ap.add_argument("--json", action="store_true", help="輸出 JSON")
+    args = ap.parse_args()
+
+    _require_numpy()
+    ts, vs = [], []
+    offset = 0.0
+    for path in args.trace:
+        t, v = load_trace(path)
+        if len(t) == 0:
+            continue
+        # 多檔串接：每個檔的時間接在上一個後面，避免跨檔被當成同一事件
+        t = t - t[0] + offset
+        offset = t[-1] + 1.0
+        ts.append(t)
+        vs.append(v)
+    if not ts:
+        print("沒有樣本")
+        return 1
+    t = np.concatenate(ts)
+    v = np.concatenate(vs)
+
+    results = grid_search(
+        t, v,
+        _parse_values(args.entry),
+        _parse_values(args.release),
+        _parse_values(args.holdoff),
+        _parse_values(args.min_width),
+    )
+    if args.expected is not None:
+        results.sort(key=lambda r: (abs(r["goals"] - args.expected), -r["entry_v"]))
+    else:
+        results.sort(key=lambda r: -r["goals"])
+    results = results[:args.top]
+
+    if args.json:
+        json.dump(results, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return 0
+
+    hours = (t[-1] - t[0]) / 3600.0
+    print(f"samples={len(t)} | duration={hours:.2f}h | combos shown={len(results)}")
+    print(f"{'entry':>6} {'release':>7} {'holdoff':>7} {'minw':>5} {'goals':>6} {'w_med':>7} {'peak_med':>8}")
+    for r in results:
+        print(f"{r['entry_v']:6.2f} {r['release_v']:7.2f} {r['holdoff_ms']:7.0f} {r['min_width_ms']:5.1f} "
+              f"{r['goals']:6d} {r['width_ms_median']:7.1f} {r['peak_v_median']:8.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
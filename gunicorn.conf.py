@@ -0,0 +1,27 @@
+# gunicorn.conf.py
+# -*- coding: utf-8 -*-
+"""
+gunicorn 設定（serve.py 的替代方案）：
+  pip3 install gunicorn
+  sudo gunicorn -c gunicorn.conf.py app:app
+
+硬體只能由一個行程擁有，所以固定 1 個 worker，用 gthread 的 thread pool 撐並行連線。
+game_logic.init() 在 worker 啟動後才呼叫（不能在 master 做：fork 之後 thread 不會跟過去）；
+若有人把 workers 調大，第二個 worker 拿不到檔案鎖會啟動失敗，gunicorn 會直接停下來提示錯誤。
+"""
+
+import os
+
+bind = "%s:%s" % (os.environ.get("BASKETBALL_WEB_HOST", "0.0.0.0"), os.environ.get("BASKETBALL_WEB_PORT", "5000"))
+workers = 1
+worker_class = "gthread"
+threads = int(os.environ.get("BASKETBALL_WEB_THREADS", "16"))
+keepalive = 5
+timeout = 60
+preload_app = False
+
+
+def post_worker_init(worker):
+    from game_logic import init
+    stats = init()
+    worker.log.info("game_logic init %.1f ms %s", stats["total_ms"], stats["phases_ms"])
@@ -0,0 +1,432 @@
+# hal.py
+# -*- coding: utf-8 -*-
+"""
+硬體抽象層：GPIO / PWM / SPI / I2C 的可替換後端。
+
+後端（環境變數 BASKETBALL_HW 選擇，預設 auto）：
+- rpi   ：RPi.GPIO + spidev + smbus（實機）
+- dummy ：什麼都不做（input 永遠 1、ADC 永遠 0、沒有 LCD），舊版非 Pi 環境的行為
+- sim   ：模擬器。GP2Y 球通過波形（MCP3008）、SG90 PWM 角度模型、PCF8574 → HD44780 解碼成 LCD 畫面
+- auto  ：能 import RPi.GPIO / spidev 就用 rpi，否則 dummy
+
+每個後端提供：
+- name
+- GPIO：RPi.GPIO 相容子集（setwarnings / setmode / setup / output / input / PWM / cleanup 與常數）
+- SpiDev()：spidev.SpiDev 相容（open / xfer2 / max_speed_hz / close）
+- SMBus(bus)：smbus.SMBus 相容（write_byte / write_i2c_block_data）；None = 沒有 I2C
+
+模擬器參數（環境變數）：
+  BASKETBALL_SIM_PASS_RATE   每個 channel 每秒平均幾次球通過（預設 0.5，Poisson）
+  BASKETBALL_SIM_MISS_RATIO  通過中有多少比例是擦框（峰值低於 entry，預設 0.2）
+  BASKETBALL_SIM_SEED        亂數種子（預設不固定）
+"""
+
+import os
+import math
+import time
+import random
+import threading
+from collections import deque
+
+HW_ENV = "BASKETBALL_HW"
+
+
+# =========================
+# dummy
+# =========================
+class _DummyPWM:
+    def start(self, *a, **k): pass
+    def ChangeDutyCycle(self, *a, **k): pass
+    def ChangeFrequency(self, *a, **k): pass
+    def stop(self, *a, **k): pass
+
+
+class DummyGPIO:
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_UP = 22
+    PUD_DOWN = 21
+
+    def setwarnings(self, *a, **k): pass
+    def setmode(self, *a, **k): pass
+    def setup(self, *a, **k): pass
+    def output(self, *a, **k): pass
+    def input(self, *a, **k): return 1
+    def cleanup(self, *a, **k): pass
+
+    def PWM(self, *a, **k):
+        return _DummyPWM()
+
+
+class DummySPI:
+    max_speed_hz = 0
+
+    def open(self, *a, **k): pass
+    def close(self): pass
+    def xfer2(self, x): return [0, 0, 0]
+
+
+class DummyBackend:
+    name = "dummy"
+
+    def __init__(self):
+        self.GPIO = DummyGPIO()
+
+    def SpiDev(self):
+        return DummySPI()
+
+    SMBus = None
+
+
+# =========================
+# rpi
+# =========================
+class RPiBackend:
+    name = "rpi"
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        import spidev
+        self.GPIO = GPIO
+        self._spidev = spidev
+        try:
+            import smbus
+            self.SMBus = smbus.SMBus
+        except Exception:
+            self.SMBus = None
+
+    def SpiDev(self):
+        return self._spidev.SpiDev()
+
+
+# =========================
+# sim
+# =========================
+SIM_ADC_VREF = 3.3
+SIM_BASELINE_V = 0.90          # 無球時 GP2Y 看到籃框內壁的電壓
+SIM_NOISE_V = 0.015
+SIM_DRIFT_V = 0.10             # 環境光造成的慢速漂移（振幅）
+SIM_DRIFT_PERIOD_S = 600.0
+SIM_GOAL_PEAK_V = (2.2, 2.9)
+SIM_MISS_PEAK_V = (1.2, 1.6)
+SIM_PASS_WIDTH_MS = (12.0, 40.0)
+SIM_SERVO_DPS = 600.0          # SG90 約 0.1 s / 60°
+SIM_LCD_FRAME_COALESCE_S = 0.005
+SIM_LCD_FRAMES = 1000
+
+
+class SimSensor:
+    """
+    單一 GP2Y0A51SK0F：背景 + 雜訊 + 慢速漂移 + Poisson 球通過（升餘弦脈衝）。
+    排程依牆鐘（perf_counter）往前推進，取樣頻率多少都一樣。
+    """
+
+    def __init__(self, rng: random.Random, pass_rate_hz: float, miss_ratio: float):
+        self.rng = rng
+        self.pass_rate_hz = float(pass_rate_hz)
+        self.miss_ratio = float(miss_ratio)
+        self.passes = 0
+        self.goals = 0             # 峰值超過 entry 的通過次數（給壓測對帳用）
+        self._phase = rng.uniform(0.0, 2.0 * math.pi)
+        self._cur = None           # (t0, width_s, peak_v)
+        self._next_t = None
+
+    def _schedule(self, now: float):
+        if self.pass_rate_hz <= 0:
+            self._next_t = float("inf")
+            return
+        self._next_t = now + self.rng.expovariate(self.pass_rate_hz)
+
+    def voltage(self, t: float) -> float:
+        if self._next_t is None:
+            self._schedule(t)
+        base = SIM_BASELINE_V + SIM_DRIFT_V * math.sin(2.0 * math.pi * t / SIM_DRIFT_PERIOD_S + self._phase)
+        v = base + self.rng.gauss(0.0, SIM_NOISE_V)
+
+        cur = self._cur
+        if cur is None and t >= self._next_t:
+            miss = self.rng.random() < self.miss_ratio
+            peak = self.rng.uniform(*(SIM_MISS_PEAK_V if miss else SIM_GOAL_PEAK_V))
+            width = self.rng.uniform(*SIM_PASS_WIDTH_MS) / 1000.0
+            cur = self._cur = (t, width, peak)
+            self.passes += 1
+            if not miss:
+                self.goals += 1
+        if cur is not None:
+            t0, width, peak = cur
+            x = (t - t0) / width
+            if x >= 1.0:
+                self._cur = None
+                self._schedule(t)
+            else:
+                v += (peak - base) * 0.5 * (1.0 - math.cos(2.0 * math.pi * x))
+        return max(0.0, min(SIM_ADC_VREF, v))
+
+
+class SimSPI:
+    """MCP3008：[1, (8+ch)<<4, 0] → [?, 高 2 bit, 低 8 bit]。"""
+
+    def __init__(self, sensors):
+        self.sensors = sensors
+        self.max_speed_hz = 0
+        self.xfers = 0
+
+    def open(self, *a, **k): pass
+    def close(self): pass
+
+    def xfer2(self, data):
+        self.xfers += 1
+        ch = (data[1] >> 4) & 0x07 if len(data) >= 2 else 0
+        v = self.sensors[ch].voltage(time.perf_counter())
+        raw = int(round(v / SIM_ADC_VREF * 1023.0))
+        return [0, (raw >> 8) & 0x03, raw & 0xFF]
+
+
+class SimPWM:
+    """SG90：50Hz、duty 2.5%~12.5% 對應 0~180°；實際角度以固定角速度追命令角度。"""
+
+    def __init__(self, pin: int, freq: float):
+        self.pin = int(pin)
+        self.freq = float(freq)
+        self.duty = 0.0
+        self.commands = 0
+        self._lock = threading.Lock()
+        self._target = None
+        self._from = None
+        self._t_cmd = 0.0
+
+    def start(self, duty):
+        self.ChangeDutyCycle(duty)
+
+    def stop(self):
+        self.ChangeDutyCycle(0)
+
+    def ChangeFrequency(self, freq):
+        self.freq = float(freq)
+
+    def ChangeDutyCycle(self, duty):
+        now = time.perf_counter()
+        with self._lock:
+            cur = self._angle_at(now)
+            self.duty = float(duty)
+            self.commands += 1
+            if self.duty <= 0:
+                return   # 沒有脈衝：舵機停在原地
+            self._from = cur if cur is not None else (self.duty - 2.5) * 18.0
+            self._target = max(0.0, min(180.0, (self.duty - 2.5) * 18.0))
+            self._t_cmd = now
+
+    def _angle_at(self, t: float):
+        if self._target is None:
+            return None
+        travel = SIM_SERVO_DPS * (t - self._t_cmd)
+        d = self._target - self._from
+        if abs(d) <= travel:
+            return self._target
+        return self._from + math.copysign(travel, d)
+
+    def angle(self):
+        """舵機目前的實際角度（None = 還沒收到過脈衝）。"""
+        with self._lock:
+            return self._angle_at(time.perf_counter())
+
+
+class SimGPIO(DummyGPIO):
+    """記錄輸出腳位；輸入腳位預設 HIGH（上拉），press() 可模擬按鈕拉 LOW。"""
+
+    def __init__(self):
+        self.outputs = {}
+        self.toggles = {}
+        self.pwms = {}
+        self._low_until = {}
+
+    def output(self, pin, value):
+        value = int(value)
+        if self.outputs.get(pin) != value:
+            self.toggles[pin] = self.toggles.get(pin, 0) + 1
+        self.outputs[pin] = value
+
+    def input(self, pin, *a, **k):
+        return self.LOW if time.monotonic() < self._low_until.get(pin, 0.0) else self.HIGH
+
+    def press(self, pin: int, duration: float = 0.1):
+        self._low_until[pin] = time.monotonic() + float(duration)
+
+    def PWM(self, pin, freq):
+        pwm = SimPWM(pin, freq)
+        self.pwms[pin] = pwm
+        return pwm
+
+
+class SimLCD:
+    """
+    PCF8574 背包 + HD44780（20×4）：在 E 下降緣鎖存高 4 bit，兩個 nibble 組成一個 byte，
+    RS=0 是指令（clear / home / set DDRAM address），RS=1 是寫字元。
+    畫面有變就記一個 frame（同一波寫入 5ms 內合併成一個）。
+    """
+
+    _LINE_BASE = (0x00, 0x40, 0x14, 0x54)
+
+    def __init__(self, i2c_addr: int):
+        self.i2c_addr = int(i2c_addr)
+        self._lock = threading.Lock()
+        self.ddram = bytearray(b" " * 0x80)
+        self.addr = 0
+        self.bytes_written = 0
+        self.i2c_ops = 0           # I2C 交易次數（write_byte / block write 各算一次）
+        self._last = 0
+        self._nibble = None
+        self.frames = deque(maxlen=SIM_LCD_FRAMES)   # [(t, (line1, line2, line3, line4))]
+
+    def text(self):
+        return tuple(
+            self.ddram[b:b + 20].decode("ascii", "replace") for b in self._LINE_BASE
+        )
+
+    def _latch(self, b: int):
+        nib = b & 0xF0
+        if self._nibble is None:
+            self._nibble = nib
+            return
+        byte = self._nibble | (nib >> 4)
+        self._nibble = None
+        if b & 0x01:
+            self.ddram[self.addr & 0x7F] = byte if 0x20 <= byte < 0x7F else 0x3F
+            self.addr = (self.addr + 1) & 0x7F
+        elif byte == 0x01:
+            self.ddram[:] = b" " * 0x80
+            self.addr = 0
+        elif byte in (0x02, 0x03):
+            self.addr = 0
+        elif byte & 0x80:
+            self.addr = byte & 0x7F
+        else:
+            return
+        self._record()
+
+    def _record(self):
+        now = time.monotonic()
+        frame = self.text()
+        if self.frames:
+            t_last, last = self.frames[-1]
+            if last == frame:
+                return
+            if now - t_last < SIM_LCD_FRAME_COALESCE_S:
+                self.frames[-1] = (t_last, frame)
+                return
+        self.frames.append((now, frame))
+
+    def _feed(self, b: int):
+        self.bytes_written += 1
+        if (self._last & 0x04) and not (b & 0x04):
+            self._latch(self._last)
+        self._last = b
+
+    def write_byte(self, value):
+        with self._lock:
+            self.i2c_ops += 1
+            self._feed(int(value))
+
+    def write_block(self, cmd, data):
+        with self._lock:
+            self.i2c_ops += 1
+            self._feed(int(cmd))
+            for b in data:
+                self._feed(int(b))
+
+
+class SimLCDBus:
+    """I2C bus：依位址分派給各自的 SimLCD（多機台時每台 LCD 一個位址）。frames / text() 是第一台的。"""
+
+    def __init__(self, bus: int = 1):
+        self.bus = bus
+        self._lock = threading.Lock()
+        self.devices = {}          # addr → SimLCD（依第一次寫入的順序）
+
+    def device(self, addr) -> SimLCD:
+        with self._lock:
+            dev = self.devices.get(int(addr))
+            if dev is None:
+                dev = self.devices[int(addr)] = SimLCD(addr)
+            return dev
+
+    def _first(self):
+        with self._lock:
+            return next(iter(self.devices.values()), None)
+
+    @property
+    def frames(self):
+        dev = self._first()
+        return dev.frames if dev is not None else deque()
+
+    def text(self):
+        dev = self._first()
+        return dev.text() if dev is not None else ("",) * 4
+
+    def write_byte(self, addr, value):
+        self.device(addr).write_byte(value)
+
+    def write_i2c_block_data(self, addr, cmd, data):
+        self.device(addr).write_block(cmd, data)
+
+
+class SimBackend:
+    name = "sim"
+
+    def __init__(self, pass_rate_hz=None, miss_ratio=None, seed=None):
+        if pass_rate_hz is None:
+            pass_rate_hz = float(os.environ.get("BASKETBALL_SIM_PASS_RATE", "0.5"))
+        if miss_ratio is None:
+            miss_ratio = float(os.environ.get("BASKETBALL_SIM_MISS_RATIO", "0.2"))
+        if seed is None and os.environ.get("BASKETBALL_SIM_SEED"):
+            seed = int(os.environ["BASKETBALL_SIM_SEED"])
+        self.rng = random.Random(seed)
+        self.GPIO = SimGPIO()
+        self.sensors = [SimSensor(self.rng, pass_rate_hz, miss_ratio) for _ in range(8)]
+        self.spi = SimSPI(self.sensors)
+        self.lcd_bus = None
+
+    def SpiDev(self):
+        return self.spi
+
+    def SMBus(self, bus=1):
+        if self.lcd_bus is None:
+            self.lcd_bus = SimLCDBus(bus)
+        return self.lcd_bus
+
+    def get_stats(self):
+        pwm = [{"pin": p.pin, "duty": p.duty, "angle": p.angle(), "commands": p.commands}
+               for p in self.GPIO.pwms.values()]
+        return {
+            "passes": [s.passes for s in self.sensors],
+            "goals": [s.goals for s in self.sensors],
+            "spi_xfers": self.spi.xfers,
+            "pwm": pwm,
+            "gpio_toggles": dict(self.GPIO.toggles),
+            "lcd_frames": {hex(a): len(d.frames) for a, d in self.lcd_bus.devices.items()} if self.lcd_bus else {},
+            "lcd_i2c_ops": {hex(a): d.i2c_ops for a, d in self.lcd_bus.devices.items()} if self.lcd_bus else {},
+            "lcd_i2c_bytes": {hex(a): d.bytes_written for a, d in self.lcd_bus.devices.items()} if self.lcd_bus else {},
+        }
+
+
+# =========================
+# 選擇後端
+# =========================
+_BACKENDS = {"rpi": RPiBackend, "dummy": DummyBackend, "sim": SimBackend}
+
+
+def load_backend(name: str = None):
+    """name 省略時讀 BASKETBALL_HW（預設 auto）。指定 rpi 但載入失敗會直接丟例外。"""
+    name = (name or os.environ.get(HW_ENV, "auto")).strip().lower()
+    if name == "auto":
+        try:
+            return RPiBackend()
+        except Exception:
+            return DummyBackend()
+    if name not in _BACKENDS:
+        raise ValueError(f"unknown {HW_ENV}={name!r} (rpi / dummy / sim / auto)")
+    return _BACKENDS[name]()
@@ -0,0 +1,229 @@
+# metrics.py
+# -*- coding: utf-8 -*-
+"""
+執行期指標：counter / histogram + Prometheus 文字格式輸出（app.py 的 GET /metrics）。
+只用標準庫；場館的 Prometheus（或任何吃 text format 0.0.4 的收集器）定期來抓，就能看出哪台機台在變慢。
+
+- 熱路徑只做數字運算：histogram 的格子在建立時就配好（array('d')），observe() 用 bisect 找格子，不配置物件
+- 帶 label 的指標用 family.labels(...) 取子指標；呼叫端在建構時取好存起來，熱路徑直接 observe()
+- 單一 writer（取樣 / 舵機 / LCD thread）不用 lock；多個 thread 會寫同一個子指標（HTTP handler）時建立時給 lock=True
+- Histogram.attach()：把儲存位置換成外部 buffer（取樣行程經 shared memory 回報給主行程）
+- register_collector()：輸出時才呼叫，把既有的統計值（取樣率、overrun、進球數…）轉成 gauge / counter
+- 時間一律用秒（Prometheus 慣例）
+
+用法：
+  LOOP = metrics.histogram("basketball_x_seconds", "說明", (0.001, 0.01, 0.1))
+  LOOP.observe(dt)
+  HTTP = metrics.histogram("basketball_http_seconds", "說明", BUCKETS, labelnames=("endpoint",), lock=True)
+  HTTP.labels("status").observe(dt)
+  text = metrics.render()
+"""
+
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_REG_LOCK = threading.Lock()
+_families = []
+_collectors = []
+
+class Counter:
+    def __init__(self, lock: bool = False):
+        self.value = 0.0
+        self._lock = threading.Lock() if lock else None
+
+    def inc(self, n: float = 1.0):
+        if self._lock is None:
+            self.value += n
+        else:
+            with self._lock:
+                self.value += n
+
+class Histogram:
+    """
+    固定格子的 histogram。儲存：[各格次數…, +Inf 格次數, 總和]，格子上緣為 bounds（遞增、不含 +Inf）。
+    各格存的是「落在這格」的次數，輸出時才累加成 Prometheus 的 le 累計值。
+    """
+
+    def __init__(self, bounds, lock: bool = False):
+        self.bounds = tuple(float(b) for b in bounds)
+        self._v = array("d", [0.0]) * self.size(len(self.bounds))
+        self._sum_i = len(self.bounds) + 1
+        if lock:
+            self._lock = threading.Lock()
+            self.observe = self._observe_locked
+
+    @staticmethod
+    def size(n_bounds: int) -> int:
+        """儲存需要幾個 double（給 shared memory 配置用）。"""
+        return n_bounds + 2
+
+    def observe(self, x: float):
+        v = self._v
+        v[bisect_left(self.bounds, x)] += 1.0
+        v[self._sum_i] += x
+
+    def _observe_locked(self, x: float):
+        with self._lock:
+            v = self._v
+            v[bisect_left(self.bounds, x)] += 1.0
+            v[self._sum_i] += x
+
+    def attach(self, view):
+        """改用外部 buffer（長度 size(len(bounds)) 的 double memoryview / array），原本的數值不帶過去。"""
+        if len(view) != len(self._v):
+            raise ValueError(f"histogram storage needs {len(self._v)} doubles, got {len(view)}")
+        self._v = view
+
+    def detach(self):
+        """換回自己的 array（複製目前數值），外部 buffer 之後可以關掉。"""
+        self._v = array("d", self._v)
+
+    def snapshot(self):
+        """回傳 (各格次數 list（含 +Inf）, 總和)。"""
+        vals = self._v.tolist()
+        return vals[:-1], vals[-1]
+
+class TimedLock:
+    """
+    threading.Lock 加上等待時間統計：沒人搶就直接拿到（不記），被擋住才計時並記一筆，
+    所以 histogram 的 _count 就是爭用次數。observe() 在拿到鎖之後呼叫：一個 histogram 只給一個 TimedLock 用時
+    不用另外加鎖；好幾個 TimedLock 共用同一個子指標的話，histogram 要用 lock=True 建立。
+    """
+
+    def __init__(self, hist: Histogram):
+        self._lock = threading.Lock()
+        self._hist = hist
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        t0 = time.perf_counter()
+        ok = self._lock.acquire(True, timeout)
+        if ok:
+            self._hist.observe(time.perf_counter() - t0)
+        return ok
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+class _Family:
+    def __init__(self, kind: str, name: str, help: str, labelnames, factory):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self.children = {}     # label 值 tuple → Counter / Histogram
+
+    def labels(self, *values):
+        """取（沒有就建立）子指標；請在初始化時取好存起來，不要每個樣本都呼叫。"""
+        key = tuple(str(v) for v in values)
+        m = self.children.get(key)
+        if m is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with _REG_LOCK:
+                m = self.children.get(key)
+                if m is None:
+                    m = self.children[key] = self._factory()
+        return m
+
+def _register(fam: _Family):
+    with _REG_LOCK:
+        if any(f.name == fam.name for f in _families):
+            raise ValueError(f"metric {fam.name} already registered")
+        _families.append(fam)
+    # 沒有 label 的指標直接回傳唯一的子指標
+    return fam.labels() if not fam.labelnames else fam
+
+def counter(name: str, help: str, labelnames=(), lock: bool = False):
+    return _register(_Family("counter", name, help, labelnames, lambda: Counter(lock)))
+
+def histogram(name: str, help: str, buckets, labelnames=(), lock: bool = False):
+    bounds = tuple(sorted(float(b) for b in buckets))
+    return _register(_Family("histogram", name, help, labelnames, lambda: Histogram(bounds, lock)))
+
+def register_collector(fn):
+    """
+    fn() 回傳 / yield (name, kind, help, samples)，samples 是 [(labels dict, value), ...]；
+    kind 為 "gauge" 或 "counter"。/metrics 被抓時才呼叫，丟例外只會略過這個 collector。
+    """
+    with _REG_LOCK:
+        _collectors.append(fn)
+
+# =========================
+# Prometheus text format 0.0.4
+# =========================
+def _esc(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt_labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_esc(str(v))}"' for k, v in pairs) + "}"
+
+def _num(x) -> str:
+    x = float(x)
+    if x != x:
+        return "NaN"
+    if x in (float("inf"), float("-inf")):
+        return "+Inf" if x > 0 else "-Inf"
+    if x == int(x) and abs(x) < 1e15:
+        return str(int(x))
+    return repr(x)
+
+def _render_family(fam: _Family, out):
+    out.append(f"# HELP {fam.name} {fam.help}")
+    out.append(f"# TYPE {fam.name} {fam.kind}")
+    with _REG_LOCK:
+        children = sorted(fam.children.items())
+    for key, m in children:
+        pairs = list(zip(fam.labelnames, key))
+        if fam.kind == "counter":
+            out.append(f"{fam.name}{_fmt_labels(pairs)} {_num(m.value)}")
+            continue
+        counts, total = m.snapshot()
+        acc = 0.0
+        for b, c in zip(m.bounds, counts):
+            acc += c
+            out.append(f"{fam.name}_bucket{_fmt_labels(pairs + [('le', repr(b))])} {_num(acc)}")
+        acc += counts[-1]
+        out.append(f"{fam.name}_bucket{_fmt_labels(pairs + [('le', '+Inf')])} {_num(acc)}")
+        out.append(f"{fam.name}_sum{_fmt_labels(pairs)} {repr(float(total))}")
+        out.append(f"{fam.name}_count{_fmt_labels(pairs)} {_num(acc)}")
+
+def render() -> str:
+    out = []
+    with _REG_LOCK:
+        families = list(_families)
+        collectors = list(_collectors)
+    for fam in families:
+        _render_family(fam, out)
+    for fn in collectors:
+        try:
+            items = list(fn())
+        except Exception as e:
+            print("⚠️ metrics collector error:", e)
+            continue
+        for name, kind, help, samples in items:
+            out.append(f"# HELP {name} {help}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                out.append(f"{name}{_fmt_labels(sorted(labels.items()))} {_num(value)}")
+    out.append("")
+    return "\n".join(out)
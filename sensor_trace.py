@@ -0,0 +1,396 @@
+# sensor_trace.py
+# -*- coding: utf-8 -*-
+"""
+IR 感測原始波形的二進位錄製 / 播放。
+
+檔案格式（little-endian，副檔名 .bbt）：
+- Header（固定 HEADER_SIZE bytes，檔案開頭）
+    magic "BBTR" | version u16 | n_channels u16 | channels 8×u8 | t0 f64（perf_counter 基準）
+    | wall0 f64（time.time）| adc_to_v f32 | sample_count u64 | index_offset u64 | index_count u32
+- Records：每個取樣週期一筆，固定大小 2 + 2×n_channels bytes
+    dt_us u16（與上一筆的微秒差；超過 65535 時存 65535 並補一個 keyframe）| raw i16 × n_channels（讀取失敗 = -1）
+- Index（關檔時附在 records 後面）：keyframe 陣列 (sample_idx u32, t_us i64)，t_us 是相對 t0 的絕對微秒
+    每個寫入 buffer 的第一筆一定是 keyframe，所以每個檔都能獨立還原時間軸
+
+錄製端（TraceRecorder）：
+- 取樣 thread 只做 struct.pack_into 到預先配置的 bytearray；滿了就換另一塊（double buffer），
+  寫檔 / fsync / 輪替都在背景 thread，取樣 thread 不碰檔案
+- 背景寫不及（兩塊都在等寫）時丟掉該段並計數，不讓取樣 thread 等待
+
+播放端（TraceReader）：
+- mmap 整個檔案；有 numpy 時 records 直接 np.frombuffer（零複製），沒有 numpy 時用 struct.iter_unpack
+
+用法：
+  python3 sensor_trace.py info traces/trace_20250101_120000.bbt
+  python3 sensor_trace.py csv traces/trace_20250101_120000.bbt > trace.csv
+"""
+
+import os
+import sys
+import time
+import mmap
+import queue
+import struct
+import threading
+from datetime import datetime
+
+np = None   # numpy 延後到第一次用到才 import（import 本模組要便宜）
+
+TRACE_MAGIC = b"BBTR"
+TRACE_VERSION = 1
+TRACE_MAX_CHANNELS = 8
+HEADER_FMT = "<4sHH8sddfQQI"
+HEADER_SIZE = 64
+INDEX_FMT = "<Iq"
+INDEX_SIZE = struct.calcsize(INDEX_FMT)
+DT_MAX_US = 0xFFFF
+
+TRACE_BUFFER_RECORDS = 4096          # 每塊 buffer 的筆數（2 kHz 約 2 秒）
+TRACE_FILE_MAX_BYTES = 32 * 1024 * 1024   # 單檔上限，超過就輪替
+TRACE_KEEP_FILES = 24                # 目錄內最多保留幾個檔（舊的刪掉）
+
+assert struct.calcsize(HEADER_FMT) <= HEADER_SIZE
+
+
+def _pack_header(n_channels, channels, t0, wall0, adc_to_v, sample_count=0, index_offset=0, index_count=0):
+    ch = bytes(list(channels) + [0xFF] * (TRACE_MAX_CHANNELS - len(channels)))
+    raw = struct.pack(HEADER_FMT, TRACE_MAGIC, TRACE_VERSION, n_channels, ch,
+                      t0, wall0, adc_to_v, sample_count, index_offset, index_count)
+    return raw + b"\0" * (HEADER_SIZE - len(raw))
+
+
+class _TraceBuffer:
+    __slots__ = ("data", "count", "keyframes")
+
+    def __init__(self, nbytes: int):
+        self.data = bytearray(nbytes)
+        self.count = 0
+        self.keyframes = []     # [(local_idx, t_us)]
+
+
+class TraceRecorder:
+    """
+    多 channel 原始 ADC 錄製器。push() 只由取樣 thread 呼叫；其餘由背景 writer thread 處理。
+    """
+
+    def __init__(self, directory: str, channels, adc_to_v: float,
+                 max_bytes: int = TRACE_FILE_MAX_BYTES, keep_files: int = TRACE_KEEP_FILES,
+                 buffer_records: int = TRACE_BUFFER_RECORDS):
+        self.directory = directory
+        self.channels = [int(c) for c in channels]
+        if not 1 <= len(self.channels) <= TRACE_MAX_CHANNELS:
+            raise ValueError("channels must have 1..8 entries")
+        self.adc_to_v = float(adc_to_v)
+        self.max_bytes = int(max_bytes)
+        self.keep_files = int(keep_files)
+
+        n = len(self.channels)
+        self._rec_fmt = "<H%dh" % n
+        self._rec_size = struct.calcsize(self._rec_fmt)
+        self._missing = (-1,) * n
+        self._cap = int(buffer_records)
+
+        # double buffer：_cur 給取樣 thread 寫；_free 放寫完可重用的那塊
+        self._cur = _TraceBuffer(self._cap * self._rec_size)
+        self._free = queue.Queue()
+        self._free.put(_TraceBuffer(self._cap * self._rec_size))
+        self._full = queue.Queue()
+
+        self._t0 = 0.0
+        self._wall0 = 0.0
+        self._last_us = 0
+        self._started = False
+
+        # 統計
+        self.samples = 0
+        self.dropped = 0
+        self.bytes_written = 0
+        self.files_written = 0
+        self.current_file = ""
+
+        self._closed = False
+        self._fh = None
+        self._file_samples = 0
+        self._file_index = []
+        self._thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._thread.start()
+
+    # ---------- 取樣 thread ----------
+    def push(self, t: float, raws):
+        """t = perf_counter 秒；raws = 各 channel 原始 ADC（None = 這次讀取失敗）。"""
+        if not self._started:
+            self._started = True
+            self._t0 = t
+            self._wall0 = time.time()
+        us = int((t - self._t0) * 1e6)
+        dt = us - self._last_us
+        self._last_us = us
+
+        buf = self._cur
+        i = buf.count
+        if i == 0 or dt > DT_MAX_US or dt < 0:
+            buf.keyframes.append((i, us))
+            dt = min(max(dt, 0), DT_MAX_US)
+        struct.pack_into(self._rec_fmt, buf.data, i * self._rec_size, dt, *(raws or self._missing))
+        buf.count = i + 1
+        self.samples += 1
+        if buf.count >= self._cap:
+            self._swap()
+
+    def _swap(self):
+        try:
+            nxt = self._free.get_nowait()
+        except queue.Empty:
+            # 背景還沒寫完：丟掉這一段，重用同一塊
+            self.dropped += self._cur.count
+            self._cur.count = 0
+            self._cur.keyframes = []
+            return
+        self._full.put(self._cur)
+        self._cur = nxt
+
+    def flush(self):
+        """把目前這塊（未滿）交給背景寫出；只在取樣 thread 或已停止取樣時呼叫。"""
+        if self._cur.count:
+            self._swap()
+
+    # ---------- 背景 writer ----------
+    def _prune(self):
+        try:
+            names = sorted(n for n in os.listdir(self.directory) if n.endswith(".bbt"))
+        except Exception:
+            return
+        for n in names[:-self.keep_files] if self.keep_files > 0 else []:
+            try:
+                os.remove(os.path.join(self.directory, n))
+            except Exception:
+                pass
+
+    def _open_file(self):
+        os.makedirs(self.directory, exist_ok=True)
+        name = "trace_" + datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3] + ".bbt"
+        path = os.path.join(self.directory, name)
+        self._fh = open(path, "wb")
+        self._fh.write(_pack_header(len(self.channels), self.channels, self._t0, self._wall0, self.adc_to_v))
+        self._file_samples = 0
+        self._file_index = []
+        self.current_file = path
+        self._prune()
+
+    def _close_file(self):
+        fh = self._fh
+        if fh is None:
+            return
+        try:
+            index_offset = fh.tell()
+            fh.write(b"".join(struct.pack(INDEX_FMT, i, us) for i, us in self._file_index))
+            fh.seek(0)
+            fh.write(_pack_header(len(self.channels), self.channels, self._t0, self._wall0, self.adc_to_v,
+                                  self._file_samples, index_offset, len(self._file_index)))
+            fh.flush()
+            os.fsync(fh.fileno())
+        finally:
+            fh.close()
+            self._fh = None
+            self.files_written += 1
+
+    def _write_buffer(self, buf: _TraceBuffer):
+        if self._fh is None:
+            self._open_file()
+        base = self._file_samples
+        self._fh.write(memoryview(buf.data)[:buf.count * self._rec_size])
+        self._file_index.extend((base + i, us) for i, us in buf.keyframes)
+        self._file_samples += buf.count
+        self.bytes_written += buf.count * self._rec_size
+        if self._fh.tell() >= self.max_bytes:
+            self._close_file()
+
+    def _writer_loop(self):
+        while True:
+            buf = self._full.get()
+            if buf is None:
+                break
+            try:
+                self._write_buffer(buf)
+            except Exception as e:
+                print("⚠️ trace write error:", e)
+                self.dropped += buf.count
+            buf.count = 0
+            buf.keyframes = []
+            self._free.put(buf)
+        try:
+            self._close_file()
+        except Exception as e:
+            print("⚠️ trace close error:", e)
+
+    def close(self):
+        """停止錄製：寫出剩餘資料並補上 header / index。呼叫前取樣 thread 應已不再 push()。"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._cur.count:
+            # 兩塊都在等寫時直接排進佇列（此時取樣 thread 已不再使用 _cur）
+            self._full.put(self._cur)
+        self._full.put(None)
+        self._thread.join(timeout=5.0)
+
+    def get_stats(self):
+        return {
+            "file": self.current_file,
+            "samples": int(self.samples),
+            "dropped": int(self.dropped),
+            "bytes_written": int(self.bytes_written),
+            "files_written": int(self.files_written),
+        }
+
+
+def _require_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError("需要 numpy：pip3 install numpy")
+        np = numpy
+
+
+class TraceReader:
+    """mmap 播放一個 .bbt 檔。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "rb")
+        size = os.fstat(self._f.fileno()).st_size
+        if size < HEADER_SIZE:
+            self._f.close()
+            raise ValueError(f"{path}: not a trace file")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, n, ch, t0, wall0, adc_to_v,
+         count, index_offset, index_count) = struct.unpack_from(HEADER_FMT, self._mm, 0)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            self.close()
+            raise ValueError(f"{path}: bad magic/version")
+        self.n_channels = int(n)
+        self.channels = list(ch[:n])
+        self.t0 = float(t0)
+        self.wall0 = float(wall0)
+        self.adc_to_v = float(adc_to_v)
+        self.record_fmt = "<H%dh" % self.n_channels
+        self.record_size = struct.calcsize(self.record_fmt)
+
+        if count == 0 and index_offset == 0:
+            # 錄製中斷（沒關檔）：用檔案大小推算筆數，沒有 index
+            count = (size - HEADER_SIZE) // self.record_size
+            self.keyframes = [(0, None)] if count else []
+        else:
+            self.keyframes = [struct.unpack_from(INDEX_FMT, self._mm, index_offset + k * INDEX_SIZE)
+                              for k in range(index_count)]
+        self.count = int(count)
+
+    def close(self):
+        try:
+            self._mm.close()
+        except BufferError:
+            pass    # 還有 numpy view 指向 mmap：交給 GC 釋放
+        finally:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _col(self, channel: int) -> int:
+        try:
+            return self.channels.index(int(channel))
+        except ValueError:
+            raise KeyError(f"no channel {channel} in trace")
+
+    # ---------- 純 Python ----------
+    def iter_samples(self):
+        """依序產生 (t 秒（相對 t0）, raws tuple)；不需要 numpy。"""
+        kf = dict((i, us) for i, us in self.keyframes if us is not None)
+        us = 0
+        end = HEADER_SIZE + self.count * self.record_size
+        view = memoryview(self._mm)[HEADER_SIZE:end]
+        try:
+            for i, rec in enumerate(struct.iter_unpack(self.record_fmt, view)):
+                k = kf.get(i)
+                us = k if k is not None else us + rec[0]
+                yield us / 1e6, rec[1:]
+        finally:
+            view.release()
+
+    def replay(self, detector, channel: int):
+        """把某個 channel 餵給有 step(t, v) 的判定器（例如 goal_detect.GoalHysteresis），回傳有效事件列表。"""
+        col = self._col(channel)
+        k = self.adc_to_v
+        events = []
+        for t, raws in self.iter_samples():
+            raw = raws[col]
+            ev = detector.step(t, raw * k if raw >= 0 else 0.0)
+            if ev is not None:
+                events.append(ev)
+        return events
+
+    # ---------- NumPy（零複製） ----------
+    def records(self):
+        """records 的 numpy structured view（dt_us, raw[n]），直接指向 mmap，不複製。"""
+        _require_numpy()
+        dtype = np.dtype([("dt_us", "<u2"), ("raw", "<i2", (self.n_channels,))])
+        return np.frombuffer(self._mm, dtype=dtype, count=self.count, offset=HEADER_SIZE)
+
+    def times(self):
+        """每筆的時間（秒，相對 t0），keyframe 處重新對齊。"""
+        rec = self.records()
+        us = np.cumsum(rec["dt_us"], dtype=np.int64)
+        kfs = [(i, u) for i, u in self.keyframes if u is not None and i < self.count]
+        if kfs:
+            idx = np.array([i for i, _ in kfs], dtype=np.int64)
+            offs = np.array([u for _, u in kfs], dtype=np.int64) - us[idx]
+            seg = np.searchsorted(idx, np.arange(self.count), side="right") - 1
+            us = us + np.where(seg >= 0, offs[np.maximum(seg, 0)], 0)
+        return us / 1e6
+
+    def raw(self, channel: int):
+        return self.records()["raw"][:, self._col(channel)]
+
+    def volts(self, channel: int):
+        r = self.raw(channel).astype(np.float64)
+        r[r < 0] = 0.0
+        return r * self.adc_to_v
+
+
+def load_trace(path: str, channel=None):
+    """讀 .bbt 檔成 (t, v) numpy array；channel 省略 = 檔內第一個 channel。"""
+    _require_numpy()
+    with TraceReader(path) as r:
+        ch = r.channels[0] if channel is None else channel
+        return np.array(r.times()), np.array(r.volts(ch))
+
+
+def _main(argv):
+    if len(argv) < 3 or argv[1] not in ("info", "csv"):
+        print("用法: python3 sensor_trace.py info|csv <file.bbt> [channel]")
+        return 2
+    with TraceReader(argv[2]) as r:
+        if argv[1] == "info":
+            last_t = 0.0
+            for last_t, _ in r.iter_samples():
+                pass
+            print(f"file={r.path}")
+            print(f"channels={r.channels} samples={r.count} keyframes={len(r.keyframes)}")
+            print(f"start={datetime.fromtimestamp(r.wall0)} duration={last_t:.3f}s")
+            return 0
+        col = r._col(int(argv[3]) if len(argv) > 3 else r.channels[0])
+        out = sys.stdout
+        out.write("t,v\n")
+        for t, raws in r.iter_samples():
+            raw = raws[col]
+            out.write(f"{t:.6f},{(raw * r.adc_to_v if raw >= 0 else 0.0):.4f}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv))
@@ -0,0 +1,60 @@
+# serve.py
+# -*- coding: utf-8 -*-
+"""
+正式環境啟動點：waitress（純 Python WSGI 伺服器，固定大小的 worker thread pool）。
+
+- 只開一個行程：硬體與遊戲 thread 只能有一份（game_logic.init() 以檔案鎖保證，重複啟動會直接失敗）
+- worker thread 數固定（BASKETBALL_WEB_THREADS，預設 16）；SSE 連線各佔一個，上限 BASKETBALL_SSE_MAX（預設 8），
+  其餘 thread 留給 /status、/start 等一般請求
+- keep-alive 由 waitress 處理（HTTP/1.1 預設保持連線），閒置連線 channel_timeout 秒後關閉
+
+用法：
+  pip3 install waitress
+  sudo python3 serve.py                    # 0.0.0.0:5000
+  BASKETBALL_WEB_PORT=8080 sudo python3 serve.py
+
+也可用 gunicorn（見 gunicorn.conf.py，固定 1 個 worker + gthread）。
+"""
+
+import os
+import sys
+
+WEB_HOST = os.environ.get("BASKETBALL_WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.environ.get("BASKETBALL_WEB_PORT", "5000"))
+WEB_THREADS = int(os.environ.get("BASKETBALL_WEB_THREADS", "16"))
+WEB_CONNECTION_LIMIT = int(os.environ.get("BASKETBALL_WEB_CONNECTIONS", "100"))
+WEB_CHANNEL_TIMEOUT_S = 120
+
+
+def main():
+    try:
+        from waitress import serve
+    except ImportError:
+        print("⚠️ 需要 waitress：pip3 install waitress")
+        return 1
+
+    from app import app
+    from game_logic import init
+
+    try:
+        stats = init()
+    except RuntimeError as e:
+        print("⚠️ init failed:", e)
+        return 2
+    print(f"[SERVE] waitress on {WEB_HOST}:{WEB_PORT} threads={WEB_THREADS} "
+          f"(init {stats['total_ms']:.1f} ms)")
+
+    serve(
+        app,
+        host=WEB_HOST,
+        port=WEB_PORT,
+        threads=WEB_THREADS,
+        connection_limit=WEB_CONNECTION_LIMIT,
+        channel_timeout=WEB_CHANNEL_TIMEOUT_S,
+        ident="basketball",
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
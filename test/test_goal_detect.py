@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_goal_detect.py
+離線檢查：goal_detect.detect_events()（NumPy 向量化）與 GoalHysteresis.step()（取樣 thread 用的逐樣本版）
+對同一段波形要抓出完全相同的進球事件。不需要硬體，波形用 hal.SimSensor 產生。
+
+用法（需要 numpy；沒有就略過）：
+  python3 test/test_goal_detect.py
+  python3 -m pytest test/test_goal_detect.py
+"""
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import hal
+from goal_detect import GoalHysteresis, detect_events
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# ====== 模擬波形 ======
+SAMPLE_RATE_HZ = 2000.0
+DURATION_S = 20.0
+PASS_RATE_HZ = 3.0        # 每秒平均幾次球通過（比實機密，holdoff 才會擋到東西）
+MISS_RATIO = 0.3          # 擦邊球（峰值不到 entry）的比例
+TIME_JITTER = 0.3         # 取樣時間抖動（週期的比例），模擬 sleep 不準
+
+# ====== 要比對的門檻組合 ======
+ENTRY_VS = (1.8, 2.0, 2.2)
+RELEASE_VS = (1.5, 1.7)
+HOLDOFF_MSS = (0, 150, 250)
+MIN_WIDTH_MSS = (0.0, 5.0, 8.0)
+
+
+def make_trace(seed: int = 1):
+    rng = random.Random(seed)
+    sensor = hal.SimSensor(rng, PASS_RATE_HZ, MISS_RATIO)
+    dt = 1.0 / SAMPLE_RATE_HZ
+    ts, vs = [], []
+    for i in range(int(DURATION_S * SAMPLE_RATE_HZ)):
+        t = i * dt + rng.uniform(0.0, TIME_JITTER * dt)
+        ts.append(t)
+        vs.append(sensor.voltage(t))
+    return ts, vs
+
+
+def step_events(ts, vs, entry_v, release_v, holdoff_ms, min_width_ms):
+    det = GoalHysteresis(entry_v, release_v, holdoff_ms, min_width_ms)
+    out = []
+    for t, v in zip(ts, vs):
+        ev = det.step(t, v)
+        if ev is not None:
+            out.append(ev)
+    return out
+
+
+@unittest.skipIf(numpy is None, "需要 numpy：pip3 install numpy")
+class DetectEventsMatchesStep(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ts, cls.vs = make_trace()
+
+    def test_same_events(self):
+        total = 0
+        for entry_v in ENTRY_VS:
+            for release_v in RELEASE_VS:
+                for holdoff_ms in HOLDOFF_MSS:
+                    for min_width_ms in MIN_WIDTH_MSS:
+                        combo = (entry_v, release_v, holdoff_ms, min_width_ms)
+                        with self.subTest(combo=combo):
+                            want = step_events(self.ts, self.vs, *combo)
+                            got = detect_events(self.ts, self.vs, *combo)
+                            self.assertEqual(len(got["t_entry"]), len(want))
+                            for k, (t_entry, t_release, peak_v, width_ms) in enumerate(want):
+                                self.assertEqual(float(got["t_entry"][k]), t_entry)
+                                self.assertEqual(float(got["t_release"][k]), t_release)
+                                self.assertEqual(float(got["peak_v"][k]), peak_v)
+                                self.assertAlmostEqual(float(got["width_ms"][k]), width_ms, places=9)
+                            total += len(want)
+        # 波形裡真的有進球（不是兩邊都 0 個也算通過）
+        self.assertGreater(total, 0)
+
+    def test_trace_ends_inside_event(self):
+        # 資料在事件中途結束：兩邊都不算這個事件
+        ts = [i / SAMPLE_RATE_HZ for i in range(100)]
+        vs = [1.0] * 50 + [2.5] * 50
+        self.assertEqual(step_events(ts, vs, 2.0, 1.7, 250, 5.0), [])
+        self.assertEqual(len(detect_events(ts, vs, 2.0, 1.7, 250, 5.0)["t_entry"]), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()